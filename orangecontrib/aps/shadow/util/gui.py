@@ -45,7 +45,7 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # #########################################################################
 
-import copy, numpy
+import numpy
 
 from PyQt5.QtWidgets import QWidget, QVBoxLayout
 from PyQt5.QtCore import Qt
@@ -54,7 +54,7 @@ from matplotlib import cm, rcParams
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 from matplotlib.collections import LineCollection
-from matplotlib.colors import colorConverter, ListedColormap
+from matplotlib.colors import colorConverter, ListedColormap, Normalize
 
 try:
     from mpl_toolkits.mplot3d import Axes3D  # mandatory to load 3D plot
@@ -64,8 +64,7 @@ except:
 from oasys.widgets import gui as oasysgui
 
 from orangecontrib.aps.util.gui import HistogramData, get_sigma
-
-from Shadow import Beam
+from orangecontrib.aps.shadow.util.histogram_util import PowerDensityCalculator
 
 
 class AbstractScanHistoWidget(QWidget):
@@ -90,7 +89,11 @@ class AbstractScanHistoWidget(QWidget):
                    show_reference=True,
                    add_labels=True,
                    has_colormap=True,
-                   colormap=cm.rainbow):
+                   colormap=cm.rainbow,
+                   redraw=True):
+        raise NotImplementedError("this methid is abstract")
+
+    def redraw(self):
         raise NotImplementedError("this methid is abstract")
 
 
@@ -120,8 +123,6 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
         self.setLayout(layout)
 
         self.xx = None
-        self.yy = None
-        self.zz = None
 
         self.title = ""
         self.xlabel = ""
@@ -131,6 +132,23 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
         self.__type=type
         self.__cc = lambda arg: colorConverter.to_rgba(arg, alpha=0.5)
 
+        self.__yy = None
+        self.__zz = None
+        self.__size = 0
+
+        self.reset_plot()
+
+    # scan data are stored in preallocated buffers (capacity doubled when full), and plotted incrementally: every
+    # redraw adds only the lines/surface strips of the histograms added after the previous one
+
+    @property
+    def yy(self):
+        return None if self.__size == 0 else self.__yy[:self.__size]
+
+    @property
+    def zz(self):
+        return None if self.__size == 0 else self.__zz[:self.__size]
+
     def clear(self):
         self.reset_plot()
         try:
@@ -140,8 +158,25 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
 
     def reset_plot(self):
         self.xx = None
-        self.yy = None
-        self.zz = None
+        self.__size = 0
+        self.__plotted_size = 0
+        self.__zmin = numpy.inf
+        self.__zmax = -numpy.inf
+
+        self.__has_colormap = True
+        self.__colormap = cm.rainbow
+        self.__transparent_colormap = None
+        self.__norm = None
+        self.__scalar_mappable = None
+        self.__colormapped_collections = []
+
+        if not self.colorbar is None:
+            try:
+                self.colorbar.remove()
+            except:
+                pass
+            self.colorbar = None
+
         self.axis.set_title("")
         self.axis.clear()
 
@@ -176,7 +211,8 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
                    show_reference=True,
                    add_labels=True,
                    has_colormap=True,
-                   colormap=cm.rainbow):
+                   colormap=cm.rainbow,
+                   redraw=True):
         factor=ShadowPlot.get_factor(col, conv=self.workspace_units_to_cm)
 
         if histo_index==0 and xrange is None:
@@ -212,117 +248,127 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
         self.set_xrange(bins)
         self.set_labels(title=title, xlabel=xtitle, ylabel=scan_variable_name, zlabel=ytitle)
 
-        self.add_histo(scan_variable_value, histogram, has_colormap, colormap, histo_index)
+        self.add_histo(scan_variable_value, histogram, has_colormap, colormap, histo_index, redraw)
 
         return HistogramData(histogram_stats, bins_stats, 0.0, xrange, fwhm, sigma, peak_intensity, integral_intensity)
 
-    def add_histo(self, scan_value, intensities, has_colormap, colormap, histo_index):
+    def add_histo(self, scan_value, intensities, has_colormap, colormap, histo_index, redraw=True):
         if self.xx is None: raise ValueError("Initialize X range first")
         if self.xx.shape != intensities.shape: raise ValueError("Given Histogram has a different binning")
 
-        if isinstance(scan_value, str):
-            self.yy = numpy.array([1]) if self.yy is None else numpy.append(self.yy, len(self.yy)+1)
-        else:
-            self.yy = numpy.array([scan_value]) if self.yy is None else numpy.append(self.yy, scan_value)
+        if self.__size == 0:
+            self.__yy = numpy.zeros(16)
+            self.__zz = numpy.zeros((16, len(self.xx)))
+            self.__has_colormap = has_colormap
+            self.__colormap = colormap
 
-        if self.zz is None:
-            self.zz = numpy.array([intensities])
-        else:
-            self.zz = numpy.append(self.zz, intensities)
+            transparent_colormap = colormap(numpy.arange(colormap.N))
+            transparent_colormap[:,-1] = 0.5*numpy.ones(colormap.N)
+            self.__transparent_colormap = ListedColormap(transparent_colormap)
+        elif self.__size == len(self.__yy):
+            self.__yy = numpy.concatenate((self.__yy, numpy.zeros(len(self.__yy))))
+            self.__zz = numpy.concatenate((self.__zz, numpy.zeros(self.__zz.shape)))
 
-        self.axis.clear()
+        self.__yy[self.__size] = self.__size + 1 if isinstance(scan_value, str) else scan_value
+        self.__zz[self.__size] = intensities
+        self.__size += 1
 
-        self.restore_labels()
+        if redraw: self.redraw()
 
-        x_to_plot, y_to_plot = numpy.meshgrid(self.xx, self.yy)
-        zz_to_plot = self.zz.reshape(len(self.yy), len(self.xx))
+    def redraw(self):
+        if self.__size == 0: return
 
-        if self.__type==Scan3DHistoWidget.PlotType.SURFACE:
-            if has_colormap:
-                self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
-                                       rstride=1, cstride=1, cmap=colormap, linewidth=0.5, antialiased=True)
-            else:
-                self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
-                                       rstride=1, cstride=1, color=self.__cc('black'), linewidth=0.5, antialiased=True)
+        if self.__plotted_size == 0:
+            self.axis.clear()
+            self.axis.mouse_init()
+
+        self.restore_labels()
 
-        elif self.__type==Scan3DHistoWidget.PlotType.LINES:
+        new_rows = range(self.__plotted_size, self.__size)
 
-            if has_colormap:
-                self.plot_lines_colormap(x_to_plot, y_to_plot, zz_to_plot, colormap, histo_index)
-            else:
-                self.plot_lines_black(x_to_plot, zz_to_plot)
+        self.__zmin = min(self.__zmin, numpy.min(self.__zz[self.__plotted_size:self.__size]))
+        self.__zmax = max(self.__zmax, numpy.max(self.__zz[self.__plotted_size:self.__size]))
 
-            xmin = numpy.min(self.xx)
-            xmax = numpy.max(self.xx)
-            ymin = numpy.min(self.yy)
-            ymax = numpy.max(self.yy)
-            zmin = numpy.min(self.zz)
-            zmax = numpy.max(self.zz)
+        if self.__has_colormap: self.__update_norm()
+
+        for row in new_rows:
+            if self.__type==Scan3DHistoWidget.PlotType.SURFACE:
+                if row > 0: self.add_surface_strip(row)
+            elif self.__type==Scan3DHistoWidget.PlotType.LINES:
+                if self.__has_colormap:
+                    self.add_lines_colormap(row)
+                else:
+                    self.add_lines_black(row)
 
-            self.axis.set_xlim(xmin,xmax)
-            self.axis.set_ylim(ymin,ymax)
-            self.axis.set_zlim(zmin,zmax)
+        self.__plotted_size = self.__size
 
-        self.axis.mouse_init()
+        self.axis.set_xlim(numpy.min(self.xx), numpy.max(self.xx))
+        if self.__size > 1: self.axis.set_ylim(numpy.min(self.yy), numpy.max(self.yy))
+        if self.__zmax > self.__zmin: self.axis.set_zlim(self.__zmin, self.__zmax)
 
         try:
-            self.plot_canvas.draw()
+            self.plot_canvas.draw_idle()
         except:
             pass
 
     def add_empty_curve(self, histo_data):
         pass
 
+    def add_lines_black(self, row):
+        self.axis.add_collection3d(LineCollection([numpy.array([self.xx, self.__zz[row]]).T], colors=[self.__cc('black')]),
+                                   zs=self.__yy[row], zdir='y')
 
-    def plot_lines_black(self, X, Z):
-        verts = []
-        for i in range(len(self.yy)):
-            verts.append(list(zip(X[i], Z[i, :])))
-
-        self.axis.add_collection3d(LineCollection(verts, colors=[self.__cc('black')]), zs=self.yy, zdir='y')
+    def add_lines_colormap(self, row):
+        # reshape the X,Z into pairs
+        points = numpy.array([self.xx, self.__zz[row]]).T.reshape(-1, 1, 2)
+        segments = numpy.concatenate([points[:-1], points[1:]], axis=1)
 
-    def plot_lines_colormap(self, X, Y, Z, colormap, histo_index):
+        lc = LineCollection(segments, cmap=self.__transparent_colormap, norm=self.__norm)
 
-        import matplotlib.pyplot as plt
+        # Set the values used for colormapping
+        lc.set_array((self.__zz[row, 1:] + self.__zz[row, :-1])/2)
+        lc.set_linewidth(2) # set linewidth a little larger to see properly the colormap variation
+        self.axis.add_collection3d(lc, zs=self.__yy[row],  zdir='y') # add line to axes
 
-        # Set normalization to the same values for all plots
-        norm = plt.Normalize(numpy.min(self.zz), numpy.max(self.zz))
+        self.__colormapped_collections.append(lc)
 
-        # Check sizes to loop always over the smallest dimension
-        n,m = Z.shape
+    def add_surface_strip(self, row):
+        x_to_plot, y_to_plot = numpy.meshgrid(self.xx, self.__yy[row-1:row+1])
+        zz_to_plot = self.__zz[row-1:row+1]
 
-        if n>m:
-            X=X.T; Y=Y.T; Z=Z.T
-            m,n = n,m
-
-        transparent_colormap = colormap(numpy.arange(colormap.N))
-        transparent_colormap[:,-1] = 0.5*numpy.ones(colormap.N)
-        transparent_colormap = ListedColormap(transparent_colormap)
+        if self.__has_colormap:
+            strip = self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
+                                           rstride=1, cstride=1, cmap=self.__colormap, norm=self.__norm, linewidth=0.5, antialiased=True)
 
+            self.__colormapped_collections.append(strip)
+        else:
+            self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
+                                   rstride=1, cstride=1, color=self.__cc('black'), linewidth=0.5, antialiased=True)
 
-        for j in range(n):
-            # reshape the X,Z into pairs
-            points = numpy.array([X[j,:], Z[j,:]]).T.reshape(-1, 1, 2)
-            segments = numpy.concatenate([points[:-1], points[1:]], axis=1)
-            lc = LineCollection(segments, cmap=transparent_colormap, norm=norm)
+    def __update_norm(self):
+        # the same normalization is shared by all the plots and by the colorbar: only its limits are changed
+        if self.__norm is None:
+            self.__norm = Normalize(self.__zmin, self.__zmax)
+            self.__scalar_mappable = cm.ScalarMappable(norm=self.__norm, cmap=self.__transparent_colormap)
+            self.__scalar_mappable.set_array([])
 
-            # Set the values used for colormapping
-            lc.set_array((Z[j,1:]+Z[j,:-1])/2)
-            lc.set_linewidth(2) # set linewidth a little larger to see properly the colormap variation
-            self.axis.add_collection3d(lc, zs=(Y[j,1:]+Y[j,:-1])/2,  zdir='y') # add line to axes
+            if self.__type==Scan3DHistoWidget.PlotType.LINES:
+                self.colorbar = self.figure.colorbar(self.__scalar_mappable, ax=self.axis)
+        elif self.__norm.vmin != self.__zmin or self.__norm.vmax != self.__zmax:
+            self.__norm.autoscale([self.__zmin, self.__zmax]) # a single notification to plots and colorbar
 
-        if histo_index==0:
-            self.colorbar = self.figure.colorbar(lc) # add colorbar, as the normalization is the same for all,
+            if not hasattr(self.__norm, "callbacks"): # matplotlib < 3.5: changes of the norm are not notified
+                for collection in self.__colormapped_collections: collection.changed()
 
-        self.colorbar.update_normal(lc)
-        self.colorbar.draw_all()
-        self.colorbar.update_bruteforce(lc)
+                if not self.colorbar is None: self.colorbar.update_normal(self.__scalar_mappable)
 
 class ScanHistoWidget(AbstractScanHistoWidget):
 
     def __init__(self, workspace_units_to_cm):
         super(ScanHistoWidget, self).__init__(workspace_units_to_cm)
 
+        self.__xlimits = None
+
         self.plot_canvas = oasysgui.plotWindow(parent=None,
                                                backend=None,
                                                resetzoom=True,
@@ -364,7 +410,8 @@ class ScanHistoWidget(AbstractScanHistoWidget):
                    show_reference=True,
                    add_labels=True,
                    has_colormap=True,
-                   colormap=cm.rainbow):
+                   colormap=cm.rainbow,
+                   redraw=True):
 
         factor=ShadowPlot.get_factor(col, conv=self.workspace_units_to_cm)
 
@@ -424,10 +471,10 @@ class ScanHistoWidget(AbstractScanHistoWidget):
         self.plot_canvas.setActiveCurveColor(color="#00008B")
 
         self.plot_canvas.setInteractiveMode('zoom', color='orange')
-        self.plot_canvas.resetZoom()
-        self.plot_canvas.replot()
 
-        self.plot_canvas.setGraphXLimits(xrange[0]*factor, xrange[1]*factor)
+        self.__xlimits = (xrange[0]*factor, xrange[1]*factor)
+
+        if redraw: self.redraw()
 
         self.plot_canvas.setActiveCurve(h_title)
 
@@ -441,6 +488,12 @@ class ScanHistoWidget(AbstractScanHistoWidget):
 
         return HistogramData(histogram_stats, bins_stats, offset, xrange, fwhm, sigma, peak_intensity, integral_intensity)
 
+    def redraw(self):
+        self.plot_canvas.resetZoom()
+        self.plot_canvas.replot()
+
+        if not self.__xlimits is None: self.plot_canvas.setGraphXLimits(*self.__xlimits)
+
     def add_empty_curve(self, histo_data):
         self.plot_canvas.addCurve(numpy.array([histo_data.get_centroid()]),
                                   numpy.zeros(1),
@@ -456,7 +509,7 @@ from silx.gui.plot import Plot2D
 from orangecontrib.shadow.util.shadow_util import ShadowPlot
 
 class PowerPlotXYWidget(QWidget):
-    
+
     def __init__(self, parent=None):
         pass
     
@@ -468,10 +521,13 @@ class PowerPlotXYWidget(QWidget):
 
         self.setLayout(QVBoxLayout())
 
-    def manage_empty_beam(self, ticket_to_add, nbins, xrange, yrange, var_x, var_y, cumulated_total_power, energy_min, energy_max, energy_step, show_image, to_mm):
+    def manage_empty_beam(self, ticket_to_add, nbins, xrange, yrange, var_x, var_y, cumulated_total_power, energy_min, energy_max, energy_step, show_image, to_mm,
+                          accumulator=None, records=None, incident_power=0.0):
+        if records is None: records = {}
+
         if not ticket_to_add is None:
-            ticket      = copy.deepcopy(ticket_to_add)
-            last_ticket = copy.deepcopy(ticket_to_add)
+            ticket      = ticket_to_add.copy() # the cumulated histogram is never modified in place
+            last_ticket = ticket_to_add.copy()
         else:
             ticket = {}
             ticket["histogram"] = numpy.zeros((nbins, nbins))
@@ -485,6 +541,16 @@ class PowerPlotXYWidget(QWidget):
             else:
                 raise ValueError("Beam is empty and no range has been specified: Calculation is impossible")
 
+        # the step is recorded with a zero power density: undo always removes the last step
+        if not accumulator is None:
+            accumulator.add(numpy.zeros((nbins, nbins) if accumulator.shape is None else accumulator.shape),
+                            intensity=0.0,
+                            nrays=0,
+                            good_rays=0,
+                            power_plot=0.0,
+                            incident_power=incident_power,
+                            **records)
+
         self.plot_power_density_ticket(ticket, var_x, var_y, cumulated_total_power, energy_min, energy_max, energy_step, show_image)
 
         if not ticket_to_add is None:
@@ -493,7 +559,7 @@ class PowerPlotXYWidget(QWidget):
             return ticket, None
 
     def plot_power_density(self, shadow_beam, var_x, var_y, total_power, cumulated_total_power, energy_min, energy_max, energy_step,
-                           nbins=100, xrange=None, yrange=None, nolost=1, ticket_to_add=None, to_mm=1.0, show_image=True,
+                           nbins=100, xrange=None, yrange=None, nolost=1, ticket_to_add=None, accumulator=None, records=None, to_mm=1.0, show_image=True,
                            kind_of_calculation=0,
                            replace_poor_statistic=0,
                            good_rays_limit=100,
@@ -501,7 +567,9 @@ class PowerPlotXYWidget(QWidget):
                            center_y = 0.0,
                            sigma_x=1.0,
                            sigma_y=1.0,
-                           gamma=1.0):
+                           gamma=1.0,
+                           eta=0.5):
+        if records is None: records = {}
 
         n_rays = len(shadow_beam._beam.rays[:, 0]) # lost and good!
 
@@ -517,61 +585,37 @@ class PowerPlotXYWidget(QWidget):
                                           energy_max,
                                           energy_step,
                                           show_image,
-                                          to_mm)
+                                          to_mm,
+                                          accumulator=accumulator,
+                                          records=records)
 
         history_item = shadow_beam.getOEHistory(oe_number=shadow_beam._oe_number)
 
-        previous_beam = None
+        incident_rays = None if history_item is None or history_item._input_beam is None else history_item._input_beam._beam.rays
 
         if shadow_beam.scanned_variable_data and shadow_beam.scanned_variable_data.has_additional_parameter("incident_power"):
-            self.cumulated_previous_power_plot += shadow_beam.scanned_variable_data.get_additional_parameter("incident_power")
-        elif not history_item is None and not history_item._input_beam is None:
-            previous_ticket = history_item._input_beam._beam.histo2(var_x, var_y, nbins=nbins, xrange=None, yrange=None, nolost=1, ref=23)
-            previous_ticket['histogram'] *= (total_power/n_rays) # power
-
-            self.cumulated_previous_power_plot += previous_ticket['histogram'].sum()
-
-        if nolost>1: # must be calculating only the rays the become lost in the last object
-            current_beam = shadow_beam
-
-            if history_item is None or history_item._input_beam is None:
-                beam = shadow_beam._beam
-            else:
-                previous_beam = previous_beam if previous_beam else history_item._input_beam.duplicate(history=False)
-
-                if nolost==2:
-                    lost = numpy.where(current_beam._beam.rays[:, 9] != 1)
-
-                    current_lost_rays = current_beam._beam.rays[lost]
-                    lost_rays_in_previous = previous_beam._beam.rays[lost]
-
-                    beam = Beam()
-                    beam.rays = current_lost_rays[numpy.where(lost_rays_in_previous[:, 9] == 1)]# lost rays that were good after the previous OE
-                else:
-                    incident_rays = previous_beam._beam.rays
-                    transmitted_rays = current_beam._beam.rays
-
-                    incident_intensity = incident_rays[:, 6]**2  + incident_rays[:, 7]**2  + incident_rays[:, 8]**2 +\
-                                         incident_rays[:, 15]**2 + incident_rays[:, 16]**2 + incident_rays[:, 17]**2
-                    transmitted_intensity = transmitted_rays[:, 6]**2  + transmitted_rays[:, 7]**2  + transmitted_rays[:, 8]**2 +\
-                                            transmitted_rays[:, 15]**2 + transmitted_rays[:, 16]**2 + transmitted_rays[:, 17]**2
-
-                    electric_field = numpy.sqrt(incident_intensity - transmitted_intensity)
-                    electric_field[numpy.where(electric_field == numpy.nan)] = 0.0
-
-                    beam = Beam()
-                    beam.rays = copy.deepcopy(shadow_beam._beam.rays)
-
-                    beam.rays[:, 6]  = electric_field
-                    beam.rays[:, 7]  = 0.0
-                    beam.rays[:, 8]  = 0.0
-                    beam.rays[:, 15] = 0.0
-                    beam.rays[:, 16] = 0.0
-                    beam.rays[:, 17] = 0.0
+            incident_power = shadow_beam.scanned_variable_data.get_additional_parameter("incident_power")
         else:
-            beam = shadow_beam._beam
-
-        if len(beam.rays) == 0:
+            incident_power = None
+
+        ticket, power_plot, incident_power = PowerDensityCalculator.calculate_power_density(shadow_beam._beam.rays, var_x, var_y, total_power,
+                                                                                           nbins=nbins, xrange=xrange, yrange=yrange, nolost=nolost,
+                                                                                           incident_rays=incident_rays,
+                                                                                           incident_power=incident_power,
+                                                                                           to_mm=to_mm,
+                                                                                           kind_of_calculation=kind_of_calculation,
+                                                                                           replace_poor_statistic=replace_poor_statistic,
+                                                                                           good_rays_limit=good_rays_limit,
+                                                                                           center_x=center_x,
+                                                                                           center_y=center_y,
+                                                                                           sigma_x=sigma_x,
+                                                                                           sigma_y=sigma_y,
+                                                                                           gamma=gamma,
+                                                                                           eta=eta)
+
+        self.cumulated_previous_power_plot += incident_power
+
+        if ticket is None:
             return self.manage_empty_beam(ticket_to_add,
                                           nbins,
                                           xrange,
@@ -583,41 +627,36 @@ class PowerPlotXYWidget(QWidget):
                                           energy_max,
                                           energy_step,
                                           show_image,
-                                          to_mm)
-
-        ticket = beam.histo2(var_x, var_y, nbins=nbins, xrange=xrange, yrange=yrange, nolost=1 if nolost != 2 else 2, ref=23)
-
-        ticket['bin_h_center'] *= to_mm
-        ticket['bin_v_center'] *= to_mm
-
-        bin_h_size = (ticket['bin_h_center'][1] - ticket['bin_h_center'][0])
-        bin_v_size = (ticket['bin_v_center'][1] - ticket['bin_v_center'][0])
-
-        if kind_of_calculation > 0:
-            if replace_poor_statistic == 0 or (replace_poor_statistic==1 and ticket['good_rays'] < good_rays_limit):
-                if kind_of_calculation == 1: # FLAT
-                    PowerPlotXYWidget.get_flat_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'])
-                elif kind_of_calculation == 2: # GAUSSIAN
-                    PowerPlotXYWidget.get_gaussian_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
-                                                       sigma_x, sigma_y, center_x, center_y)
-                elif kind_of_calculation == 3: #LORENTZIAN
-                    PowerPlotXYWidget.get_lorentzian_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
-                                                        gamma, center_x, center_y)
-                # rinormalization
-                ticket['histogram'] *= ticket['intensity']
-
-        ticket['histogram'][numpy.where(ticket['histogram'] < 1e-9)] = 0.0
-        ticket['histogram'] *= (total_power / n_rays)  # power
-
-        if ticket_to_add == None:
-            self.cumulated_power_plot = ticket['histogram'].sum()
+                                          to_mm,
+                                          accumulator=accumulator,
+                                          records=records,
+                                          incident_power=incident_power)
+
+        if ticket_to_add is None:
+            self.cumulated_power_plot = power_plot
         else:
-            self.cumulated_power_plot += ticket['histogram'].sum()
+            self.cumulated_power_plot += power_plot
 
-        ticket['histogram'] /= (bin_h_size * bin_v_size)  # power density
+        last_ticket = None
 
-        if not ticket_to_add is None:
-            last_ticket = copy.deepcopy(ticket)
+        if not accumulator is None:
+            last_ticket = ticket.copy()
+
+            accumulator.add(ticket['histogram'],
+                            intensity=ticket['intensity'],
+                            nrays=ticket['nrays'],
+                            good_rays=ticket['good_rays'],
+                            power_plot=power_plot,
+                            incident_power=incident_power,
+                            **records)
+
+            ticket['histogram'] = accumulator.get_power_density().copy() # the accumulator buffers are reused by the next step
+            ticket['intensity'] = accumulator.get_total("intensity")
+            ticket['nrays']     = int(accumulator.get_total("nrays"))
+            ticket['good_rays'] = int(accumulator.get_total("good_rays"))
+        elif not ticket_to_add is None:
+            last_ticket = ticket.copy()
+            last_ticket['histogram'] = ticket['histogram'].copy()
 
             ticket['histogram'] += ticket_to_add['histogram']
             ticket['intensity'] += ticket_to_add['intensity']
@@ -626,12 +665,15 @@ class PowerPlotXYWidget(QWidget):
 
         self.plot_power_density_ticket(ticket, var_x, var_y, cumulated_total_power, energy_min, energy_max, energy_step, show_image)
 
-        if not ticket_to_add is None:
-            return ticket, last_ticket
-        else:
-            return ticket, None
+        return ticket, last_ticket
 
     def plot_power_density_ticket(self, ticket, var_x, var_y, cumulated_total_power, energy_min, energy_max, energy_step, show_image=True):
+        if not isinstance(var_x, str): var_x = self.get_label(var_x)
+        if not isinstance(var_y, str): var_y = self.get_label(var_y)
+
+        ticket['h_label'] = var_x
+        ticket['v_label'] = var_y
+
         if show_image:
             histogram = ticket['histogram']
 
@@ -646,18 +688,10 @@ class PowerPlotXYWidget(QWidget):
             xx = ticket['bin_h_center']
             yy = ticket['bin_v_center']
 
-            if not isinstance(var_x, str): var_x = self.get_label(var_x)
-            if not isinstance(var_y, str): var_y = self.get_label(var_y)
-
-            ticket['h_label'] = var_x
-            ticket['v_label'] = var_y
-
             self.plot_data2D(histogram, xx, yy, title, var_x, var_y)
 
     def get_label(self, var):
-        if var == 1: return "X [mm]"
-        elif var == 2: return "Y [mm]"
-        elif var == 3: return "Z [mm]"
+        return PowerDensityCalculator.get_label(var)
 
     def plot_data2D(self, data2D, dataX, dataY, title="", xtitle="", ytitle=""):
         if self.plot_canvas is None:
@@ -706,30 +740,6 @@ class PowerPlotXYWidget(QWidget):
             self.cumulated_power_plot = 0.0
             self.cumulated_previous_power_plot = 0.0
 
-    @classmethod
-    def get_flat_2d(cls, z, x, y):
-        for i in range(len(x)):
-            z[i, :] = 1
-
-        norm = numpy.sum(z)
-        z[:,:] /= norm
-
-    @classmethod
-    def get_gaussian_2d(cls, z, x, y, sigma_x, sigma_y, center_x=0.0, center_y=0.0):
-        for i in range(len(x)):
-            z[i, :] = numpy.exp(-1*(0.5*((x[i]-center_x)/sigma_x)**2 + 0.5*((y-center_y)/sigma_y)**2))
-
-        norm = numpy.sum(z)
-        z[:,:] /= norm
-
-    @classmethod
-    def get_lorentzian_2d(cls, z, x, y, gamma, center_x=0.0, center_y=0.0):
-        for i in range(len(x)):
-            z[i, :] = gamma/(((x[i]-center_x)**2 + (y-center_y)**2 + gamma**2))
-
-        norm = numpy.sum(z)
-        z[:,:] /= norm
-
 
 if __name__=="__main__":
 
@@ -739,9 +749,9 @@ if __name__=="__main__":
     x, y = numpy.meshgrid(x2, y2)
     z = numpy.ones((100, 100))
 
-    #PowerPlotXYWidget.get_gaussian_2d(z, x2, y2, 1e-5, 2e-5)
-    PowerPlotXYWidget.get_lorentzian_2d(z, x2, y2, 1.5e-6)
-    #z = PowerPlotXYWidget.get_flat_2d(x2, y2)
+    #PowerDensityCalculator.get_gaussian_2d(z, x2, y2, 1e-5, 2e-5)
+    PowerDensityCalculator.get_lorentzian_2d(z, x2, y2, 1.5e-6)
+    #z = PowerDensityCalculator.get_flat_2d(x2, y2)
 
     from matplotlib import pyplot as plt
 
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Copyright (c) 2018, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+import time, threading, queue
+import numpy
+
+from orangecontrib.shadow.util.shadow_util import ShadowPlot
+
+class PowerDensityHdf5File(ShadowPlot.PlotXYHdf5File):
+    """
+    autosave file of the power density: the cumulated plot is kept in the standard Plot XY layout
+    (readable by PowerPlotXY), while the partial plots of every energy step are appended to one
+    chunked and compressed dataset (step, h, v) in the group "partial_results"
+
+    the file is flushed every flush_steps steps or every flush_seconds seconds (0 = not used), and
+    when closed
+    """
+    COMPRESSIONS = [None, "gzip", "lzf"]
+
+    def __init__(self, file_name, mode="w", compression="lzf", flush_steps=1, flush_seconds=0.0):
+        super().__init__(file_name, mode=mode)
+
+        if not compression in PowerDensityHdf5File.COMPRESSIONS: raise ValueError("Compression not recognized: " + str(compression))
+
+        self.compression = compression
+        self.flush_steps = flush_steps
+        self.flush_seconds = flush_seconds
+
+        self.__steps_to_flush = 0
+        self.__last_flush_time = time.time()
+
+    def add_partial_plot_xy(self, ticket, energy_min, energy_max, dataset_name="power_density"):
+        histogram = numpy.asarray(ticket["histogram"], dtype=numpy.float64)
+
+        partial_results = self.require_group("partial_results")
+
+        if not dataset_name in partial_results:
+            nh, nv = histogram.shape
+
+            partial_results.create_dataset(dataset_name,
+                                           shape=(0, nh, nv),
+                                           maxshape=(None, nh, nv),
+                                           chunks=(1, nh, nv),
+                                           dtype=numpy.float64,
+                                           compression=self.compression,
+                                           compression_opts=4 if self.compression == "gzip" else None,
+                                           shuffle=not self.compression is None)
+            partial_results.create_dataset("energy_min", shape=(0,), maxshape=(None,), chunks=(1024,), dtype=numpy.float64)
+            partial_results.create_dataset("energy_max", shape=(0,), maxshape=(None,), chunks=(1024,), dtype=numpy.float64)
+
+            partial_results[dataset_name].attrs["x_label"] = ticket["h_label"] if "h_label" in ticket else ""
+            partial_results[dataset_name].attrs["y_label"] = ticket["v_label"] if "v_label" in ticket else ""
+
+        stack = partial_results[dataset_name]
+
+        if stack.shape[1:] != histogram.shape:
+            raise ValueError("Partial plot with shape " + str(histogram.shape) + " cannot be appended to plots with shape " + str(stack.shape[1:]))
+
+        index = stack.shape[0]
+
+        stack.resize(index + 1, axis=0)
+        stack[index] = histogram
+
+        for name, value in zip(["energy_min", "energy_max"], [energy_min, energy_max]):
+            partial_results[name].resize(index + 1, axis=0)
+            partial_results[name][index] = value
+
+    def get_partial_plots_xy(self, dataset_name="power_density"):
+        partial_results = self["partial_results"]
+
+        return partial_results[dataset_name][()], partial_results["energy_min"][()], partial_results["energy_max"][()]
+
+    def step_completed(self):
+        self.__steps_to_flush += 1
+
+        if (self.flush_steps > 0 and self.__steps_to_flush >= self.flush_steps) or \
+           (self.flush_seconds > 0 and time.time() - self.__last_flush_time >= self.flush_seconds):
+            self.flush()
+
+    def flush(self):
+        super().flush()
+
+        self.__steps_to_flush = 0
+        self.__last_flush_time = time.time()
+
+    def close(self):
+        if self: self.flush()
+
+        super().close()
+
+class PowerDensityHdf5Writer(object):
+    """
+    writes the autosave file in a dedicated thread: the steps are put in a bounded queue (the
+    caller blocks when the writer is max_queue_size steps behind), errors of the writer are raised
+    back to the caller at the next step or at close, close drains the queue before closing the file
+
+    h5py holds the GIL while compressing and writing: the thread hides the latency of the file
+    (flushes, slow disks), not the compression, hence lzf by default (gzip is much slower)
+    """
+    def __init__(self, file_name, compression="lzf", flush_steps=1, flush_seconds=0.0, max_queue_size=8):
+        self.__file = PowerDensityHdf5File(file_name, compression=compression, flush_steps=flush_steps, flush_seconds=flush_seconds)
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__error = None
+
+        self.__thread = threading.Thread(target=self.__run, name="PowerDensityHdf5Writer", daemon=True)
+        self.__thread.start()
+
+    @property
+    def filename(self):
+        return self.__file.filename
+
+    def write_step(self, ticket, partial_ticket=None, energy_min=0.0, energy_max=0.0, dataset_name="power_density"):
+        self.check_error()
+
+        # tickets are accumulated in place by the plot: the writer must own its data
+        self.__queue.put((self.__copy(ticket),
+                          None if partial_ticket is None else self.__copy(partial_ticket),
+                          energy_min,
+                          energy_max,
+                          dataset_name))
+
+    def check_error(self):
+        if not self.__error is None:
+            error, self.__error = self.__error, None
+
+            raise error
+
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+
+        self.__file.close()
+
+        self.check_error()
+
+    def __run(self):
+        while True:
+            step = self.__queue.get()
+
+            if step is None: break
+            if not self.__error is None: continue # the file is in an unknown state: the remaining steps are discarded
+
+            ticket, partial_ticket, energy_min, energy_max, dataset_name = step
+
+            try:
+                self.__file.write_coordinates(ticket)
+                self.__file.add_plot_xy(ticket, dataset_name=dataset_name)
+
+                if not partial_ticket is None:
+                    self.__file.add_partial_plot_xy(partial_ticket, energy_min=energy_min, energy_max=energy_max, dataset_name=dataset_name)
+
+                self.__file.step_completed()
+            except Exception as exception:
+                self.__error = exception
+
+    @classmethod
+    def __copy(cls, ticket):
+        return {key : value.copy() if isinstance(value, numpy.ndarray) else value for key, value in ticket.items()}
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Copyright (c) 2018, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+import numpy
+from collections import OrderedDict
+
+INTENSITY_COLUMNS = [6, 7, 8, 15, 16, 17] # Es and Ep components: intensity is the sum of their squares (Shadow column 23)
+
+CHUNK_SIZE = 65536
+
+def get_intensity(rays, out=None, scratch=None):
+    intensity = numpy.zeros(len(rays)) if out is None else out
+    scratch   = numpy.empty(len(rays)) if scratch is None else scratch
+
+    intensity[:] = 0.0
+
+    for column in INTENSITY_COLUMNS:
+        numpy.square(rays[:, column], out=scratch)
+        intensity += scratch
+
+    return intensity
+
+def get_absorbed_intensity(rays, incident_rays, out=None, chunk_size=CHUNK_SIZE):
+    """
+    incident minus transmitted intensity of every ray (negative or undefined values set to 0), computed in
+    chunks of rays with preallocated buffers: the only full-size array is the result
+    """
+    if len(incident_rays) != len(rays): raise ValueError("Incident and transmitted beams have a different number of rays")
+
+    absorbed_intensity = numpy.empty(len(rays)) if out is None else out
+
+    transmitted_intensity = numpy.empty(min(chunk_size, len(rays)))
+    scratch               = numpy.empty(min(chunk_size, len(rays)))
+
+    for start in range(0, len(rays), chunk_size):
+        stop = min(start + chunk_size, len(rays))
+        size = stop - start
+
+        get_intensity(incident_rays[start:stop], out=absorbed_intensity[start:stop], scratch=scratch[:size])
+        get_intensity(rays[start:stop], out=transmitted_intensity[:size], scratch=scratch[:size])
+
+        absorbed_intensity[start:stop] -= transmitted_intensity[:size]
+        numpy.fmax(absorbed_intensity[start:stop], 0.0, out=absorbed_intensity[start:stop]) # NaN -> 0
+
+    return absorbed_intensity
+
+def set_absorbed_intensity(rays, incident_rays, chunk_size=CHUNK_SIZE):
+    """
+    puts the absorbed intensity in the ray table (modified in place), as the square of Es(x) (the other components to 0),
+    working in chunks and writing only the electric field columns
+    """
+    if len(incident_rays) != len(rays): raise ValueError("Incident and transmitted beams have a different number of rays")
+
+    absorbed_intensity = numpy.empty(min(chunk_size, len(rays)))
+
+    for start in range(0, len(rays), chunk_size):
+        stop = min(start + chunk_size, len(rays))
+        size = stop - start
+
+        get_absorbed_intensity(rays[start:stop], incident_rays[start:stop], out=absorbed_intensity[:size], chunk_size=chunk_size)
+
+        numpy.sqrt(absorbed_intensity[:size], out=rays[start:stop, 6])
+        rays[start:stop, [7, 8, 15, 16, 17]] = 0.0
+
+def get_good_range(values):
+    # same as Shadow.Beam.get_good_range
+    if values.size == 0: return [-1.0, 1.0]
+
+    range_min = values.min()
+    range_max = values.max()
+
+    range_min = range_min*0.95 if range_min > 0.0 else range_min*1.05
+    range_max = range_max*0.95 if range_max < 0.0 else range_max*1.05
+
+    if range_min == range_max:
+        if range_min == 0.0: return [-1.0, 1.0]
+        else: return [range_min*0.95, range_max*1.05]
+
+    return [range_min, range_max]
+
+def get_bin_indexes(values, edges):
+    # same binning as numpy.histogram2d: last bin closed on the right, -1 for values out of range
+    nbins = len(edges) - 1
+
+    indexes = numpy.searchsorted(edges, values, side="right") - 1
+    indexes[values == edges[-1]] = nbins - 1
+    indexes[(indexes < 0) | (indexes >= nbins)] = -1
+
+    return indexes
+
+def power_histograms(rays, col_h, col_v, nbins=100, xrange=None, yrange=None, incident_rays=None, nolost=1):
+    """
+    fused computation of all the power histograms of an optical element, in place of a Shadow.Beam.histo2 for each of them
+
+    the bin index of every ray is computed once, on the grid of the selected kind of power (nolost: 1 transmitted = good rays,
+    2 lost = rays lost in this element, 3 absorbed = intensity lost by the rays still good), and all the histograms are
+    accumulated on it with numpy.bincount, without copying the ray table:
+    - histogram_transmitted: intensity of the good rays
+    - histogram_lost: intensity of the rays lost in this element (all the lost rays, without incident beam)
+    - histogram_absorbed: incident minus transmitted intensity of the good rays (None without incident beam)
+    - histogram_incident: intensity of the good incident rays, at their own positions (None without incident beam)
+
+    returns a ticket as the one of histo2 for the selected kind of power, with the other histograms and the total intensity
+    of the good incident rays (incident_intensity) added
+    """
+    if not incident_rays is None and len(incident_rays) != len(rays):
+        raise ValueError("Incident and transmitted beams have a different number of rays")
+
+    good = rays[:, 9] == 1
+    intensity = get_intensity(rays)
+
+    if incident_rays is None:
+        lost = ~good
+        incident_intensity = None
+    else:
+        incident_good = incident_rays[:, 9] == 1
+        lost = ~good & incident_good # lost rays that were good after the previous OE
+        incident_intensity = get_intensity(incident_rays)
+
+    selection = lost if nolost == 2 else good
+
+    x = rays[:, col_h-1]
+    y = rays[:, col_v-1]
+
+    if xrange is None: xrange = get_good_range(x[selection])
+    if yrange is None: yrange = get_good_range(y[selection])
+
+    bin_h_edges = numpy.linspace(xrange[0], xrange[1], nbins + 1)
+    bin_v_edges = numpy.linspace(yrange[0], yrange[1], nbins + 1)
+
+    def get_flat_indexes(x, y):
+        index_h = get_bin_indexes(x, bin_h_edges)
+        index_v = get_bin_indexes(y, bin_v_edges)
+
+        return numpy.where((index_h >= 0) & (index_v >= 0), index_h*nbins + index_v, -1)
+
+    def get_histogram(flat_indexes, weights, mask):
+        mask = mask & (flat_indexes >= 0)
+
+        # bincount returns integers when no ray is selected: the histograms are always float
+        return numpy.bincount(flat_indexes[mask], weights=weights[mask], minlength=nbins*nbins).astype(numpy.float64, copy=False).reshape(nbins, nbins)
+
+    flat_indexes = get_flat_indexes(x, y)
+
+    ticket = {}
+    ticket["histogram_transmitted"] = get_histogram(flat_indexes, intensity, good)
+    ticket["histogram_lost"]        = get_histogram(flat_indexes, intensity, lost)
+
+    if incident_rays is None:
+        ticket["histogram_absorbed"] = None
+        ticket["histogram_incident"] = None
+        ticket["incident_intensity"] = None
+    else:
+        absorbed_intensity = get_absorbed_intensity(rays, incident_rays)
+
+        ticket["histogram_absorbed"] = get_histogram(flat_indexes, absorbed_intensity, good)
+        ticket["histogram_incident"] = get_histogram(get_flat_indexes(incident_rays[:, col_h-1], incident_rays[:, col_v-1]), incident_intensity, incident_good)
+        ticket["incident_intensity"] = incident_intensity[incident_good].sum()
+
+    if nolost == 2:
+        histogram = ticket["histogram_lost"].copy()
+        ticket["intensity"] = intensity[lost].sum()
+        ticket["nrays"]     = int(numpy.count_nonzero(lost))
+        ticket["good_rays"] = 0
+    else:
+        if nolost == 3 and not incident_rays is None:
+            histogram = ticket["histogram_absorbed"].copy()
+            ticket["intensity"] = absorbed_intensity[good].sum()
+        else:
+            histogram = ticket["histogram_transmitted"].copy()
+            ticket["intensity"] = intensity[good].sum()
+
+        ticket["nrays"]     = len(rays)
+        ticket["good_rays"] = int(numpy.count_nonzero(good))
+
+    ticket["xrange"]       = xrange
+    ticket["yrange"]       = yrange
+    ticket["bin_h_edges"]  = bin_h_edges
+    ticket["bin_v_edges"]  = bin_v_edges
+    ticket["bin_h_left"]   = bin_h_edges[0:-1]
+    ticket["bin_h_right"]  = bin_h_edges[1:]
+    ticket["bin_v_left"]   = bin_v_edges[0:-1]
+    ticket["bin_v_right"]  = bin_v_edges[1:]
+    ticket["bin_h_center"] = bin_h_edges[0:-1] + 0.5*(bin_h_edges[1] - bin_h_edges[0])
+    ticket["bin_v_center"] = bin_v_edges[0:-1] + 0.5*(bin_v_edges[1] - bin_v_edges[0])
+    ticket["histogram"]    = histogram
+    ticket["histogram_h"]  = histogram.sum(axis=1)
+    ticket["histogram_v"]  = histogram.sum(axis=0)
+
+    return ticket
+
+class PowerDensityCalculator(object):
+    """
+    power density of one energy step, from the rays at the final element: power histogram of the rays (or kernel
+    fitted on it) normalized to the total power of the step. No Qt: used by the widgets and by headless scans
+    """
+    KERNEL_CACHE_SIZE = 16
+
+    __kernel_cache = OrderedDict()
+
+    @classmethod
+    def get_label(cls, var):
+        if var == 1: return "X [mm]"
+        elif var == 2: return "Y [mm]"
+        elif var == 3: return "Z [mm]"
+
+    @classmethod
+    def calculate_power_density(cls, rays, var_x, var_y, total_power, nbins=100, xrange=None, yrange=None, nolost=1,
+                                incident_rays=None, incident_power=None, to_mm=1.0,
+                                kind_of_calculation=0,
+                                replace_poor_statistic=0,
+                                good_rays_limit=100,
+                                center_x = 0.0,
+                                center_y = 0.0,
+                                sigma_x=1.0,
+                                sigma_y=1.0,
+                                gamma=1.0,
+                                eta=0.5):
+        """
+        returns the ticket with the power density (None if there are no rays to histogram), the plotted power and
+        the incident power (computed from the incident rays, if not given)
+        """
+        n_rays = len(rays) # lost and good!
+
+        if n_rays == 0: return None, 0.0, 0.0 if incident_power is None else incident_power
+
+        # transmitted, lost (in the last object) and absorbed power in a single pass, without copying the rays
+        ticket = power_histograms(rays, var_x, var_y, nbins=nbins, xrange=xrange, yrange=yrange,
+                                  incident_rays=incident_rays, nolost=nolost)
+
+        if incident_power is None:
+            if not incident_rays is None:
+                incident_power = ticket['incident_intensity']*(total_power/n_rays)
+            else:
+                incident_power = 0.0
+
+        if ticket['nrays'] == 0: return None, 0.0, incident_power
+
+        ticket['bin_h_center'] *= to_mm
+        ticket['bin_v_center'] *= to_mm
+
+        bin_h_size = (ticket['bin_h_center'][1] - ticket['bin_h_center'][0])
+        bin_v_size = (ticket['bin_v_center'][1] - ticket['bin_v_center'][0])
+
+        if kind_of_calculation == 4 and not 0.0 <= eta <= 1.0: raise ValueError("Gaussian Fraction should be between 0 and 1")
+
+        # beam moments of a zero histogram (all rays lost or out of the plot range): the histogram stays zero
+        if kind_of_calculation > 0 and (kind_of_calculation < 4 or ticket['histogram'].sum() > 0.0):
+            if replace_poor_statistic == 0 or (replace_poor_statistic==1 and ticket['good_rays'] < good_rays_limit):
+                if kind_of_calculation == 1: # FLAT
+                    cls.get_flat_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'])
+                elif kind_of_calculation == 2: # GAUSSIAN
+                    cls.get_gaussian_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
+                                        sigma_x, sigma_y, center_x, center_y)
+                elif kind_of_calculation == 3: #LORENTZIAN
+                    cls.get_lorentzian_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
+                                          gamma, center_x, center_y)
+                elif kind_of_calculation in [4, 5]: # FROM BEAM MOMENTS
+                    beam_center_x, beam_center_y, covariance = cls.get_beam_moments(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'])
+
+                    # variance of the binning: the kernel cannot be narrower than one bin (e.g. with very few rays)
+                    covariance[0, 0] += bin_h_size**2/12
+                    covariance[1, 1] += bin_v_size**2/12
+
+                    if kind_of_calculation == 4: # PSEUDO-VOIGT
+                        cls.get_pseudo_voigt_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
+                                                numpy.sqrt(covariance[0, 0]), numpy.sqrt(covariance[1, 1]), eta, beam_center_x, beam_center_y)
+                    else: # ROTATED GAUSSIAN
+                        cls.get_rotated_gaussian_2d(ticket['histogram'], ticket['bin_h_center'], ticket['bin_v_center'],
+                                                    covariance, beam_center_x, beam_center_y)
+                # rinormalization
+                ticket['histogram'] *= ticket['intensity']
+
+        ticket['histogram'][numpy.where(ticket['histogram'] < 1e-9)] = 0.0
+        ticket['histogram'] *= (total_power / n_rays)  # power
+
+        power_plot = ticket['histogram'].sum()
+
+        ticket['histogram'] /= (bin_h_size * bin_v_size)  # power density
+
+        ticket['h_label'] = cls.get_label(var_x)
+        ticket['v_label'] = cls.get_label(var_y)
+
+        return ticket, power_plot, incident_power
+
+    # kernels are normalized to 1, and cached: during a cumulative scan the bin grid does not change
+
+    @classmethod
+    def get_flat_2d(cls, z, x, y):
+        z[:, :] = cls.__get_kernel(cls.__flat_kernel, x, y)
+
+    @classmethod
+    def get_gaussian_2d(cls, z, x, y, sigma_x, sigma_y, center_x=0.0, center_y=0.0):
+        z[:, :] = cls.__get_kernel(cls.__gaussian_kernel, x, y, sigma_x, sigma_y, center_x, center_y)
+
+    @classmethod
+    def get_lorentzian_2d(cls, z, x, y, gamma, center_x=0.0, center_y=0.0):
+        z[:, :] = cls.__get_kernel(cls.__lorentzian_kernel, x, y, gamma, center_x, center_y)
+
+    @classmethod
+    def get_pseudo_voigt_2d(cls, z, x, y, sigma_x, sigma_y, eta=0.5, center_x=0.0, center_y=0.0):
+        z[:, :] = cls.__get_kernel(cls.__pseudo_voigt_kernel, x, y, sigma_x, sigma_y, eta, center_x, center_y)
+
+    @classmethod
+    def get_rotated_gaussian_2d(cls, z, x, y, covariance, center_x=0.0, center_y=0.0):
+        z[:, :] = cls.__get_kernel(cls.__rotated_gaussian_kernel, x, y, covariance[0, 0], covariance[0, 1], covariance[1, 1], center_x, center_y)
+
+    @classmethod
+    def get_beam_moments(cls, histogram, x, y):
+        total = numpy.sum(histogram)
+
+        if total <= 0.0: raise ValueError("No power to compute the beam moments")
+
+        weights_x = numpy.sum(histogram, axis=1)/total
+        weights_y = numpy.sum(histogram, axis=0)/total
+
+        center_x = numpy.sum(weights_x*x)
+        center_y = numpy.sum(weights_y*y)
+
+        sigma_xx = numpy.sum(weights_x*(x-center_x)**2)
+        sigma_yy = numpy.sum(weights_y*(y-center_y)**2)
+        sigma_xy = numpy.sum(histogram*numpy.outer(x-center_x, y-center_y))/total
+
+        return center_x, center_y, numpy.array([[sigma_xx, sigma_xy], [sigma_xy, sigma_yy]])
+
+    @classmethod
+    def __get_kernel(cls, kernel_function, x, y, *parameters):
+        key = (kernel_function.__name__, len(x), len(y), x.tobytes(), y.tobytes()) + tuple([float(parameter) for parameter in parameters])
+
+        if key in cls.__kernel_cache:
+            cls.__kernel_cache.move_to_end(key)
+        else:
+            kernel = kernel_function(x[:, numpy.newaxis], y[numpy.newaxis, :], *parameters)
+            kernel = kernel/numpy.sum(kernel)
+            kernel.setflags(write=False)
+
+            cls.__kernel_cache[key] = kernel
+
+            if len(cls.__kernel_cache) > cls.KERNEL_CACHE_SIZE: cls.__kernel_cache.popitem(last=False)
+
+        return cls.__kernel_cache[key]
+
+    @classmethod
+    def __flat_kernel(cls, x, y):
+        return numpy.ones((x.shape[0], y.shape[1]))
+
+    @classmethod
+    def __gaussian_kernel(cls, x, y, sigma_x, sigma_y, center_x, center_y):
+        return numpy.exp(-1*(0.5*((x-center_x)/sigma_x)**2 + 0.5*((y-center_y)/sigma_y)**2))
+
+    @classmethod
+    def __lorentzian_kernel(cls, x, y, gamma, center_x, center_y):
+        return gamma/(((x-center_x)**2 + (y-center_y)**2 + gamma**2))
+
+    @classmethod
+    def __pseudo_voigt_kernel(cls, x, y, sigma_x, sigma_y, eta, center_x, center_y):
+        # gaussian and lorentzian with the same FWHM (HWHM of the lorentzian = sqrt(2 ln2) sigma), each normalized to 1
+        gaussian   = numpy.exp(-1*(0.5*((x-center_x)/sigma_x)**2 + 0.5*((y-center_y)/sigma_y)**2))
+        lorentzian = 1/(1 + ((x-center_x)/(numpy.sqrt(2*numpy.log(2))*sigma_x))**2 + ((y-center_y)/(numpy.sqrt(2*numpy.log(2))*sigma_y))**2)
+
+        return eta*gaussian/numpy.sum(gaussian) + (1-eta)*lorentzian/numpy.sum(lorentzian)
+
+    @classmethod
+    def __rotated_gaussian_kernel(cls, x, y, sigma_xx, sigma_xy, sigma_yy, center_x, center_y):
+        determinant = sigma_xx*sigma_yy - sigma_xy**2
+
+        if determinant <= 0.0: raise ValueError("Beam moments define a degenerate Gaussian distribution")
+
+        dx = x-center_x
+        dy = y-center_y
+
+        return numpy.exp(-0.5*(sigma_yy*dx**2 - 2*sigma_xy*dx*dy + sigma_xx*dy**2)/determinant)
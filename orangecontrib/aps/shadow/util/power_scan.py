@@ -0,0 +1,501 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Copyright (c) 2018, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+import os, sys, json, argparse, importlib, multiprocessing
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from orangecontrib.aps.util.accumulator import PowerDensityAccumulator
+from orangecontrib.aps.util.energy_binning import SPECTRUM_FILE, read_spectrum_file, read_filters_file, calculate_automatic_binning, get_energy_binnings, allocate_number_of_rays
+from orangecontrib.aps.util.srw_util import shutdown_srw_process_pool
+from orangecontrib.aps.shadow.util.undulator_util import APSUndulatorSource
+from orangecontrib.aps.shadow.util.histogram_util import PowerDensityCalculator
+from orangecontrib.aps.shadow.util.hdf5_util import PowerDensityHdf5File, PowerDensityHdf5Writer
+
+def get_settings(default_settings, settings, description):
+    for name in settings.keys():
+        if not name in default_settings: raise ValueError(description + " setting not recognized: " + str(name))
+
+    return {name : settings.get(name, value) for name, value in default_settings.items()}
+
+def get_beamline(beamline):
+    """
+    the beamline is a function tracing the beam of the source (ShadowBeam) and returning the beam at the element
+    where the power density is computed, given as a callable or as "package.module:function"
+    """
+    if beamline is None or callable(beamline): return beamline
+
+    module_name, _, function_name = str(beamline).partition(":")
+
+    if module_name.strip() == "" or function_name.strip() == "": raise ValueError("Beamline must be specified as <module>:<function>, found: " + str(beamline))
+
+    return getattr(importlib.import_module(module_name.strip()), function_name.strip())
+
+_process_power_scan = None
+_process_power_scan_key = None
+
+def _run_step_in_process(settings, step):
+    # the scan is built once per process (and per settings): the SRW cache of the process is kept between the steps
+    global _process_power_scan, _process_power_scan_key
+
+    key = json.dumps(settings, sort_keys=True, default=repr)
+
+    if _process_power_scan is None or _process_power_scan_key != key:
+        _process_power_scan = PowerScan(**settings)
+        _process_power_scan_key = key
+
+    return _process_power_scan.run_step(*step)
+
+class HeadlessAPSUndulator(APSUndulatorSource):
+    """
+    APS Undulator out of the canvas: settings have the same names and defaults of the ones of the widget
+    (power scans always compute the distributions with SRW, at the energy of the step)
+    """
+    SETTINGS = {"number_of_periods" : 184,
+                "undulator_period" : 0.025,
+                "Kv" : 0.857,
+                "Kh" : 0,
+                "Bh" : 0.0,
+                "Bv" : 1.5,
+                "magnetic_field_from" : 0,
+                "initial_phase_vertical" : 0.0,
+                "initial_phase_horizontal" : 0.0,
+                "symmetry_vs_longitudinal_position_vertical" : 1,
+                "symmetry_vs_longitudinal_position_horizontal" : 0,
+                "horizontal_central_position" : 0.0,
+                "vertical_central_position" : 0.0,
+                "longitudinal_central_position" : 0.0,
+                "electron_energy_in_GeV" : 6.0,
+                "electron_energy_spread" : 1.35e-3,
+                "ring_current" : 0.2,
+                "electron_beam_size_h" : 1.45e-05,
+                "electron_beam_size_v" : 2.8e-06,
+                "electron_beam_divergence_h" : 2.9e-06,
+                "electron_beam_divergence_v" : 1.5e-06,
+                "auto_expand" : 0,
+                "auto_expand_rays" : 0,
+                "type_of_initialization" : 0,
+                "moment_x" : 0.0,
+                "moment_y" : 0.0,
+                "moment_z" : 0.0,
+                "moment_xp" : 0.0,
+                "moment_yp" : 0.0,
+                "source_dimension_wf_h_slit_gap" : 0.0015,
+                "source_dimension_wf_v_slit_gap" : 0.0015,
+                "source_dimension_wf_h_slit_points" : 301,
+                "source_dimension_wf_v_slit_points" : 301,
+                "source_dimension_wf_distance" : 28.0,
+                "horizontal_range_modification_factor_at_resizing" : 0.5,
+                "horizontal_resolution_modification_factor_at_resizing" : 5.0,
+                "vertical_range_modification_factor_at_resizing" : 0.5,
+                "vertical_resolution_modification_factor_at_resizing" : 5.0,
+                "kind_of_sampler" : 1,
+                "sampler_interpolation" : 0,
+                "parallel_srw_calculation" : 0,
+                "use_srw_cache" : 1,
+                "srw_cache_directory" : ".",
+                "srw_cache_size" : 512,
+                "number_of_rays" : 5000,
+                "seed" : 6775431,
+                "polarization" : 1,
+                "coherent_beam" : 0,
+                "phase_diff" : 0.0,
+                "polarization_degree" : 1.0,
+                "optimize_source" : 0,
+                "optimize_file_name" : "NONESPECIFIED",
+                "max_number_of_rejected_rays" : 10000000}
+
+    def __init__(self, workspace_units_to_m=1.0, **settings):
+        for name, value in get_settings(HeadlessAPSUndulator.SETTINGS, settings, "Source").items(): setattr(self, name, value)
+
+        self.workspace_units_to_m = workspace_units_to_m
+
+        self.distribution_source = 0
+        self.use_harmonic = 1
+        self.harmonic_number = 1
+        self.energy = 10000.0
+        self.save_srw_result = 0
+        self.compute_power = True
+
+    def trace(self, energy, energy_step, power_step=None, seed=None, number_of_rays=None):
+        if not seed is None: self.seed = seed
+
+        self.energy = energy
+        self.energy_step = energy_step
+        self.power_step = -1 if power_step is None else power_step
+        self.number_of_rays_step = number_of_rays
+
+        self.checkFields()
+
+        beam_out = self.traceShadowSource()
+
+        x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, total_power = self.getSourceDistributions()
+
+        beam_out.set_initial_flux(self.integrated_flux)
+
+        self.applySourceDistributions(beam_out, x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution)
+        self.setPowerScanningData(beam_out, total_power)
+
+        return beam_out, total_power
+
+class PowerScan(object):
+    """
+    the power density scan of the canvas workflow (Power Density Loop Point -> APS Undulator -> beamline -> Power
+    Plot XY) without GUI: energy binning of a spectrum file, source and beamline traced at every energy step and
+    power densities cumulated, optionally autosaved in HDF5 as the widget does
+
+    settings of the energy binning and of the power plot have the names and the defaults of the ones of the widgets
+    """
+    BINNING_SETTINGS = {"spectrum_file" : SPECTRUM_FILE,
+                        "filters_file" : None,
+                        "autobinning" : 1,
+                        "auto_n_step" : 1001,
+                        "auto_perc_total_power" : 99,
+                        "auto_power_tolerance" : 0.01,
+                        "auto_max_n_step" : 10000,
+                        "send_power_step" : 0,
+                        "allocate_rays" : 0,
+                        "total_number_of_rays" : 1000000,
+                        "minimum_number_of_rays" : 1000,
+                        "seed_increment" : 1}
+
+    POWER_PLOT_SETTINGS = {"x_column_index" : 0,
+                           "y_column_index" : 2,
+                           "x_range" : 0,
+                           "x_range_min" : 0.0,
+                           "x_range_max" : 0.0,
+                           "y_range" : 0,
+                           "y_range_min" : 0.0,
+                           "y_range_max" : 0.0,
+                           "rays" : 1,
+                           "number_of_bins" : 100,
+                           "kind_of_calculation" : 0,
+                           "replace_poor_statistic" : 0,
+                           "good_rays_limit" : 100,
+                           "center_x" : 0.0,
+                           "center_y" : 0.0,
+                           "sigma_x" : 0.0,
+                           "sigma_y" : 0.0,
+                           "gamma" : 0.0,
+                           "eta" : 0.5,
+                           "autosave_partial_results" : 0,
+                           "autosave_compression" : 2,
+                           "autosave_flush_steps" : 10,
+                           "autosave_flush_seconds" : 30.0}
+
+    def __init__(self, source_settings=None, binning_settings=None, power_plot_settings=None, beamline=None, workspace_units_to_m=1.0):
+        if source_settings is None:     source_settings = {}
+        if binning_settings is None:    binning_settings = {}
+        if power_plot_settings is None: power_plot_settings = {}
+
+        self.settings = {"source_settings"     : dict(source_settings),
+                         "binning_settings"    : dict(binning_settings),
+                         "power_plot_settings" : dict(power_plot_settings),
+                         "beamline"            : beamline,
+                         "workspace_units_to_m": workspace_units_to_m}
+
+        self.source               = HeadlessAPSUndulator(workspace_units_to_m, **source_settings)
+        self.binning_settings     = get_settings(PowerScan.BINNING_SETTINGS, binning_settings, "Energy binning")
+        self.power_plot_settings  = get_settings(PowerScan.POWER_PLOT_SETTINGS, power_plot_settings, "Power plot")
+        self.beamline             = get_beamline(beamline)
+        self.workspace_units_to_m = workspace_units_to_m
+        self.seed                 = self.source.seed
+
+        self.accumulator = None
+
+    @classmethod
+    def from_settings_file(cls, file_name):
+        """
+        JSON file with the sections "source", "energy_binning" and "power_plot" (settings of the widgets), "beamline"
+        (<module>:<function>) and "workspace_units_to_m"
+        """
+        with open(file_name, "r") as settings_file:
+            settings = json.load(settings_file)
+
+        for name in settings.keys():
+            if not name in ["source", "energy_binning", "power_plot", "beamline", "workspace_units_to_m"]:
+                raise ValueError("Section not recognized in " + file_name + ": " + str(name))
+
+        return PowerScan(source_settings=settings.get("source", {}),
+                         binning_settings=settings.get("energy_binning", {}),
+                         power_plot_settings=settings.get("power_plot", {}),
+                         beamline=settings.get("beamline", None),
+                         workspace_units_to_m=settings.get("workspace_units_to_m", 1.0))
+
+    def get_energy_binning(self):
+        spectrum_data = read_spectrum_file(self.binning_settings["spectrum_file"])
+        filters       = None if self.binning_settings["filters_file"] is None else read_filters_file(self.binning_settings["filters_file"])
+
+        if self.binning_settings["auto_n_step"] <= 0: raise ValueError("(Auto) % Number of Steps should be > 0")
+        if self.binning_settings["auto_perc_total_power"] <= 0: raise ValueError("(Auto) % Total Power should be > 0")
+        if self.binning_settings["autobinning"] == 3:
+            if self.binning_settings["auto_power_tolerance"] <= 0: raise ValueError("(Auto) Power Error Tolerance should be > 0")
+            if self.binning_settings["auto_max_n_step"] < self.binning_settings["auto_n_step"]: raise ValueError("(Auto) Max Number of Steps should be >= (Auto) Number of Steps")
+
+        return calculate_automatic_binning(spectrum_data,
+                                           filters=filters,
+                                           autobinning=self.binning_settings["autobinning"],
+                                           n_step=int(self.binning_settings["auto_n_step"]),
+                                           perc_total_power=self.binning_settings["auto_perc_total_power"],
+                                           power_tolerance=self.binning_settings["auto_power_tolerance"],
+                                           max_n_step=int(self.binning_settings["auto_max_n_step"]))
+
+    def get_steps(self):
+        """
+        energy, energy step, power step (None if not sent to the source), seed and number of rays (None if the one
+        of the source) of every step, as sent by the loop point (rounded) and seen by the source (the seed is
+        incremented at every step, the first one included)
+        """
+        steps = []
+        seed  = self.seed
+
+        energy_binnings = get_energy_binnings(self.get_energy_binning())
+
+        if self.binning_settings["allocate_rays"] == 1:
+            if self.binning_settings["total_number_of_rays"] <= 0: raise ValueError("Total Number of Rays should be > 0")
+            if self.binning_settings["minimum_number_of_rays"] < 0: raise ValueError("Min Number of Rays per Step should be >= 0")
+
+            numbers_of_rays = allocate_number_of_rays([energy_binning.power_step for energy_binning in energy_binnings],
+                                                      int(self.binning_settings["total_number_of_rays"]),
+                                                      int(self.binning_settings["minimum_number_of_rays"]))
+
+            for energy_binning, number_of_rays in zip(energy_binnings, numbers_of_rays):
+                energy_binning.number_of_rays = int(number_of_rays)
+
+        for energy_binning in energy_binnings:
+            seed += self.binning_settings["seed_increment"]
+
+            steps.append((round(energy_binning.energy_value, 8),
+                          round(energy_binning.energy_step, 8),
+                          None if self.binning_settings["send_power_step"] == 0 else round(energy_binning.power_step, 8),
+                          seed,
+                          energy_binning.number_of_rays))
+
+        return steps
+
+    def get_ranges(self):
+        xrange = None
+        yrange = None
+        factor = self.workspace_units_to_m*1e3
+
+        if self.power_plot_settings["x_range"] == 1:
+            if self.power_plot_settings["x_range_min"] >= self.power_plot_settings["x_range_max"]: raise ValueError("X range min should be < X range max")
+
+            xrange = [self.power_plot_settings["x_range_min"] / factor, self.power_plot_settings["x_range_max"] / factor]
+
+        if self.power_plot_settings["y_range"] == 1:
+            if self.power_plot_settings["y_range_min"] >= self.power_plot_settings["y_range_max"]: raise ValueError("Y range min should be < Y range max")
+
+            yrange = [self.power_plot_settings["y_range_min"] / factor, self.power_plot_settings["y_range_max"] / factor]
+
+        return xrange, yrange
+
+    def run_step(self, energy, energy_step, power_step=None, seed=None, number_of_rays=None):
+        """
+        returns the ticket with the power density of the step (None if no ray reached the final element), the
+        plotted power, the incident power and the total power of the step
+
+        the samplers using the global numpy random state are seeded with the seed of the step too: the result of a
+        step does not depend on the process running it, nor on the steps run before
+        """
+        if not seed is None: numpy.random.seed(seed)
+
+        shadow_beam, total_power = self.source.trace(energy, energy_step, power_step, seed, number_of_rays)
+
+        if not self.beamline is None: shadow_beam = self.beamline(shadow_beam)
+
+        history_item = None if shadow_beam.historySize() == 0 else shadow_beam.getOEHistory(oe_number=shadow_beam._oe_number)
+
+        incident_rays = None if history_item is None or history_item._input_beam is None else history_item._input_beam._beam.rays
+
+        if shadow_beam.scanned_variable_data and shadow_beam.scanned_variable_data.has_additional_parameter("incident_power"):
+            incident_power = shadow_beam.scanned_variable_data.get_additional_parameter("incident_power")
+        else:
+            incident_power = None
+
+        xrange, yrange = self.get_ranges()
+
+        ticket, power_plot, incident_power = PowerDensityCalculator.calculate_power_density(shadow_beam._beam.rays,
+                                                                                           self.power_plot_settings["x_column_index"]+1,
+                                                                                           self.power_plot_settings["y_column_index"]+1,
+                                                                                           total_power,
+                                                                                           nbins=int(self.power_plot_settings["number_of_bins"]),
+                                                                                           xrange=xrange,
+                                                                                           yrange=yrange,
+                                                                                           nolost=self.power_plot_settings["rays"]+1,
+                                                                                           incident_rays=incident_rays,
+                                                                                           incident_power=incident_power,
+                                                                                           to_mm=self.workspace_units_to_m*1e3,
+                                                                                           kind_of_calculation=self.power_plot_settings["kind_of_calculation"],
+                                                                                           replace_poor_statistic=self.power_plot_settings["replace_poor_statistic"],
+                                                                                           good_rays_limit=self.power_plot_settings["good_rays_limit"],
+                                                                                           center_x=self.power_plot_settings["center_x"],
+                                                                                           center_y=self.power_plot_settings["center_y"],
+                                                                                           sigma_x=self.power_plot_settings["sigma_x"],
+                                                                                           sigma_y=self.power_plot_settings["sigma_y"],
+                                                                                           gamma=self.power_plot_settings["gamma"],
+                                                                                           eta=self.power_plot_settings["eta"])
+
+        return ticket, power_plot, incident_power, total_power
+
+    def run(self, file_name=None, progress=None, number_of_processes=1):
+        """
+        runs all the steps and returns the ticket with the cumulated power density; with file_name, the result
+        is written in HDF5 at every step (same layout of the autosave file of Power Plot XY). progress, if given,
+        is called at every step with: step index, number of steps, energy
+
+        with number_of_processes > 1 (0 = one per CPU) the steps are run in a pool of processes, and their results
+        are cumulated in the order of the steps: the result is identical to the one of the serial scan
+        """
+        if number_of_processes == 0: number_of_processes = os.cpu_count()
+
+        steps = self.get_steps()
+
+        self.accumulator = PowerDensityAccumulator()
+
+        writer = None if file_name is None else \
+            PowerDensityHdf5Writer(file_name,
+                                   compression=PowerDensityHdf5File.COMPRESSIONS[self.power_plot_settings["autosave_compression"]],
+                                   flush_steps=self.power_plot_settings["autosave_flush_steps"],
+                                   flush_seconds=self.power_plot_settings["autosave_flush_seconds"])
+
+        cumulated_ticket = None
+
+        step_results = self.__get_step_results(steps, number_of_processes)
+
+        try:
+            for index, (energy, energy_step, _, _, _) in enumerate(steps):
+                ticket, power_plot, incident_power, total_power = next(step_results)
+
+                if not progress is None: progress(index, len(steps), energy)
+
+                if ticket is None: continue # no power on the final element
+
+                self.accumulator.add(ticket['histogram'],
+                                     intensity=ticket['intensity'],
+                                     nrays=ticket['nrays'],
+                                     good_rays=ticket['good_rays'],
+                                     power_plot=power_plot,
+                                     incident_power=incident_power,
+                                     energy_max=energy,
+                                     total_power=total_power)
+
+                cumulated_ticket = ticket.copy()
+                cumulated_ticket['histogram'] = self.accumulator.get_power_density().copy()
+                cumulated_ticket['intensity'] = self.accumulator.get_total("intensity")
+                cumulated_ticket['nrays']     = int(self.accumulator.get_total("nrays"))
+                cumulated_ticket['good_rays'] = int(self.accumulator.get_total("good_rays"))
+
+                if not writer is None:
+                    if self.power_plot_settings["autosave_partial_results"] == 1:
+                        writer.write_step(cumulated_ticket, partial_ticket=ticket, energy_min=energy-energy_step, energy_max=energy)
+                    else:
+                        writer.write_step(cumulated_ticket)
+        finally:
+            step_results.close()
+
+            if not writer is None: writer.close()
+
+        if cumulated_ticket is None: raise ValueError("No power on the final element in any energy step")
+
+        cumulated_ticket['histogram'] = cumulated_ticket['histogram'].copy()
+
+        return cumulated_ticket
+
+    def __get_step_results(self, steps, number_of_processes):
+        # results are given in the order of the steps, whatever the order of completion
+        if number_of_processes <= 1:
+            for step in steps: yield self.run_step(*step)
+        else:
+            settings = dict(self.settings)
+            settings["source_settings"] = dict(settings["source_settings"], parallel_srw_calculation=0) # no nested pools
+
+            max_running = 2*number_of_processes # results waiting to be cumulated are kept in memory: limits them
+
+            process_pool = ProcessPoolExecutor(max_workers=number_of_processes, mp_context=multiprocessing.get_context("spawn"))
+            futures      = {}
+            submitted    = 0
+
+            try:
+                for index in range(len(steps)):
+                    while submitted < len(steps) and submitted < index + max_running:
+                        futures[submitted] = process_pool.submit(_run_step_in_process, settings, steps[submitted])
+                        submitted += 1
+
+                    yield futures.pop(index).result()
+            finally:
+                process_pool.shutdown(wait=True, cancel_futures=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m orangecontrib.aps.shadow.util.power_scan",
+                                     description="Power density scan with the APS Undulator, without the OASYS canvas")
+    parser.add_argument("settings_file", help="JSON file with the settings: sections source, energy_binning, power_plot, beamline, workspace_units_to_m")
+    parser.add_argument("output_file", help="HDF5 file of the power density")
+    parser.add_argument("-n", "--processes", type=int, default=1, help="number of processes running the energy steps (0 = one per CPU, default 1)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the progress of the scan")
+
+    arguments = parser.parse_args(argv)
+
+    def print_progress(index, number_of_steps, energy):
+        print("Step " + str(index + 1) + " of " + str(number_of_steps) + ": " + str(energy) + " eV", file=sys.stderr)
+
+    power_scan = PowerScan.from_settings_file(arguments.settings_file)
+
+    try:
+        power_scan.run(arguments.output_file, progress=None if arguments.quiet else print_progress, number_of_processes=arguments.processes)
+    finally:
+        shutdown_srw_process_pool()
+
+    if not arguments.quiet:
+        print("Total Power [W]: Plotted=" + str(round(power_scan.accumulator.get_total("power_plot"), 2)) + \
+              ", Incident=" + str(round(power_scan.accumulator.get_total("incident_power"), 2)) + \
+              ", Total=" + str(round(power_scan.accumulator.get_total("total_power"), 2)), file=sys.stderr)
+
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
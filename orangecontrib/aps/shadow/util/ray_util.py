@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Copyright (c) 2018, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+import numpy
+
+# columns of the SHADOW ray table (0-based)
+
+X, Y, Z = 0, 1, 2
+DIRECTION_X, DIRECTION_Y, DIRECTION_Z = 3, 4, 5
+ES_X, ES_Y, ES_Z = 6, 7, 8
+FLAG = 9
+EP_X, EP_Y, EP_Z = 15, 16, 17
+
+def zero_columns(rays, columns):
+    """
+    sets to zero the given columns of all the rays, in place
+    """
+    rays[:, list(columns)] = 0.0
+
+    return rays
+
+def zero_p_polarization(rays):
+    return zero_columns(rays, [EP_X, EP_Y, EP_Z])
+
+def set_positions(rays, x=None, y=None, z=None):
+    """
+    sets the positions of all the rays (only the coordinates given), in place
+    """
+    if not x is None: rays[:, X] = x
+    if not y is None: rays[:, Y] = y
+    if not z is None: rays[:, Z] = z
+
+    return rays
+
+def set_directions_from_angles(rays, alpha_x, alpha_z):
+    """
+    sets the direction cosines of all the rays from the horizontal (alpha_x) and vertical (alpha_z) angles
+    with the Y axis, in place: (cos(alpha_z) sin(alpha_x), cos(alpha_z) cos(alpha_x), sin(alpha_z))
+    """
+    alpha_x = numpy.asarray(alpha_x, dtype=numpy.float64)
+    alpha_z = numpy.asarray(alpha_z, dtype=numpy.float64)
+
+    cos_alpha_z = numpy.cos(alpha_z)
+
+    numpy.sin(alpha_x, out=rays[:, DIRECTION_X])
+    numpy.cos(alpha_x, out=rays[:, DIRECTION_Y])
+    numpy.sin(alpha_z, out=rays[:, DIRECTION_Z])
+
+    rays[:, DIRECTION_X] *= cos_alpha_z
+    rays[:, DIRECTION_Y] *= cos_alpha_z
+
+    return rays
@@ -0,0 +1,65 @@
+import numpy, pytest
+
+from orangecontrib.aps.shadow.util.histogram_util import power_histograms, PowerDensityCalculator
+
+def get_rays(n_rays=1000, flag=1):
+    rays = numpy.zeros((n_rays, 18))
+    random = numpy.random.default_rng(0)
+
+    rays[:, 0] = random.normal(0.0, 1.0, n_rays)
+    rays[:, 2] = random.normal(0.0, 0.5, n_rays)
+    rays[:, 6] = 1.0 # Es
+    rays[:, 9] = flag
+
+    return rays
+
+def test_power_histograms_all_lost():
+    ticket = power_histograms(get_rays(flag=-1), 1, 3, nbins=10, nolost=1)
+
+    assert ticket["histogram"].dtype == numpy.float64
+    assert ticket["histogram_transmitted"].dtype == numpy.float64
+    assert numpy.all(ticket["histogram"] == 0.0)
+    assert ticket["good_rays"] == 0
+
+def test_power_histograms_out_of_range():
+    ticket = power_histograms(get_rays(), 1, 3, nbins=10, xrange=[100.0, 200.0], yrange=[100.0, 200.0])
+
+    assert ticket["histogram"].dtype == numpy.float64
+    assert numpy.all(ticket["histogram"] == 0.0)
+    assert ticket["histogram_lost"].dtype == numpy.float64
+
+def test_calculate_power_density_all_lost():
+    ticket, power_plot, _ = PowerDensityCalculator.calculate_power_density(get_rays(flag=-1), 1, 3, total_power=10.0, nbins=10)
+
+    assert ticket["histogram"].dtype == numpy.float64
+    assert numpy.all(ticket["histogram"] == 0.0)
+    assert power_plot == 0.0
+
+def test_calculate_power_density_out_of_range():
+    ticket, power_plot, _ = PowerDensityCalculator.calculate_power_density(get_rays(), 1, 3, total_power=10.0, nbins=10,
+                                                                           xrange=[100.0, 200.0], yrange=[100.0, 200.0])
+
+    assert numpy.all(ticket["histogram"] == 0.0)
+    assert power_plot == 0.0
+
+def test_calculate_power_density_total_power():
+    ticket, power_plot, _ = PowerDensityCalculator.calculate_power_density(get_rays(), 1, 3, total_power=10.0, nbins=10)
+
+    assert numpy.isclose(power_plot, 10.0)
+
+def test_calculate_power_density_beam_moments_no_power():
+    for kind_of_calculation in [4, 5]:
+        ticket, power_plot, _ = PowerDensityCalculator.calculate_power_density(get_rays(flag=-1), 1, 3, total_power=10.0, nbins=10,
+                                                                               kind_of_calculation=kind_of_calculation)
+        assert numpy.all(ticket["histogram"] == 0.0)
+        assert power_plot == 0.0
+
+        ticket, power_plot, _ = PowerDensityCalculator.calculate_power_density(get_rays(), 1, 3, total_power=10.0, nbins=10,
+                                                                               xrange=[100.0, 200.0], yrange=[100.0, 200.0],
+                                                                               kind_of_calculation=kind_of_calculation)
+        assert numpy.all(ticket["histogram"] == 0.0)
+        assert power_plot == 0.0
+
+def test_calculate_power_density_eta_out_of_range():
+    with pytest.raises(ValueError):
+        PowerDensityCalculator.calculate_power_density(get_rays(), 1, 3, total_power=10.0, nbins=10, kind_of_calculation=4, eta=1.5)
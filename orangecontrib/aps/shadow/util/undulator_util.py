@@ -0,0 +1,877 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# #########################################################################
+# Copyright (c) 2018, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2018. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# #########################################################################
+
+import os
+import numpy
+from collections import OrderedDict
+
+from oasys.widgets import congruence
+
+from srxraylib.util.inverse_method_sampler import Sampler2D
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowSource
+
+from orangecontrib.aps.util.custom_distribution import CustomDistribution, CustomDistribution2D, SeparableDistribution2D
+from orangecontrib.aps.util.accumulator import PowerDensityAccumulator
+from orangecontrib.aps.shadow.util import ray_util
+from orangecontrib.aps.util.srw_util import transform_srw_array, calculate_srw_intensity, get_srw_process_pool, SRWResultsCache, SRWDistributionsFile, load_srw_intensity_file
+
+import scipy.constants as codata
+
+m2ev = codata.c * codata.h / codata.e
+
+from oasys_srw.srwlib import *
+from oasys_srw.srwlib import array as srw_array
+
+class Distribution:
+    POSITION = 0
+    DIVERGENCE = 1
+
+class APSUndulatorSource(object):
+    """
+    calculations of the APS undulator source (SHADOW rays with spatial and angular distributions from SRW or from
+    files), without any GUI: mixed in the widget, that provides the settings with the same names, and used by
+    the headless power scans
+    """
+    energy_step = None
+    power_step = None
+    number_of_rays_step = None # number of rays of the energy step of a power scan, if given by the loop point
+    compute_power = False
+    integrated_flux = None
+
+    cumulated_results = None
+
+    srw_cache = None
+    DISTRIBUTION_FILES_CACHE_SIZE = 16
+
+    distribution_files_cache = OrderedDict() # file name -> (size, modification time, distribution), LRU: shared by all the sources
+    srw_energy_scan_store = None
+    srw_prefetched_calculations = None
+
+    ####################################################################################
+    # PROCEDURES
+    ####################################################################################
+
+    def checkFields(self):
+        self.number_of_rays = congruence.checkPositiveNumber(self.number_of_rays, "Number of rays")
+        self.seed = congruence.checkPositiveNumber(self.seed, "Seed")
+
+        if self.use_harmonic == 0:
+            if self.distribution_source != 0: raise Exception("Harmonic Energy can be computed only for explicit SRW Calculation")
+
+            self.harmonic_number = congruence.checkStrictlyPositiveNumber(self.harmonic_number, "Harmonic Number")
+        else:
+            self.energy = congruence.checkPositiveNumber(self.energy, "Photon Energy")
+
+        if self.optimize_source > 0:
+            self.max_number_of_rejected_rays = congruence.checkPositiveNumber(self.max_number_of_rejected_rays,
+                                                                             "Max number of rejected rays")
+            congruence.checkFile(self.optimize_file_name)
+
+    def populateFields(self, shadow_src):
+        number_of_rays = self.number_of_rays if self.number_of_rays_step is None else self.number_of_rays_step
+
+        shadow_src.src.NPOINT = number_of_rays if self.auto_expand==0 else (number_of_rays if self.auto_expand_rays==0 else int(numpy.ceil(number_of_rays*1.1)))
+        shadow_src.src.ISTAR1 = self.seed
+        shadow_src.src.F_OPD = 1
+        shadow_src.src.F_SR_TYPE = 0
+
+        shadow_src.src.FGRID = 0
+        shadow_src.src.IDO_VX = 0
+        shadow_src.src.IDO_VZ = 0
+        shadow_src.src.IDO_X_S = 0
+        shadow_src.src.IDO_Y_S = 0
+        shadow_src.src.IDO_Z_S = 0
+
+        shadow_src.src.FSOUR = 0 # spatial_type (point)
+        shadow_src.src.FDISTR = 1 # angular_distribution (flat)
+
+        shadow_src.src.HDIV1 = -1.0e-6
+        shadow_src.src.HDIV2 = 1.0e-6
+        shadow_src.src.VDIV1 = -1.0e-6
+        shadow_src.src.VDIV2 = 1.0e-6
+
+        shadow_src.src.FSOURCE_DEPTH = 1 # OFF
+
+        shadow_src.src.F_COLOR = 1 # single value
+        shadow_src.src.F_PHOT = 0 # eV , 1 Angstrom
+
+        shadow_src.src.PH1 = self.energy if self.use_harmonic==1 else self.resonance_energy(harmonic=self.harmonic_number)
+
+        shadow_src.src.F_POLAR = self.polarization
+
+        if self.polarization == 1:
+            shadow_src.src.F_COHER = self.coherent_beam
+            shadow_src.src.POL_ANGLE = self.phase_diff
+            shadow_src.src.POL_DEG = self.polarization_degree
+
+        shadow_src.src.F_OPD = 1
+        shadow_src.src.F_BOUND_SOUR = self.optimize_source
+        if self.optimize_source > 0:
+            shadow_src.src.FILE_BOUND = bytes(congruence.checkFileName(self.optimize_file_name), 'utf-8')
+        shadow_src.src.NTOTALPOINT = self.max_number_of_rejected_rays
+
+    # WEIRD MEMORY INITIALIZATION BY FORTRAN. JUST A FIX.
+    def fix_Intensity(self, beam_out):
+        if self.polarization == 0: ray_util.zero_p_polarization(beam_out._beam.rays)
+
+    def traceShadowSource(self, write_begin_file=0, write_start_file=0, write_end_file=0):
+        shadow_src = ShadowSource.create_src()
+
+        self.populateFields(shadow_src)
+
+        beam_out = ShadowBeam.traceFromSource(shadow_src,
+                                              write_begin_file=write_begin_file,
+                                              write_start_file=write_start_file,
+                                              write_end_file=write_end_file)
+
+        self.fix_Intensity(beam_out)
+
+        return beam_out
+
+    def getSourceDistributions(self, do_cumulated_calculations=False):
+        if self.distribution_source == 0:
+            return self.runSRWCalculation(do_cumulated_calculations)
+        elif self.distribution_source == 1:
+            return self.loadSRWFiles() + (None,)
+        elif self.distribution_source == 2: # ASCII FILES
+            return self.loadASCIIFiles() + (None,)
+        elif self.distribution_source == 3:
+            return self.loadSRWBinaryFiles() + (None,)
+        else:
+            raise ValueError("Distribution source not recognized")
+
+    def applySourceDistributions(self, beam_out, x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution):
+        self.generate_user_defined_distribution_from_srw(beam_out=beam_out,
+                                                         coord_x=x,
+                                                         coord_z=z,
+                                                         intensity=intensity_source_dimension,
+                                                         distribution_type=Distribution.POSITION,
+                                                         kind_of_sampler=self.kind_of_sampler,
+                                                         interpolation=self.sampler_interpolation,
+                                                         seed=0 if self.seed==0 else self.seed+1)
+
+        self.generate_user_defined_distribution_from_srw(beam_out=beam_out,
+                                                         coord_x=x_first,
+                                                         coord_z=z_first,
+                                                         intensity=intensity_angular_distribution,
+                                                         distribution_type=Distribution.DIVERGENCE,
+                                                         kind_of_sampler=self.kind_of_sampler,
+                                                         interpolation=self.sampler_interpolation,
+                                                         seed=0 if self.seed==0 else self.seed+2)
+
+    def setPowerScanningData(self, beam_out, total_power):
+        additional_parameters = {}
+
+        additional_parameters["total_power"]        = total_power
+        additional_parameters["photon_energy_step"] = self.energy_step
+
+        beam_out.setScanningData(ShadowBeam.ScanningData("photon_energy", self.energy, "Energy for Power Calculation", "eV", additional_parameters))
+
+    ####################################################################################
+    # SRW CALCULATION
+    ####################################################################################
+
+    def get_default_initial_z(self):
+        return self.longitudinal_central_position-0.5*self.undulator_period*(self.number_of_periods + 8) # initial Longitudinal Coordinate (set before the ID)
+
+    def checkSRWFields(self):
+
+        congruence.checkPositiveNumber(self.Kh, "Horizontal K")
+        congruence.checkPositiveNumber(self.Kv, "Vertical K")
+        congruence.checkStrictlyPositiveNumber(self.undulator_period, "Period Length")
+        congruence.checkStrictlyPositiveNumber(self.number_of_periods, "Number of Periods")
+
+        congruence.checkStrictlyPositiveNumber(self.electron_energy_in_GeV, "Energy")
+        congruence.checkPositiveNumber(self.electron_energy_spread, "Energy Spread")
+        congruence.checkStrictlyPositiveNumber(self.ring_current, "Ring Current")
+
+        congruence.checkPositiveNumber(self.electron_beam_size_h       , "Horizontal Beam Size")
+        congruence.checkPositiveNumber(self.electron_beam_divergence_h , "Vertical Beam Size")
+        congruence.checkPositiveNumber(self.electron_beam_size_v       , "Horizontal Beam Divergence")
+        congruence.checkPositiveNumber(self.electron_beam_divergence_v , "Vertical Beam Divergence")
+
+
+        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_h_slit_gap, "Wavefront Propagation H Slit Gap")
+        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_v_slit_gap, "Wavefront Propagation V Slit Gap")
+        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_h_slit_points, "Wavefront Propagation H Slit Points")
+        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_v_slit_points, "Wavefront Propagation V Slit Points")
+        congruence.checkGreaterOrEqualThan(self.source_dimension_wf_distance, self.get_minimum_propagation_distance(),
+                                           "Wavefront Propagation Distance", "Minimum Distance out of the Source: " + str(self.get_minimum_propagation_distance()))
+
+        if self.save_srw_result == 1:
+            congruence.checkDir(self.source_dimension_srw_file)
+            congruence.checkDir(self.angular_distribution_srw_file)
+        elif self.save_srw_result == 2:
+            congruence.checkDir(self.srw_distributions_directory)
+
+    def get_minimum_propagation_distance(self):
+        return round(self.get_source_length()*1.01, 6)
+
+    def get_source_length(self):
+        return self.undulator_period*self.number_of_periods
+
+    def magnetic_field_from_K(self):
+        Bv = self.Kv * 2 * pi * codata.m_e * codata.c / (codata.e * self.undulator_period)
+        Bh = self.Kh * 2 * pi * codata.m_e * codata.c / (codata.e * self.undulator_period)
+
+        return Bv, Bh
+
+    def createUndulator(self):
+        #***********Undulator
+        if self.magnetic_field_from == 0:
+            By, Bx = self.magnetic_field_from_K() #Peak Vertical field [T]
+        else:
+            By = self.Bv
+            Bx = self.Bh
+
+        symmetry_vs_longitudinal_position_horizontal = 1 if self.symmetry_vs_longitudinal_position_horizontal == 0 else -1
+        symmetry_vs_longitudinal_position_vertical = 1 if self.symmetry_vs_longitudinal_position_vertical == 0 else -1
+
+        und = SRWLMagFldU([SRWLMagFldH(1, 'h',
+                                       _B=Bx,
+                                       _ph=self.initial_phase_horizontal,
+                                       _s=symmetry_vs_longitudinal_position_horizontal,
+                                       _a=1.0),
+                           SRWLMagFldH(1, 'v',
+                                       _B=By,
+                                       _ph=self.initial_phase_vertical,
+                                       _s=symmetry_vs_longitudinal_position_vertical,
+                                       _a=1)],
+                          self.undulator_period, self.number_of_periods) #Planar Undulator
+
+        magFldCnt = SRWLMagFldC(_arMagFld=[und],
+                                _arXc = array('d', [self.horizontal_central_position]),
+                                _arYc = array('d', [self.vertical_central_position]),
+                                _arZc = array('d', [self.longitudinal_central_position]))#Container of all Field Elements
+
+        return magFldCnt
+
+    def createElectronBeam(self, distribution_type=Distribution.DIVERGENCE):
+        #***********Electron Beam
+        elecBeam = SRWLPartBeam()
+
+        if self.type_of_initialization == 0: # zero
+            self.moment_x = 0.0
+            self.moment_y = 0.0
+            self.moment_z = self.get_default_initial_z()
+            self.moment_xp = 0.0
+            self.moment_yp = 0.0
+        elif self.type_of_initialization == 2: # sampled
+            self.moment_x = numpy.random.normal(0.0, self.electron_beam_size_h)
+            self.moment_y = numpy.random.normal(0.0, self.electron_beam_size_v)
+            self.moment_z = self.get_default_initial_z()
+            self.moment_xp = numpy.random.normal(0.0, self.electron_beam_divergence_h)
+            self.moment_yp = numpy.random.normal(0.0, self.electron_beam_divergence_v)
+
+        elecBeam.partStatMom1.x = self.moment_x
+        elecBeam.partStatMom1.y = self.moment_y
+        elecBeam.partStatMom1.z = self.moment_z
+        elecBeam.partStatMom1.xp = self.moment_xp
+        elecBeam.partStatMom1.yp = self.moment_yp
+        elecBeam.partStatMom1.gamma = self.gamma()
+
+        elecBeam.Iavg = self.ring_current #Average Current [A]
+
+        #2nd order statistical moments
+        elecBeam.arStatMom2[0] = 0 if distribution_type==Distribution.DIVERGENCE else (self.electron_beam_size_h)**2 #<(x-x0)^2>
+        elecBeam.arStatMom2[1] = 0
+        elecBeam.arStatMom2[2] = (self.electron_beam_divergence_h)**2 #<(x'-x'0)^2>
+        elecBeam.arStatMom2[3] = 0 if distribution_type==Distribution.DIVERGENCE else (self.electron_beam_size_v)**2 #<(y-y0)^2>
+        elecBeam.arStatMom2[4] = 0
+        elecBeam.arStatMom2[5] = (self.electron_beam_divergence_v)**2 #<(y'-y'0)^2>
+        # energy spread
+        elecBeam.arStatMom2[10] = (self.electron_energy_spread)**2 #<(E-E0)^2>/E0^2
+
+        return elecBeam
+
+    def get_source_slit_data(self, direction="b"):
+        if self.auto_expand==1:
+            source_dimension_wf_h_slit_points = int(numpy.ceil(0.55*self.source_dimension_wf_h_slit_points)*2)
+            source_dimension_wf_v_slit_points = int(numpy.ceil(0.55*self.source_dimension_wf_v_slit_points)*2)
+            source_dimension_wf_h_slit_gap = self.source_dimension_wf_h_slit_gap*1.1
+            source_dimension_wf_v_slit_gap = self.source_dimension_wf_v_slit_gap*1.1
+        else:
+            source_dimension_wf_h_slit_points = self.source_dimension_wf_h_slit_points
+            source_dimension_wf_v_slit_points = self.source_dimension_wf_v_slit_points
+            source_dimension_wf_h_slit_gap = self.source_dimension_wf_h_slit_gap
+            source_dimension_wf_v_slit_gap = self.source_dimension_wf_v_slit_gap
+
+        if direction=="h":   return source_dimension_wf_h_slit_points, source_dimension_wf_h_slit_gap
+        elif direction=="v": return source_dimension_wf_v_slit_points, source_dimension_wf_v_slit_gap
+        else:                return source_dimension_wf_h_slit_points, source_dimension_wf_h_slit_gap, source_dimension_wf_v_slit_points, source_dimension_wf_v_slit_gap
+
+    def createInitialWavefrontMesh(self, elecBeam, energy=None):
+        #****************** Initial Wavefront
+        wfr = SRWLWfr() #For intensity distribution at fixed photon energy
+
+        source_dimension_wf_h_slit_points, \
+        source_dimension_wf_h_slit_gap, \
+        source_dimension_wf_v_slit_points, \
+        source_dimension_wf_v_slit_gap = self.get_source_slit_data(direction="b")
+
+        wfr.allocate(1, source_dimension_wf_h_slit_points, source_dimension_wf_v_slit_points) #Numbers of points vs Photon Energy, Horizontal and Vertical Positions
+        wfr.mesh.zStart = self.source_dimension_wf_distance - self.longitudinal_central_position #Longitudinal Position [m] from Center of Straight Section at which SR has to be calculated
+        wfr.mesh.eStart = self.get_photon_energy() if energy is None else energy  #Initial Photon Energy [eV]
+        wfr.mesh.eFin = wfr.mesh.eStart #Final Photon Energy [eV]
+
+        wfr.mesh.xStart = -0.5*source_dimension_wf_h_slit_gap #Initial Horizontal Position [m]
+        wfr.mesh.xFin = -1 * wfr.mesh.xStart #0.00015 #Final Horizontal Position [m]
+        wfr.mesh.yStart = -0.5*source_dimension_wf_v_slit_gap #Initial Vertical Position [m]
+        wfr.mesh.yFin = -1 * wfr.mesh.yStart#0.00015 #Final Vertical Position [m]
+
+        wfr.partBeam = elecBeam
+
+        return wfr
+
+    def get_photon_energy(self):
+        return self.energy if self.use_harmonic==1 else self.resonance_energy(harmonic=self.harmonic_number)
+
+    def createCalculationPrecisionSettings(self):
+        #***********Precision Parameters for SR calculation
+        meth = 1 #SR calculation method: 0- "manual", 1- "auto-undulator", 2- "auto-wiggler"
+        relPrec = 0.01 #relative precision
+        zStartInteg = 0 #longitudinal position to start integration (effective if < zEndInteg)
+        zEndInteg = 0 #longitudinal position to finish integration (effective if > zStartInteg)
+        npTraj = 100000 #Number of points for trajectory calculation
+        useTermin = 1 #Use "terminating terms" (i.e. asymptotic expansions at zStartInteg and zEndInteg) or not (1 or 0 respectively)
+        arPrecParSpec = [meth, relPrec, zStartInteg, zEndInteg, npTraj, useTermin, 0]
+
+        return arPrecParSpec
+
+    def createBeamlineSourceDimension(self, wfr):
+        #***************** Optical Elements and Propagation Parameters
+
+        opDrift = SRWLOptD(-self.source_dimension_wf_distance) # back to the center of the undulator
+        ppDrift = [0, 0, 1., 1, 0,
+                   self.horizontal_range_modification_factor_at_resizing,
+                   self.horizontal_resolution_modification_factor_at_resizing,
+                   self.vertical_range_modification_factor_at_resizing,
+                   self.vertical_resolution_modification_factor_at_resizing,
+                   0, 0, 0]
+
+        return SRWLOptC([opDrift],[ppDrift])
+
+    def transform_srw_array(self, output_array, mesh):
+        return transform_srw_array(output_array, mesh)
+
+    def runSRWCalculation(self, do_cumulated_calculations=False):
+
+        self.checkSRWFields()
+
+        srw_results = None
+
+        if not self.srw_energy_scan_store is None and self.type_of_initialization != 2 and self.save_srw_result == 0:
+            if self.srw_energy_scan_store.contains(SRWResultsCache.get_key(self.get_srw_parameters(include_photon_energy=False)), self.get_photon_energy()):
+                srw_results = self.srw_energy_scan_store.get(self.get_photon_energy())
+
+        if srw_results is None:
+            srw_results = self.getPrefetchedSRWDistributions()
+
+        if srw_results is None:
+            if self.is_srw_cache_usable():
+                srw_cache     = self.get_srw_cache()
+                srw_cache_key = srw_cache.get_key(self.get_srw_parameters())
+                srw_results   = srw_cache.get(srw_cache_key)
+
+                if srw_results is None:
+                    srw_results = self.calculateSRWDistributions()
+
+                    srw_cache.put(srw_cache_key, srw_results)
+            else:
+                srw_results = self.calculateSRWDistributions()
+
+        x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, self.integrated_flux = srw_results
+
+        if self.compute_power:
+            total_power = self.power_step if self.power_step > 0 else self.integrated_flux * (1e3 * self.energy_step * codata.e)
+        else:
+            total_power = None
+
+        if self.compute_power and do_cumulated_calculations:
+            if self.cumulated_results is None: self.cumulated_results = PowerDensityAccumulator()
+
+            self.cumulated_results.add(intensity_angular_distribution * (1e3 * self.energy_step * codata.e),
+                                       energy=self.energy,
+                                       integrated_flux=self.integrated_flux,
+                                       power=total_power)
+
+        # SWITCH FROM SRW METERS TO SHADOWOUI U.M.
+        x /= self.workspace_units_to_m
+        z /= self.workspace_units_to_m
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, total_power
+
+    def calculateSRWDistributions(self):
+        magFldCnt, wfrAngDist, wfrSouDim, optBLSouDim, arPrecParSpec = self.prepareSRWCalculations()
+
+        # the two calculations are independent
+        if self.parallel_srw_calculation == 1:
+            srw_process_pool = get_srw_process_pool()
+
+            future_angular_distribution = srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrAngDist, arPrecParSpec)
+            future_source_dimension     = srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrSouDim, arPrecParSpec, optBLSouDim)
+
+            arIAngDist, meshAngDist = future_angular_distribution.result()
+            arISouDim, meshSouDim   = future_source_dimension.result()
+        else:
+            arIAngDist, meshAngDist = calculate_srw_intensity(magFldCnt, wfrAngDist, arPrecParSpec)
+            arISouDim, meshSouDim   = calculate_srw_intensity(magFldCnt, wfrSouDim, arPrecParSpec, optBLSouDim)
+
+        return self.processSRWIntensities(arIAngDist, meshAngDist, arISouDim, meshSouDim)
+
+    def prepareSRWCalculations(self, energy=None):
+        magFldCnt = self.createUndulator()
+
+        arPrecParSpec = self.createCalculationPrecisionSettings()
+
+        # This is the convergence parameter. Higher is more accurate but slower!!
+        # 0.2 is used in the original example. But I think it should be higher. The calculation may then however need too much memory.
+        sampFactNxNyForProp = 0.0 #0.6 #sampling factor for adjusting nx, ny (effective if > 0)
+
+        arPrecParSpec[6] = sampFactNxNyForProp #sampling factor for adjusting nx, ny (effective if > 0)
+
+        # 1 calculate intensity distribution ME convoluted for dimension size (radiation at the slit)
+        elecBeamAngDist = self.createElectronBeam(distribution_type=Distribution.DIVERGENCE)
+        wfrAngDist      = self.createInitialWavefrontMesh(elecBeamAngDist, energy)
+
+        # 2 for source dimension, back propagation to the source central position
+        elecBeamSouDim = self.createElectronBeam(distribution_type=Distribution.POSITION)
+        wfrSouDim      = self.createInitialWavefrontMesh(elecBeamSouDim, energy)
+        optBLSouDim    = self.createBeamlineSourceDimension(wfrSouDim)
+
+        return magFldCnt, wfrAngDist, wfrSouDim, optBLSouDim, arPrecParSpec
+
+    def processSRWIntensities(self, arIAngDist, meshAngDist, arISouDim, meshSouDim):
+        # from radiation at the slit we can calculate Angular Distribution and Power
+
+        x, z, intensity_angular_distribution = self.transform_srw_array(arIAngDist, meshAngDist)
+
+        dx = (x[1] - x[0]) * 1e3  # mm for power computations
+        dy = (z[1] - z[0]) * 1e3
+
+        integrated_flux = intensity_angular_distribution.sum()*dx*dy
+
+        distance = self.source_dimension_wf_distance # relative to the center of the undulator
+
+        x_first = numpy.arctan(x/distance)
+        z_first = numpy.arctan(z/distance)
+
+        if self.save_srw_result == 1:
+            meshAngDist.xStart = numpy.arctan(meshAngDist.xStart/distance)
+            meshAngDist.xFin   = numpy.arctan(meshAngDist.xFin  /distance)
+            meshAngDist.yStart = numpy.arctan(meshAngDist.yStart/distance)
+            meshAngDist.yFin   = numpy.arctan(meshAngDist.yFin  /distance)
+
+            srwl_uti_save_intens_ascii(srw_array('f', arIAngDist.tobytes()), meshAngDist, self.angular_distribution_srw_file)
+            srwl_uti_save_intens_ascii(srw_array('f', arISouDim.tobytes()), meshSouDim, self.source_dimension_srw_file)
+
+        x, z, intensity_source_dimension = self.transform_srw_array(arISouDim, meshSouDim)
+
+        if self.save_srw_result == 2:
+            SRWDistributionsFile.write(self.srw_distributions_directory,
+                                       x, z, intensity_source_dimension,
+                                       x_first, z_first, intensity_angular_distribution,
+                                       integrated_flux,
+                                       parameters=self.get_srw_parameters())
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, integrated_flux
+
+    def generate_user_defined_distribution_from_srw(self,
+                                                    beam_out,
+                                                    coord_x,
+                                                    coord_z,
+                                                    intensity,
+                                                    distribution_type=Distribution.POSITION,
+                                                    kind_of_sampler=2,
+                                                    seed=0,
+                                                    interpolation=CustomDistribution.NONE):
+        if isinstance(intensity, SeparableDistribution2D) and not kind_of_sampler == 1: intensity = intensity.to_array()
+
+        if kind_of_sampler == 2:
+            s2d = Sampler2D(intensity, coord_x, coord_z)
+
+            sampled_x, sampled_z = s2d.get_n_sampled_points(len(beam_out._beam.rays))
+        elif kind_of_sampler == 0:
+            pdf = numpy.abs(intensity/numpy.max(intensity))
+            pdf /= pdf.sum()
+
+            distribution = CustomDistribution(pdf, interpolation=interpolation, seed=seed)
+
+            sampled = distribution(len(beam_out._beam.rays))
+
+            min_value_x = numpy.min(coord_x)
+            step_x = numpy.abs(coord_x[1]-coord_x[0])
+            min_value_z = numpy.min(coord_z)
+            step_z = numpy.abs(coord_z[1]-coord_z[0])
+
+            sampled_x = min_value_x + sampled[0, :]*step_x
+            sampled_z = min_value_z + sampled[1, :]*step_z
+        elif kind_of_sampler == 1:
+            min_x = numpy.min(coord_x)
+            max_x = numpy.max(coord_x)
+            delta_x = max_x - min_x
+
+            min_z = numpy.min(coord_z)
+            max_z = numpy.max(coord_z)
+            delta_z = max_z - min_z
+
+            dim_x = len(coord_x)
+            dim_z = len(coord_z)
+
+            if isinstance(intensity, SeparableDistribution2D): d = intensity # x and z sampled independently
+            else: d = CustomDistribution2D(numpy.abs(intensity), (0, 0), (dim_x, dim_z))
+
+            samples = d.get_samples(len(beam_out._beam.rays), seed)
+
+            sampled_x = min_x + samples[:, 0] * delta_x
+            sampled_z = min_z + samples[:, 1] * delta_z
+        else:
+            raise ValueError("Sampler not recognized")
+
+        if distribution_type == Distribution.POSITION:
+            ray_util.set_positions(beam_out._beam.rays, x=sampled_x, z=sampled_z)
+        elif distribution_type == Distribution.DIVERGENCE:
+            ray_util.set_directions_from_angles(beam_out._beam.rays, sampled_x, sampled_z)
+
+    def gamma(self):
+        return 1e9*self.electron_energy_in_GeV / (codata.m_e *  codata.c**2 / codata.e)
+
+    def resonance_energy(self, theta_x=0.0, theta_z=0.0, harmonic=1):
+        gamma = self.gamma()
+
+        wavelength = (self.undulator_period / (2.0*gamma **2)) * \
+                     (1 + self.Kv**2 / 2.0 + self.Kh**2 / 2.0 + \
+                      gamma**2 * (theta_x**2 + theta_z ** 2))
+
+        wavelength /= harmonic
+
+        return m2ev/wavelength
+
+    ####################################################################################
+    # SRW CACHE
+    ####################################################################################
+
+    def prefetchSRWDistributions(self, energies):
+        if self.type_of_initialization == 2 or self.save_srw_result != 0: return
+
+        self.checkSRWFields()
+
+        srw_key = SRWResultsCache.get_key(self.get_srw_parameters(include_photon_energy=False))
+
+        if self.srw_prefetched_calculations is None: self.srw_prefetched_calculations = {}
+
+        # prefetched calculations of a different configuration are useless
+        for prefetch_key in [prefetch_key for prefetch_key in self.srw_prefetched_calculations.keys() if prefetch_key[0] != srw_key]:
+            for future in self.srw_prefetched_calculations.pop(prefetch_key): future.cancel()
+
+        srw_process_pool = get_srw_process_pool()
+
+        for energy in energies:
+            prefetch_key = (srw_key, round(energy, 8))
+
+            if prefetch_key in self.srw_prefetched_calculations: continue
+            if not self.srw_energy_scan_store is None and self.srw_energy_scan_store.contains(srw_key, energy): continue
+
+            magFldCnt, wfrAngDist, wfrSouDim, optBLSouDim, arPrecParSpec = self.prepareSRWCalculations(energy)
+
+            self.srw_prefetched_calculations[prefetch_key] = [srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrAngDist, arPrecParSpec),
+                                                              srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrSouDim, arPrecParSpec, optBLSouDim)]
+
+    def getPrefetchedSRWDistributions(self):
+        if self.srw_prefetched_calculations is None or self.type_of_initialization == 2 or self.save_srw_result != 0: return None
+
+        prefetch_key = (SRWResultsCache.get_key(self.get_srw_parameters(include_photon_energy=False)), round(self.get_photon_energy(), 8))
+
+        if not prefetch_key in self.srw_prefetched_calculations: return None
+
+        future_angular_distribution, future_source_dimension = self.srw_prefetched_calculations.pop(prefetch_key)
+
+        arIAngDist, meshAngDist = future_angular_distribution.result()
+        arISouDim, meshSouDim   = future_source_dimension.result()
+
+        srw_results = self.processSRWIntensities(arIAngDist, meshAngDist, arISouDim, meshSouDim)
+
+        if self.is_srw_cache_usable(): self.get_srw_cache().put(SRWResultsCache.get_key(self.get_srw_parameters()), srw_results)
+
+        return srw_results
+
+    def cancelPrefetchedSRWCalculations(self):
+        if not self.srw_prefetched_calculations is None:
+            for futures in self.srw_prefetched_calculations.values():
+                for future in futures: future.cancel()
+
+        self.srw_prefetched_calculations = None
+
+    def is_srw_cache_usable(self):
+        # electron beam sampled from phase space is random by definition, saving files needs the SRW arrays
+        return self.use_srw_cache > 0 and self.type_of_initialization != 2 and self.save_srw_result == 0
+
+    def get_srw_cache(self):
+        cache_directory = None if self.use_srw_cache < 2 else congruence.checkDir(os.path.join(self.srw_cache_directory, "srw_cache"))
+        max_memory_size = int(self.srw_cache_size*1024**2)
+
+        if APSUndulatorSource.srw_cache is None:
+            APSUndulatorSource.srw_cache = SRWResultsCache(max_memory_size=max_memory_size, cache_directory=cache_directory)
+        else:
+            APSUndulatorSource.srw_cache.max_memory_size = max_memory_size
+            APSUndulatorSource.srw_cache.cache_directory = cache_directory
+
+        return APSUndulatorSource.srw_cache
+
+    def get_srw_parameters(self, include_photon_energy=True):
+        if self.magnetic_field_from == 0:
+            By, Bx = self.magnetic_field_from_K()
+        else:
+            By = self.Bv
+            Bx = self.Bh
+
+        if self.type_of_initialization == 0:
+            moments = [0.0, 0.0, self.get_default_initial_z(), 0.0, 0.0]
+        else:
+            moments = [self.moment_x, self.moment_y, self.moment_z, self.moment_xp, self.moment_yp]
+
+        return {"magnetic_field" : [Bx, By,
+                                    self.initial_phase_horizontal, self.initial_phase_vertical,
+                                    self.symmetry_vs_longitudinal_position_horizontal, self.symmetry_vs_longitudinal_position_vertical,
+                                    self.undulator_period, self.number_of_periods,
+                                    self.horizontal_central_position, self.vertical_central_position, self.longitudinal_central_position],
+                "electron_beam"  : [self.electron_energy_in_GeV, self.electron_energy_spread, self.ring_current,
+                                    self.electron_beam_size_h, self.electron_beam_size_v,
+                                    self.electron_beam_divergence_h, self.electron_beam_divergence_v] + moments,
+                "mesh"           : list(self.get_source_slit_data(direction="b")) + \
+                                   [self.source_dimension_wf_distance] + \
+                                   ([self.get_photon_energy()] if include_photon_energy else []),
+                "precision"      : self.createCalculationPrecisionSettings(),
+                "propagation"    : [self.horizontal_range_modification_factor_at_resizing,
+                                    self.horizontal_resolution_modification_factor_at_resizing,
+                                    self.vertical_range_modification_factor_at_resizing,
+                                    self.vertical_resolution_modification_factor_at_resizing]}
+
+    def clearSRWCache(self):
+        if not APSUndulatorSource.srw_cache is None:
+            APSUndulatorSource.srw_cache.clear(clear_disk=True)
+
+    ####################################################################################
+    # SRW FILES
+    ####################################################################################
+
+    def checkSRWFilesFields(self):
+        congruence.checkFile(self.source_dimension_srw_file)
+        congruence.checkFile(self.angular_distribution_srw_file)
+
+    def loadSRWFiles(self):
+
+        self.checkSRWFilesFields()
+
+        x, z, intensity_source_dimension = self.loadNumpyFormat(self.source_dimension_srw_file)
+        x_first, z_first, intensity_angular_distribution = self.loadNumpyFormat(self.angular_distribution_srw_file)
+
+
+        # SWITCH FROM SRW METERS TO SHADOWOUI U.M.
+        x = x/self.workspace_units_to_m
+        z = z/self.workspace_units_to_m
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution
+
+    def checkSRWBinaryFilesFields(self):
+        congruence.checkFile(os.path.join(self.srw_distributions_directory, SRWDistributionsFile.HEADER_FILE))
+
+    def loadSRWBinaryFiles(self):
+        self.checkSRWBinaryFilesFields()
+
+        x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, self.integrated_flux = SRWDistributionsFile.read(self.srw_distributions_directory)
+
+        # SWITCH FROM SRW METERS TO SHADOWOUI U.M.
+        x = x/self.workspace_units_to_m
+        z = z/self.workspace_units_to_m
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution
+
+    def file_load(self, _fname, _read_labels=1):
+        data, allrange, arLabels, arUnits = load_srw_intensity_file(_fname, read_labels=_read_labels == 1)
+
+        return data, None, allrange, arLabels, arUnits
+
+    def loadNumpyFormat(self, filename):
+        data, dump, allrange, arLabels, arUnits = self.file_load(filename)
+
+        dim_x = allrange[5]
+        dim_y = allrange[8]
+        np_array = data.reshape((dim_y, dim_x))
+        np_array = np_array.transpose()
+        x_coordinates = numpy.linspace(allrange[3], allrange[4], dim_x)
+        y_coordinates = numpy.linspace(allrange[6], allrange[7], dim_y)
+
+        return x_coordinates, y_coordinates, np_array
+
+    ####################################################################################
+    # ASCII FILES
+    ####################################################################################
+
+    def checkASCIIFilesFields(self):
+        congruence.checkFile(self.x_positions_file)
+        congruence.checkFile(self.z_positions_file)
+        congruence.checkFile(self.x_divergences_file)
+        congruence.checkFile(self.z_divergences_file)
+
+        self.x_positions_factor = float(self.x_positions_factor)
+        self.z_positions_factor = float(self.z_positions_factor)
+        self.x_divergences_factor = float(self.x_divergences_factor)
+        self.z_divergences_factor = float(self.z_divergences_factor)
+
+        congruence.checkStrictlyPositiveNumber(self.x_positions_factor, "X Position Units to Workspace Units")
+        congruence.checkStrictlyPositiveNumber(self.z_positions_factor, "Z Position Units to Workspace Units")
+        congruence.checkStrictlyPositiveNumber(self.x_divergences_factor, "X Divergence Units to rad")
+        congruence.checkStrictlyPositiveNumber(self.z_divergences_factor, "Z Divergence Units to rad")
+
+    def loadASCIIFiles(self):
+        self.checkASCIIFilesFields()
+
+        x_positions = self.extract_distribution_from_file(distribution_file_name=self.x_positions_file)
+        z_positions = self.extract_distribution_from_file(distribution_file_name=self.z_positions_file)
+
+        x_positions[:, 0] *= self.x_positions_factor
+        z_positions[:, 0] *= self.z_positions_factor
+
+        x_divergences = self.extract_distribution_from_file(distribution_file_name=self.x_divergences_file)
+        z_divergences = self.extract_distribution_from_file(distribution_file_name=self.z_divergences_file)
+
+        x_divergences[:, 0] *= self.x_divergences_factor
+        z_divergences[:, 0] *= self.z_divergences_factor
+
+        x, z, intensity_source_dimension = self.combine_distributions(x_positions, z_positions, separable=True)
+        x_first, z_first, intensity_angular_distribution = self.combine_distributions(x_divergences, z_divergences, separable=True)
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution
+
+    def extract_distribution_from_file(self, distribution_file_name):
+        """
+        two columns (value, frequency) separated by spaces or by a comma, with optional comment lines (#): files
+        are parsed again only when their size or modification time change. Returns a new array at every call
+        """
+        try:
+            file_stat = os.stat(distribution_file_name)
+            file_key  = os.path.abspath(distribution_file_name)
+
+            cached = APSUndulatorSource.distribution_files_cache.get(file_key, None)
+
+            if not cached is None and cached[0] == file_stat.st_size and cached[1] == file_stat.st_mtime_ns:
+                distribution = cached[2]
+
+                APSUndulatorSource.distribution_files_cache.move_to_end(file_key)
+            else:
+                with open(distribution_file_name, "r") as distribution_file:
+                    rows = distribution_file.read().splitlines()
+
+                data_rows = [row for row in rows if not row.strip() == "" and not row.strip().startswith("#")]
+
+                if len(data_rows) == 0: raise Exception("Empty file")
+
+                # the separator is checked row by row: a comma separates exactly two values
+                for row in data_rows:
+                    if "," in row and [part.strip() == "" for part in row.split(",")] != [False, False]:
+                        raise Exception("Malformed file, must be: <value> <spaces or comma> <frequency>")
+
+                distribution = numpy.loadtxt([row.replace(",", " ") for row in data_rows], dtype=numpy.float64, ndmin=2)
+
+                if not distribution.shape[1] == 2: raise Exception("Malformed file, must be: <value> <spaces or comma> <frequency>")
+                if not numpy.all(numpy.isfinite(distribution)): raise Exception("Malformed file, values must be finite numbers")
+
+                APSUndulatorSource.distribution_files_cache[file_key] = (file_stat.st_size, file_stat.st_mtime_ns, distribution)
+                APSUndulatorSource.distribution_files_cache.move_to_end(file_key)
+
+                if len(APSUndulatorSource.distribution_files_cache) > APSUndulatorSource.DISTRIBUTION_FILES_CACHE_SIZE:
+                    APSUndulatorSource.distribution_files_cache.popitem(last=False)
+        except Exception as err:
+            raise Exception("Problems reading distribution file: {0}".format(err))
+
+        return distribution.copy() # the caller scales the values in place
+
+    def combine_distributions(self, distribution_x, distribution_y, separable=False):
+        """
+        2D intensity (x, y) from the 1D distributions, computed by broadcasting. Geometrical mean (0) and convolution (2)
+        are products of 1D factors: with separable=True they are returned as SeparableDistribution2D, without building
+        the 2D map
+        """
+        coord_x = distribution_x[:, 0]
+        coord_y = distribution_y[:, 0]
+
+        intensity_x = distribution_x[:, 1]
+        intensity_y = distribution_y[:, 1]
+
+        if self.combine_strategy == 0:
+            if separable and numpy.all(intensity_x >= 0) and numpy.all(intensity_y >= 0):
+                return coord_x, coord_y, SeparableDistribution2D(numpy.sqrt(intensity_x), numpy.sqrt(intensity_y))
+
+            convoluted_intensity = numpy.sqrt(intensity_x[:, numpy.newaxis]*intensity_y[numpy.newaxis, :])
+        elif self.combine_strategy == 1:
+            convoluted_intensity = numpy.sqrt(intensity_x[:, numpy.newaxis]**2 + intensity_y[numpy.newaxis, :]**2)
+        elif self.combine_strategy == 2:
+            # the 2D convolution of the two (constant along one axis) maps is the product of two 1D moving sums
+            convoluted_x = self.__moving_sum(intensity_x)
+            convoluted_y = self.__moving_sum(intensity_y)
+
+            if separable: return coord_x, coord_y, SeparableDistribution2D(numpy.abs(convoluted_x), numpy.abs(convoluted_y))
+
+            convoluted_intensity = numpy.outer(convoluted_x, convoluted_y)
+        elif self.combine_strategy == 3:
+            convoluted_intensity = 0.5*(intensity_x[:, numpy.newaxis] + intensity_y[numpy.newaxis, :])
+        else:
+            raise ValueError("Combine strategy not recognized")
+
+        return coord_x, coord_y, convoluted_intensity
+
+    @classmethod
+    def __moving_sum(cls, values):
+        # "same" part of the convolution of values with a window of ones of the same length (as convolve2d does)
+        size = len(values)
+
+        cumulated_values = numpy.concatenate((numpy.zeros(1), numpy.cumsum(values)))
+        positions        = numpy.arange(size) + (size - 1)//2
+
+        return cumulated_values[numpy.minimum(positions, size - 1) + 1] - cumulated_values[numpy.maximum(positions - size + 1, 0)]
@@ -61,6 +61,8 @@ from orangewidget.settings import Setting
 
 from orangecontrib.shadow.util.shadow_objects import ShadowBeam
 
+from orangecontrib.aps.util.srw_util import transform_srw_array
+
 class LoopPoint(widget.OWWidget):
 
     name = "Power Calculator"
@@ -170,20 +172,14 @@ class LoopPoint(widget.OWWidget):
 
         mesh_out = wfr.mesh
 
-        h_array=numpy.linspace(mesh_out.xStart, mesh_out.xFin, mesh_out.nx)*1e3 # in mm
-        v_array=numpy.linspace(mesh_out.yStart, mesh_out.yFin, mesh_out.ny)*1e3 # in mm
-
-        intensity_array = numpy.zeros((h_array.size, v_array.size))
-
         arI0 = srwlib.array("f", [0]*mesh_out.nx*mesh_out.ny) #"flat" array to take 2D intensity data
 
         srwlib.srwl.CalcIntFromElecField(arI0, wfr, 6, 1, 3, photon_energy, 0, 0)
 
-        data = numpy.ndarray(buffer=arI0, shape=(mesh_out.ny, mesh_out.nx),dtype=arI0.typecode)
+        h_array, v_array, intensity_array = transform_srw_array(arI0, mesh_out)
 
-        for ix in range(h_array.size):
-            for iy in range(v_array.size):
-                intensity_array[ix, iy] = data[iy,ix]
+        h_array *= 1e3 # in mm
+        v_array *= 1e3 # in mm
 
         return self.calculate_power(h_array, v_array, intensity_array, photon_energy_step)
 
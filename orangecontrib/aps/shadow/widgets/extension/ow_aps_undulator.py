@@ -45,14 +45,13 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # #########################################################################
 
-import numpy
-from numpy.matlib import repmat
-from scipy.signal import convolve2d
+import numpy, os, shutil, tempfile
 
 from silx.gui.plot import Plot2D
 
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QDialogButtonBox
 from PyQt5.QtGui import QPixmap, QPalette, QColor, QFont
+from PyQt5.QtCore import QTimer
 from PyQt5 import QtWidgets
 
 import orangecanvas.resources as resources
@@ -69,29 +68,23 @@ from syned.storage_ring.light_source import ElectronBeam, LightSource
 from syned.widget.widget_decorator import WidgetDecorator
 from syned.beamline.shape import Rectangle
 
-from srxraylib.util.inverse_method_sampler import Sampler2D
-
-from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowSource
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam
 from orangecontrib.shadow.widgets.gui.ow_generic_element import GenericElement
 
-from orangecontrib.aps.util.custom_distribution import CustomDistribution
+from orangecontrib.aps.util.srw_util import calculate_srw_intensity, get_srw_process_pool, SRWResultsCache, SRWEnergyScanStore
+from orangecontrib.aps.shadow.util.undulator_util import APSUndulatorSource
 
 import scipy.constants as codata
 
 m2ev = codata.c * codata.h / codata.e
 
 from oasys_srw.srwlib import *
-from oasys_srw.srwlib import array as srw_array
 
 VERTICAL = 1
 HORIZONTAL = 2
 BOTH = 3
 
-class Distribution:
-    POSITION = 0
-    DIVERGENCE = 1
-
-class APSUndulator(GenericElement):
+class APSUndulator(APSUndulatorSource, GenericElement):
 
     TABS_AREA_HEIGHT = 620
 
@@ -169,13 +162,24 @@ class APSUndulator(GenericElement):
     vertical_resolution_modification_factor_at_resizing    = Setting(5.0)
 
     kind_of_sampler = Setting(1)
+    sampler_interpolation = Setting(0)
     save_srw_result = Setting(0)
-    
+
+    parallel_srw_calculation = Setting(0)
+
+    use_srw_cache = Setting(1)
+    srw_cache_directory = Setting(".")
+    srw_cache_size = Setting(512)
+
     # SRW FILE INPUT
 
     source_dimension_srw_file     = Setting("intensity_source_dimension.dat")
     angular_distribution_srw_file = Setting("intensity_angular_distribution.dat")
 
+    # SRW BINARY FILES INPUT
+
+    srw_distributions_directory = Setting("srw_distributions")
+
     # ASCII FILE INPUT
 
     x_positions_file = Setting("x_positions.txt")
@@ -213,17 +217,10 @@ class APSUndulator(GenericElement):
     auto_energy = Setting(0.0)
     auto_harmonic_number = Setting(1)
 
-    energy_step = None
-    power_step = None
     start_event = True
-    compute_power = False
-    integrated_flux = None
     power_density = None
 
-    cumulated_energies = None
-    cumulated_integrated_flux = None
-    cumulated_power_density = None
-    cumulated_power = None
+    srw_precomputation = None
 
     def __init__(self, show_automatic_box=False):
         super().__init__(show_automatic_box=show_automatic_box)
@@ -270,11 +267,12 @@ class APSUndulator(GenericElement):
         tab_util = oasysgui.createTabPage(tabs_setting, "Utility")
 
         gui.comboBox(tab_spdiv, self, "distribution_source", label="Distribution Source", labelWidth=310,
-                     items=["SRW Calculation", "SRW Files", "ASCII Files"], orientation="horizontal", callback=self.set_DistributionSource)
+                     items=["SRW Calculation", "SRW Files", "ASCII Files", "SRW Binary Files"], orientation="horizontal", callback=self.set_DistributionSource)
 
         self.srw_box = oasysgui.widgetBox(tab_spdiv, "", addSpace=False, orientation="vertical", height=550)
         self.srw_files_box = oasysgui.widgetBox(tab_spdiv, "", addSpace=False, orientation="vertical", height=550)
         self.ascii_box = oasysgui.widgetBox(tab_spdiv, "", addSpace=False, orientation="vertical", height=550)
+        self.srw_binary_files_box = oasysgui.widgetBox(tab_spdiv, "", addSpace=False, orientation="vertical", height=550)
 
         self.set_DistributionSource()
 
@@ -352,12 +350,18 @@ class APSUndulator(GenericElement):
         tabs_srw = oasysgui.tabWidget(self.srw_box)
 
         gui.comboBox(self.srw_box, self, "kind_of_sampler", label="Random Generator", labelWidth=250,
-                     items=["Simple", "Accurate", "Accurate (SRIO)", ], orientation="horizontal")
+                     items=["Simple", "Accurate", "Accurate (SRIO)", ], orientation="horizontal", callback=self.set_KindOfSampler)
+
+        self.cb_sampler_interpolation = gui.comboBox(self.srw_box, self, "sampler_interpolation", label="Sub-pixel Interpolation", labelWidth=250,
+                                                     items=["No", "Uniform", "Bilinear"], orientation="horizontal")
+
+        self.set_KindOfSampler()
 
         gui.comboBox(self.srw_box, self, "save_srw_result", label="Save SRW results", labelWidth=310,
-                     items=["No", "Yes"], orientation="horizontal", callback=self.set_SaveFileSRW)
+                     items=["No", "Yes (ASCII)", "Yes (Binary)"], orientation="horizontal", callback=self.set_SaveFileSRW)
 
         self.save_file_box = oasysgui.widgetBox(self.srw_box, "", addSpace=False, orientation="vertical")
+        self.save_binary_file_box = oasysgui.widgetBox(self.srw_box, "", addSpace=False, orientation="vertical", height=55)
         self.save_file_box_empty = oasysgui.widgetBox(self.srw_box, "", addSpace=False, orientation="vertical", height=55)
 
         file_box = oasysgui.widgetBox(self.save_file_box, "", addSpace=False, orientation="horizontal", height=25)
@@ -372,6 +376,12 @@ class APSUndulator(GenericElement):
 
         gui.button(file_box, self, "...", callback=self.selectAngularDistributionFile)
 
+        file_box = oasysgui.widgetBox(self.save_binary_file_box, "", addSpace=False, orientation="horizontal", height=25)
+
+        self.le_srw_distributions_directory = oasysgui.lineEdit(file_box, self, "srw_distributions_directory", "Distributions Directory", labelWidth=140,  valueType=str, orientation="horizontal")
+
+        gui.button(file_box, self, "...", callback=self.selectSRWDistributionsDirectory)
+
         self.set_SaveFileSRW()
 
         tab_ls = oasysgui.createTabPage(tabs_srw, "Undulator Setting")
@@ -485,6 +495,9 @@ class APSUndulator(GenericElement):
         oasysgui.lineEdit(left_box_4, self, "vertical_range_modification_factor_at_resizing", "V range modification factor at resizing", labelWidth=290, valueType=float, orientation="horizontal")
         oasysgui.lineEdit(left_box_4, self, "vertical_resolution_modification_factor_at_resizing", "V resolution modification factor at resizing", labelWidth=290, valueType=float, orientation="horizontal")
 
+        gui.comboBox(tab_wf, self, "parallel_srw_calculation", label="Parallel Calculation of Size and Divergence", labelWidth=310,
+                     items=["No", "Yes"], orientation="horizontal")
+
         gui.comboBox(tab_wf, self, "auto_expand", label="Auto Expand Slit to Compensate Random Generator", labelWidth=310,
                      items=["No", "Yes"], orientation="horizontal", callback=self.set_auto_expand)
 
@@ -510,6 +523,16 @@ class APSUndulator(GenericElement):
 
         gui.button(file_box, self, "...", height=45, callback=self.selectAngularDistributionFile)
 
+        ####################################################################################
+        # SRW BINARY FILES
+
+        gui.separator(self.srw_binary_files_box)
+
+        file_box = oasysgui.widgetBox(self.srw_binary_files_box, "", addSpace=True, orientation="horizontal", height=45)
+
+        self.le_srw_distributions_directory = oasysgui.lineEdit(file_box, self, "srw_distributions_directory", "Distributions Directory", labelWidth=180,  valueType=str, orientation="vertical")
+
+        gui.button(file_box, self, "...", height=45, callback=self.selectSRWDistributionsDirectory)
 
         ####################################################################################
         # ASCII FILES
@@ -566,6 +589,25 @@ class APSUndulator(GenericElement):
         gui.button(button_box, self, "Set Kh value", callback=self.auto_set_undulator_H)
         gui.button(button_box, self, "Set Both K values", callback=self.auto_set_undulator_B)
 
+        left_box_2 = oasysgui.widgetBox(tab_util, "SRW Results Cache", addSpace=False, orientation="vertical")
+
+        gui.comboBox(left_box_2, self, "use_srw_cache", label="Reuse SRW Results", labelWidth=250,
+                     items=["No", "In Memory", "In Memory and on Disk"], orientation="horizontal", callback=self.set_SRWCache)
+
+        self.srw_cache_box = oasysgui.widgetBox(left_box_2, "", addSpace=False, orientation="vertical")
+
+        oasysgui.lineEdit(self.srw_cache_box, self, "srw_cache_size", "Max Memory Size [MB]", labelWidth=250, valueType=float, orientation="horizontal")
+
+        self.srw_cache_directory_box = oasysgui.widgetBox(self.srw_cache_box, "", addSpace=False, orientation="horizontal")
+
+        self.le_srw_cache_directory = oasysgui.lineEdit(self.srw_cache_directory_box, self, "srw_cache_directory", "Cache Directory", labelWidth=120, valueType=str, orientation="horizontal")
+
+        gui.button(self.srw_cache_directory_box, self, "...", callback=self.selectSRWCacheDirectory)
+
+        gui.button(self.srw_cache_box, self, "Clear Cache", callback=self.clearSRWCache)
+
+        self.set_SRWCache()
+
         gui.rubber(self.controlArea)
 
         cumulated_plot_tab = oasysgui.createTabPage(self.main_tabs, "Cumulated_Plots")
@@ -605,7 +647,7 @@ class APSUndulator(GenericElement):
         self.cumulated_tabs.setCurrentIndex(current_tab)
 
     def set_CumulatedPlotQuality(self):
-        if not self.cumulated_power is None:
+        if not self.cumulated_results is None:
             self.initializeCumulatedTabs()
 
             self.plot_cumulated_results(True)
@@ -659,9 +701,6 @@ class APSUndulator(GenericElement):
     def set_z0Default(self):
         self.moment_z = self.get_default_initial_z()
 
-    def get_default_initial_z(self):
-        return self.longitudinal_central_position-0.5*self.undulator_period*(self.number_of_periods + 8) # initial Longitudinal Coordinate (set before the ID)
-
     def auto_set_undulator_V(self):
         self.auto_set_undulator(VERTICAL)
 
@@ -760,6 +799,7 @@ class APSUndulator(GenericElement):
         self.srw_box.setVisible(self.distribution_source == 0)
         self.srw_files_box.setVisible(self.distribution_source == 1)
         self.ascii_box.setVisible(self.distribution_source == 2)
+        self.srw_binary_files_box.setVisible(self.distribution_source == 3)
 
         self.set_harmonic_energy()
 
@@ -769,8 +809,21 @@ class APSUndulator(GenericElement):
     def set_OptimizeSource(self):
         self.optimize_file_name_box.setVisible(self.optimize_source != 0)
 
+    def set_KindOfSampler(self):
+        self.cb_sampler_interpolation.setEnabled(self.kind_of_sampler == 0)
+
+    def set_SRWCache(self):
+        self.srw_cache_box.setVisible(self.use_srw_cache > 0)
+        self.srw_cache_directory_box.setVisible(self.use_srw_cache == 2)
+
+    def selectSRWCacheDirectory(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Select Cache Directory", directory=self.srw_cache_directory)
+
+        if directory: self.le_srw_cache_directory.setText(directory)
+
     def set_SaveFileSRW(self):
         self.save_file_box.setVisible(self.save_srw_result == 1)
+        self.save_binary_file_box.setVisible(self.save_srw_result == 2)
         self.save_file_box_empty.setVisible(self.save_srw_result == 0)
 
     def selectOptimizeFile(self):
@@ -782,6 +835,11 @@ class APSUndulator(GenericElement):
     def selectAngularDistributionFile(self):
         self.le_angular_distribution_srw_file.setText(oasysgui.selectFileFromDialog(self, self.angular_distribution_srw_file, "Open Angular Distribution File"))
 
+    def selectSRWDistributionsDirectory(self):
+        directory = QtWidgets.QFileDialog.getExistingDirectory(self, "Select SRW Distributions Directory", directory=self.srw_distributions_directory)
+
+        if directory: self.srw_distributions_directory = directory
+
     def selectXPositionsFile(self):
         self.le_x_positions_file.setText(oasysgui.selectFileFromDialog(self, self.x_positions_file, "Open X Positions File", file_extension_filter="*.dat, *.txt"))
 
@@ -860,37 +918,24 @@ class APSUndulator(GenericElement):
             self.fixWeirdShadowBug()
             ###########################################
 
-            shadow_src = ShadowSource.create_src()
-
-            self.populateFields(shadow_src)
-
             self.progressBarSet(10)
 
             self.setStatusMessage("Running SHADOW")
 
             write_begin_file, write_start_file, write_end_file = self.get_write_file_options()
 
-            beam_out = ShadowBeam.traceFromSource(shadow_src,
-                                                  write_begin_file=write_begin_file,
-                                                  write_start_file=write_start_file,
-                                                  write_end_file=write_end_file)
-
-            self.fix_Intensity(beam_out)
+            beam_out = self.traceShadowSource(write_begin_file=write_begin_file,
+                                              write_start_file=write_start_file,
+                                              write_end_file=write_end_file)
 
             self.progressBarSet(20)
 
-            if self.distribution_source == 0:
-                self.setStatusMessage("Running SRW")
-
-                x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, total_power = self.runSRWCalculation(do_cumulated_calculations)
-            elif self.distribution_source == 1:
-                self.setStatusMessage("Loading SRW files")
-
-                x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution = self.loadSRWFiles()
-            elif self.distribution_source == 2: # ASCII FILES
-                self.setStatusMessage("Loading Ascii files")
+            if self.distribution_source == 0:   self.setStatusMessage("Running SRW")
+            elif self.distribution_source == 1: self.setStatusMessage("Loading SRW files")
+            elif self.distribution_source == 2: self.setStatusMessage("Loading Ascii files")
+            elif self.distribution_source == 3: self.setStatusMessage("Loading SRW binary files")
 
-                x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution = self.loadASCIIFiles()
+            x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, total_power = self.getSourceDistributions(do_cumulated_calculations)
 
             beam_out.set_initial_flux(self.integrated_flux)
 
@@ -900,23 +945,7 @@ class APSUndulator(GenericElement):
 
             self.progressBarSet(60)
 
-            self.generate_user_defined_distribution_from_srw(beam_out=beam_out,
-                                                             coord_x=x,
-                                                             coord_z=z,
-                                                             intensity=intensity_source_dimension,
-                                                             distribution_type=Distribution.POSITION,
-                                                             kind_of_sampler=self.kind_of_sampler,
-                                                             seed=0 if self.seed==0 else self.seed+1)
-
-            self.progressBarSet(70)
-
-            self.generate_user_defined_distribution_from_srw(beam_out=beam_out,
-                                                             coord_x=x_first,
-                                                             coord_z=z_first,
-                                                             intensity=intensity_angular_distribution,
-                                                             distribution_type=Distribution.DIVERGENCE,
-                                                             kind_of_sampler=self.kind_of_sampler,
-                                                             seed=0 if self.seed==0 else self.seed+2)
+            self.applySourceDistributions(beam_out, x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution)
 
             self.setStatusMessage("Plotting Results")
 
@@ -927,12 +956,7 @@ class APSUndulator(GenericElement):
             self.setStatusMessage("")
 
             if self.compute_power and self.energy_step and total_power:
-                additional_parameters = {}
-
-                additional_parameters["total_power"]        = total_power
-                additional_parameters["photon_energy_step"] = self.energy_step
-
-                beam_out.setScanningData(ShadowBeam.ScanningData("photon_energy", self.energy, "Energy for Power Calculation", "eV", additional_parameters))
+                self.setPowerScanningData(beam_out, total_power)
 
             self.send("Beam", beam_out)
         except Exception as exception:
@@ -945,18 +969,18 @@ class APSUndulator(GenericElement):
     def sendNewBeam(self, trigger):
         self.compute_power = False
         self.energy_step = None
+        self.number_of_rays_step = None
 
         if trigger and trigger.new_object == True:
             do_cumulated_calculations = False
+            precompute_energy_values = None
+            prefetch_energy_values = None
 
             if trigger.has_additional_parameter("seed_increment"):
                 self.seed += trigger.get_additional_parameter("seed_increment")
 
             if not trigger.has_additional_parameter("start_event"):
-                self.cumulated_energies = None
-                self.cumulated_integrated_flux = None
-                self.cumulated_power_density = None
-                self.cumulated_power = None
+                self.cumulated_results = None
 
             if trigger.has_additional_parameter("energy_value") and trigger.has_additional_parameter("energy_step"):
                 self.compute_power = True
@@ -966,86 +990,52 @@ class APSUndulator(GenericElement):
                 do_cumulated_calculations = True
 
                 if trigger.has_additional_parameter("start_event") and trigger.get_additional_parameter("start_event") == True:
-                    self.cumulated_energies = None
-                    self.cumulated_integrated_flux = None
-                    self.cumulated_power_density = None
-                    self.cumulated_power = None
+                    self.cumulated_results = None
+                    self.cancelPrecomputedSRWCalculations()
+                    self.removeSRWEnergyScanStore()
+                    self.cancelPrefetchedSRWCalculations()
+
+                    if trigger.has_additional_parameter("precompute_energy_values"):
+                        precompute_energy_values = trigger.get_additional_parameter("precompute_energy_values")
 
                 self.energy = trigger.get_additional_parameter("energy_value")
                 self.energy_step = trigger.get_additional_parameter("energy_step")
                 self.power_step = trigger.get_additional_parameter("power_step")
                 self.start_event = trigger.get_additional_parameter("start_event")
 
+                if trigger.has_additional_parameter("number_of_rays"):
+                    self.number_of_rays_step = int(trigger.get_additional_parameter("number_of_rays"))
+
                 self.set_WFUseHarmonic()
                 self.set_DistributionSource()
                 self.set_SaveFileSRW()
 
-            self.runShadowSource(do_cumulated_calculations)
+                if trigger.has_additional_parameter("prefetch_energy_values"):
+                    prefetch_energy_values = trigger.get_additional_parameter("prefetch_energy_values")
 
-    def checkFields(self):
-        self.number_of_rays = congruence.checkPositiveNumber(self.number_of_rays, "Number of rays")
-        self.seed = congruence.checkPositiveNumber(self.seed, "Seed")
+            def run():
+                if not prefetch_energy_values is None:
+                    try:
+                        self.prefetchSRWDistributions(prefetch_energy_values)
+                    except Exception as exception:
+                        self.cancelPrefetchedSRWCalculations()
 
-        if self.use_harmonic == 0:
-            if self.distribution_source != 0: raise Exception("Harmonic Energy can be computed only for explicit SRW Calculation")
+                        if self.IS_DEVELOP: raise exception
 
-            self.harmonic_number = congruence.checkStrictlyPositiveNumber(self.harmonic_number, "Harmonic Number")
-        else:
-            self.energy = congruence.checkPositiveNumber(self.energy, "Photon Energy")
-
-        if self.optimize_source > 0:
-            self.max_number_of_rejected_rays = congruence.checkPositiveNumber(self.max_number_of_rejected_rays,
-                                                                             "Max number of rejected rays")
-            congruence.checkFile(self.optimize_file_name)
-
-    def populateFields(self, shadow_src):
-        shadow_src.src.NPOINT = self.number_of_rays if self.auto_expand==0 else (self.number_of_rays if self.auto_expand_rays==0 else int(numpy.ceil(self.number_of_rays*1.1)))
-        shadow_src.src.ISTAR1 = self.seed
-        shadow_src.src.F_OPD = 1
-        shadow_src.src.F_SR_TYPE = 0
-
-        shadow_src.src.FGRID = 0
-        shadow_src.src.IDO_VX = 0
-        shadow_src.src.IDO_VZ = 0
-        shadow_src.src.IDO_X_S = 0
-        shadow_src.src.IDO_Y_S = 0
-        shadow_src.src.IDO_Z_S = 0
-
-        shadow_src.src.FSOUR = 0 # spatial_type (point)
-        shadow_src.src.FDISTR = 1 # angular_distribution (flat)
-
-        shadow_src.src.HDIV1 = -1.0e-6
-        shadow_src.src.HDIV2 = 1.0e-6
-        shadow_src.src.VDIV1 = -1.0e-6
-        shadow_src.src.VDIV2 = 1.0e-6
-
-        shadow_src.src.FSOURCE_DEPTH = 1 # OFF
-
-        shadow_src.src.F_COLOR = 1 # single value
-        shadow_src.src.F_PHOT = 0 # eV , 1 Angstrom
-
-        shadow_src.src.PH1 = self.energy if self.use_harmonic==1 else self.resonance_energy(harmonic=self.harmonic_number)
-
-        shadow_src.src.F_POLAR = self.polarization
-
-        if self.polarization == 1:
-            shadow_src.src.F_COHER = self.coherent_beam
-            shadow_src.src.POL_ANGLE = self.phase_diff
-            shadow_src.src.POL_DEG = self.polarization_degree
-
-        shadow_src.src.F_OPD = 1
-        shadow_src.src.F_BOUND_SOUR = self.optimize_source
-        if self.optimize_source > 0:
-            shadow_src.src.FILE_BOUND = bytes(congruence.checkFileName(self.optimize_file_name), 'utf-8')
-        shadow_src.src.NTOTALPOINT = self.max_number_of_rejected_rays
-
-    # WEIRD MEMORY INITIALIZATION BY FORTRAN. JUST A FIX.
-    def fix_Intensity(self, beam_out):
-        if self.polarization == 0:
-            for index in range(0, len(beam_out._beam.rays)):
-                beam_out._beam.rays[index, 15] = 0
-                beam_out._beam.rays[index, 16] = 0
-                beam_out._beam.rays[index, 17] = 0
+                self.runShadowSource(do_cumulated_calculations)
+
+            if precompute_energy_values is None:
+                run()
+            else:
+                # the first step is traced when the precomputation is over
+                try:
+                    self.precomputeSRWDistributions(precompute_energy_values, on_finished=run)
+                except Exception as exception:
+                    QtWidgets.QMessageBox.critical(self, "Error", str(exception), QtWidgets.QMessageBox.Ok)
+
+                    if self.IS_DEVELOP: raise exception
+
+                    run()
 
     def cumulated_plot_data1D(self, dataX, dataY, plot_canvas_index, title="", xtitle="", ytitle=""):
         if self.cumulated_plot_canvas[plot_canvas_index] is None:
@@ -1112,12 +1102,15 @@ class APSUndulator(GenericElement):
             try:
                 self.cumulated_view_type_combo.setEnabled(False)
 
-                total_power = str(round(self.cumulated_power[-1], 2))
+                cumulated_energies = self.cumulated_results.get_records("energy")
+                cumulated_power    = numpy.cumsum(self.cumulated_results.get_records("power"))
 
-                self.cumulated_plot_data1D(self.cumulated_energies, self.cumulated_integrated_flux, 0, "Spectral Flux", "Energy [eV]", "Flux [ph/s/0.1%BW]")
-                self.cumulated_plot_data1D(self.cumulated_energies, self.cumulated_power, 1,
+                total_power = str(round(self.cumulated_results.get_total("power"), 2))
+
+                self.cumulated_plot_data1D(cumulated_energies, self.cumulated_results.get_records("integrated_flux"), 0, "Spectral Flux", "Energy [eV]", "Flux [ph/s/0.1%BW]")
+                self.cumulated_plot_data1D(cumulated_energies, cumulated_power, 1,
                                            "Cumulated Power (Total = " + total_power + " W)", "Energy [eV]", "Power [W]")
-                self.cumulated_plot_data2D(self.cumulated_power_density, self.dataX, self.dataY, 2,
+                self.cumulated_plot_data2D(self.cumulated_results.get_power_density(), self.dataX, self.dataY, 2,
                                            "Power Density [W/mm^2] (Total Power = " + total_power + " W)", "X [mm]", "Y [mm]")
 
                 self.cumulated_view_type_combo.setEnabled(True)
@@ -1126,561 +1119,123 @@ class APSUndulator(GenericElement):
 
                 raise Exception("Data not plottable: exception: " + str(e))
 
-    ####################################################################################
-    # SRW CALCULATION
-    ####################################################################################
-
-    def checkSRWFields(self):
-
-        congruence.checkPositiveNumber(self.Kh, "Horizontal K")
-        congruence.checkPositiveNumber(self.Kv, "Vertical K")
-        congruence.checkStrictlyPositiveNumber(self.undulator_period, "Period Length")
-        congruence.checkStrictlyPositiveNumber(self.number_of_periods, "Number of Periods")
-
-        congruence.checkStrictlyPositiveNumber(self.electron_energy_in_GeV, "Energy")
-        congruence.checkPositiveNumber(self.electron_energy_spread, "Energy Spread")
-        congruence.checkStrictlyPositiveNumber(self.ring_current, "Ring Current")
-
-        congruence.checkPositiveNumber(self.electron_beam_size_h       , "Horizontal Beam Size")
-        congruence.checkPositiveNumber(self.electron_beam_divergence_h , "Vertical Beam Size")
-        congruence.checkPositiveNumber(self.electron_beam_size_v       , "Horizontal Beam Divergence")
-        congruence.checkPositiveNumber(self.electron_beam_divergence_v , "Vertical Beam Divergence")
-
-
-        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_h_slit_gap, "Wavefront Propagation H Slit Gap")
-        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_v_slit_gap, "Wavefront Propagation V Slit Gap")
-        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_h_slit_points, "Wavefront Propagation H Slit Points")
-        congruence.checkStrictlyPositiveNumber(self.source_dimension_wf_v_slit_points, "Wavefront Propagation V Slit Points")
-        congruence.checkGreaterOrEqualThan(self.source_dimension_wf_distance, self.get_minimum_propagation_distance(),
-                                           "Wavefront Propagation Distance", "Minimum Distance out of the Source: " + str(self.get_minimum_propagation_distance()))
-
-        if self.save_srw_result == 1:
-            congruence.checkDir(self.source_dimension_srw_file)
-            congruence.checkDir(self.angular_distribution_srw_file)
-
-    def get_minimum_propagation_distance(self):
-        return round(self.get_source_length()*1.01, 6)
-
-    def get_source_length(self):
-        return self.undulator_period*self.number_of_periods
-
-    def magnetic_field_from_K(self):
-        Bv = self.Kv * 2 * pi * codata.m_e * codata.c / (codata.e * self.undulator_period)
-        Bh = self.Kh * 2 * pi * codata.m_e * codata.c / (codata.e * self.undulator_period)
+    def onDeleteWidget(self):
+        self.cancelPrecomputedSRWCalculations()
+        self.removeSRWEnergyScanStore()
 
-        return Bv, Bh
-
-    def createUndulator(self):
-        #***********Undulator
-        if self.magnetic_field_from == 0:
-            By, Bx = self.magnetic_field_from_K() #Peak Vertical field [T]
-        else:
-            By = self.Bv
-            Bx = self.Bh
-
-        symmetry_vs_longitudinal_position_horizontal = 1 if self.symmetry_vs_longitudinal_position_horizontal == 0 else -1
-        symmetry_vs_longitudinal_position_vertical = 1 if self.symmetry_vs_longitudinal_position_vertical == 0 else -1
-
-        und = SRWLMagFldU([SRWLMagFldH(1, 'h',
-                                       _B=Bx,
-                                       _ph=self.initial_phase_horizontal,
-                                       _s=symmetry_vs_longitudinal_position_horizontal,
-                                       _a=1.0),
-                           SRWLMagFldH(1, 'v',
-                                       _B=By,
-                                       _ph=self.initial_phase_vertical,
-                                       _s=symmetry_vs_longitudinal_position_vertical,
-                                       _a=1)],
-                          self.undulator_period, self.number_of_periods) #Planar Undulator
-
-        magFldCnt = SRWLMagFldC(_arMagFld=[und],
-                                _arXc = array('d', [self.horizontal_central_position]),
-                                _arYc = array('d', [self.vertical_central_position]),
-                                _arZc = array('d', [self.longitudinal_central_position]))#Container of all Field Elements
-
-        return magFldCnt
-
-    def createElectronBeam(self, distribution_type=Distribution.DIVERGENCE):
-        #***********Electron Beam
-        elecBeam = SRWLPartBeam()
-
-        if self.type_of_initialization == 0: # zero
-            self.moment_x = 0.0
-            self.moment_y = 0.0
-            self.moment_z = self.get_default_initial_z()
-            self.moment_xp = 0.0
-            self.moment_yp = 0.0
-        elif self.type_of_initialization == 2: # sampled
-            self.moment_x = numpy.random.normal(0.0, self.electron_beam_size_h)
-            self.moment_y = numpy.random.normal(0.0, self.electron_beam_size_v)
-            self.moment_z = self.get_default_initial_z()
-            self.moment_xp = numpy.random.normal(0.0, self.electron_beam_divergence_h)
-            self.moment_yp = numpy.random.normal(0.0, self.electron_beam_divergence_v)
-
-        elecBeam.partStatMom1.x = self.moment_x
-        elecBeam.partStatMom1.y = self.moment_y
-        elecBeam.partStatMom1.z = self.moment_z
-        elecBeam.partStatMom1.xp = self.moment_xp
-        elecBeam.partStatMom1.yp = self.moment_yp
-        elecBeam.partStatMom1.gamma = self.gamma()
-
-        elecBeam.Iavg = self.ring_current #Average Current [A]
-
-        #2nd order statistical moments
-        elecBeam.arStatMom2[0] = 0 if distribution_type==Distribution.DIVERGENCE else (self.electron_beam_size_h)**2 #<(x-x0)^2>
-        elecBeam.arStatMom2[1] = 0
-        elecBeam.arStatMom2[2] = (self.electron_beam_divergence_h)**2 #<(x'-x'0)^2>
-        elecBeam.arStatMom2[3] = 0 if distribution_type==Distribution.DIVERGENCE else (self.electron_beam_size_v)**2 #<(y-y0)^2>
-        elecBeam.arStatMom2[4] = 0
-        elecBeam.arStatMom2[5] = (self.electron_beam_divergence_v)**2 #<(y'-y'0)^2>
-        # energy spread
-        elecBeam.arStatMom2[10] = (self.electron_energy_spread)**2 #<(E-E0)^2>/E0^2
-
-        return elecBeam
-
-    def get_source_slit_data(self, direction="b"):
-        if self.auto_expand==1:
-            source_dimension_wf_h_slit_points = int(numpy.ceil(0.55*self.source_dimension_wf_h_slit_points)*2)
-            source_dimension_wf_v_slit_points = int(numpy.ceil(0.55*self.source_dimension_wf_v_slit_points)*2)
-            source_dimension_wf_h_slit_gap = self.source_dimension_wf_h_slit_gap*1.1
-            source_dimension_wf_v_slit_gap = self.source_dimension_wf_v_slit_gap*1.1
-        else:
-            source_dimension_wf_h_slit_points = self.source_dimension_wf_h_slit_points
-            source_dimension_wf_v_slit_points = self.source_dimension_wf_v_slit_points
-            source_dimension_wf_h_slit_gap = self.source_dimension_wf_h_slit_gap
-            source_dimension_wf_v_slit_gap = self.source_dimension_wf_v_slit_gap
-
-        if direction=="h":   return source_dimension_wf_h_slit_points, source_dimension_wf_h_slit_gap
-        elif direction=="v": return source_dimension_wf_v_slit_points, source_dimension_wf_v_slit_gap
-        else:                return source_dimension_wf_h_slit_points, source_dimension_wf_h_slit_gap, source_dimension_wf_v_slit_points, source_dimension_wf_v_slit_gap
-
-    def createInitialWavefrontMesh(self, elecBeam):
-        #****************** Initial Wavefront
-        wfr = SRWLWfr() #For intensity distribution at fixed photon energy
-
-        source_dimension_wf_h_slit_points, \
-        source_dimension_wf_h_slit_gap, \
-        source_dimension_wf_v_slit_points, \
-        source_dimension_wf_v_slit_gap = self.get_source_slit_data(direction="b")
-
-        wfr.allocate(1, source_dimension_wf_h_slit_points, source_dimension_wf_v_slit_points) #Numbers of points vs Photon Energy, Horizontal and Vertical Positions
-        wfr.mesh.zStart = self.source_dimension_wf_distance - self.longitudinal_central_position #Longitudinal Position [m] from Center of Straight Section at which SR has to be calculated
-        wfr.mesh.eStart = self.energy if self.use_harmonic==1 else self.resonance_energy(harmonic=self.harmonic_number)  #Initial Photon Energy [eV]
-        wfr.mesh.eFin = wfr.mesh.eStart #Final Photon Energy [eV]
-
-        wfr.mesh.xStart = -0.5*source_dimension_wf_h_slit_gap #Initial Horizontal Position [m]
-        wfr.mesh.xFin = -1 * wfr.mesh.xStart #0.00015 #Final Horizontal Position [m]
-        wfr.mesh.yStart = -0.5*source_dimension_wf_v_slit_gap #Initial Vertical Position [m]
-        wfr.mesh.yFin = -1 * wfr.mesh.yStart#0.00015 #Final Vertical Position [m]
-
-        wfr.partBeam = elecBeam
-
-        return wfr
-
-    def createCalculationPrecisionSettings(self):
-        #***********Precision Parameters for SR calculation
-        meth = 1 #SR calculation method: 0- "manual", 1- "auto-undulator", 2- "auto-wiggler"
-        relPrec = 0.01 #relative precision
-        zStartInteg = 0 #longitudinal position to start integration (effective if < zEndInteg)
-        zEndInteg = 0 #longitudinal position to finish integration (effective if > zStartInteg)
-        npTraj = 100000 #Number of points for trajectory calculation
-        useTermin = 1 #Use "terminating terms" (i.e. asymptotic expansions at zStartInteg and zEndInteg) or not (1 or 0 respectively)
-        arPrecParSpec = [meth, relPrec, zStartInteg, zEndInteg, npTraj, useTermin, 0]
-
-        return arPrecParSpec
-
-    def createBeamlineSourceDimension(self, wfr):
-        #***************** Optical Elements and Propagation Parameters
-
-        opDrift = SRWLOptD(-self.source_dimension_wf_distance) # back to the center of the undulator
-        ppDrift = [0, 0, 1., 1, 0,
-                   self.horizontal_range_modification_factor_at_resizing,
-                   self.horizontal_resolution_modification_factor_at_resizing,
-                   self.vertical_range_modification_factor_at_resizing,
-                   self.vertical_resolution_modification_factor_at_resizing,
-                   0, 0, 0]
-
-        return SRWLOptC([opDrift],[ppDrift])
-
-
-    def transform_srw_array(self, output_array, mesh):
-        h_array = numpy.linspace(mesh.xStart, mesh.xFin, mesh.nx)
-        v_array = numpy.linspace(mesh.yStart, mesh.yFin, mesh.ny)
-
-        intensity_array = numpy.zeros((h_array.size, v_array.size))
-
-        tot_len = int(mesh.ny * mesh.nx)
-        len_output_array = len(output_array)
-
-        if len_output_array > tot_len:
-            output_array = numpy.array(output_array[0:tot_len])
-        elif len_output_array < tot_len:
-            aux_array = srw_array('d', [0] * len_output_array)
-            for i in range(len_output_array): aux_array[i] = output_array[i]
-            output_array = numpy.array(srw_array(aux_array))
-        else:
-            output_array = numpy.array(output_array)
-
-        output_array = output_array.reshape(mesh.ny, mesh.nx)
-
-        for ix in range(mesh.nx):
-            for iy in range(mesh.ny):
-                intensity_array[ix, iy] = output_array[iy, ix]
-
-        return h_array, v_array, intensity_array
-
-
-    def runSRWCalculation(self, do_cumulated_calculations=False):
-
-        self.checkSRWFields()
-
-        magFldCnt = self.createUndulator()
-        elecBeam = self.createElectronBeam(distribution_type=Distribution.DIVERGENCE)
-        wfr = self.createInitialWavefrontMesh(elecBeam)
-
-        arPrecParSpec = self.createCalculationPrecisionSettings()
-
-        # This is the convergence parameter. Higher is more accurate but slower!!
-        # 0.2 is used in the original example. But I think it should be higher. The calculation may then however need too much memory.
-        sampFactNxNyForProp = 0.0 #0.6 #sampling factor for adjusting nx, ny (effective if > 0)
-
-        # 1 calculate intensity distribution ME convoluted for dimension size
-
-        arPrecParSpec[6] = sampFactNxNyForProp #sampling factor for adjusting nx, ny (effective if > 0)
-        srwl.CalcElecFieldSR(wfr, 0, magFldCnt, arPrecParSpec)
-
-        arI = array('f', [0]*wfr.mesh.nx*wfr.mesh.ny) #"flat" 2D array to take intensity data
-        srwl.CalcIntFromElecField(arI, wfr, 6, 1, 3, wfr.mesh.eStart, 0, 0)
-
-        # from radiation at the slit we can calculate Angular Distribution and Power
-
-        x, z, intensity_angular_distribution = self.transform_srw_array(arI, wfr.mesh)
-
-        dx = (x[1] - x[0]) * 1e3  # mm for power computations
-        dy = (z[1] - z[0]) * 1e3
-
-        self.integrated_flux = intensity_angular_distribution.sum()*dx*dy
-
-        if self.compute_power:
-            total_power = self.power_step if self.power_step > 0 else self.integrated_flux * (1e3 * self.energy_step * codata.e)
-        else:
-            total_power = None
-
-        if self.compute_power and do_cumulated_calculations:
-            current_energy          = numpy.ones(1) * self.energy
-            current_integrated_flux = numpy.ones(1) * self.integrated_flux
-            current_power_density   = intensity_angular_distribution.copy() * (1e3 * self.energy_step * codata.e)
-            current_power           = total_power
-
-            if self.cumulated_energies is None:
-                self.cumulated_energies        = current_energy
-                self.cumulated_integrated_flux = current_integrated_flux
-                self.cumulated_power_density   = current_power_density
-                self.cumulated_power           = numpy.ones(1) * (current_power)
-            else:
-                self.cumulated_energies        = numpy.append(self.cumulated_energies,  current_energy)
-                self.cumulated_integrated_flux = numpy.append(self.cumulated_integrated_flux,  current_integrated_flux)
-                self.cumulated_power_density  += current_power_density
-                self.cumulated_power           = numpy.append(self.cumulated_power,  numpy.ones(1) * (self.cumulated_power[-1] + current_power))
-
-        distance = self.source_dimension_wf_distance # relative to the center of the undulator
-
-        x_first = numpy.arctan(x/distance)
-        z_first = numpy.arctan(z/distance)
-
-        wfrAngDist = self.createInitialWavefrontMesh(elecBeam)
-        wfrAngDist.mesh.xStart = numpy.arctan(wfr.mesh.xStart/distance)
-        wfrAngDist.mesh.xFin   = numpy.arctan(wfr.mesh.xFin  /distance)
-        wfrAngDist.mesh.yStart = numpy.arctan(wfr.mesh.yStart/distance)
-        wfrAngDist.mesh.yFin   = numpy.arctan(wfr.mesh.yFin  /distance)
-
-        if self.save_srw_result == 1: srwl_uti_save_intens_ascii(arI, wfrAngDist.mesh, self.angular_distribution_srw_file)
-
-        # for source dimension, back propagation to the source central position
-        elecBeam    = self.createElectronBeam(distribution_type=Distribution.POSITION)
-        wfr         = self.createInitialWavefrontMesh(elecBeam)
-        optBLSouDim = self.createBeamlineSourceDimension(wfr)
-
-        srwl.CalcElecFieldSR(wfr, 0, magFldCnt, arPrecParSpec)
-        srwl.PropagElecField(wfr, optBLSouDim)
-
-        arI = array('f', [0]*wfr.mesh.nx*wfr.mesh.ny) #"flat" 2D array to take intensity data
-        srwl.CalcIntFromElecField(arI, wfr, 6, 1, 3, wfr.mesh.eStart, 0, 0)
-
-        if self.save_srw_result == 1: srwl_uti_save_intens_ascii(arI, wfr.mesh, self.source_dimension_srw_file)
-
-        x, z, intensity_source_dimension = self.transform_srw_array(arI, wfr.mesh)
-
-        # SWITCH FROM SRW METERS TO SHADOWOUI U.M.
-        x /= self.workspace_units_to_m
-        z /= self.workspace_units_to_m
-
-        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, total_power
-
-
-    def generate_user_defined_distribution_from_srw(self,
-                                                    beam_out,
-                                                    coord_x,
-                                                    coord_z,
-                                                    intensity,
-                                                    distribution_type=Distribution.POSITION,
-                                                    kind_of_sampler=2,
-                                                    seed=0):
-        if kind_of_sampler == 2:
-            s2d = Sampler2D(intensity, coord_x, coord_z)
-
-            samples_x, samples_z = s2d.get_n_sampled_points(len(beam_out._beam.rays))
-
-            if distribution_type == Distribution.POSITION:
-                beam_out._beam.rays[:, 0] = samples_x
-                beam_out._beam.rays[:, 2] = samples_z
-
-            elif distribution_type == Distribution.DIVERGENCE:
-                alpha_x = samples_x
-                alpha_z = samples_z
-
-                beam_out._beam.rays[:, 3] =  numpy.cos(alpha_z)*numpy.sin(alpha_x)
-                beam_out._beam.rays[:, 4] =  numpy.cos(alpha_z)*numpy.cos(alpha_x)
-                beam_out._beam.rays[:, 5] =  numpy.sin(alpha_z)
-        elif kind_of_sampler == 0:
-            pdf = numpy.abs(intensity/numpy.max(intensity))
-            pdf /= pdf.sum()
-
-            distribution = CustomDistribution(pdf, seed=seed)
-
-            sampled = distribution(len(beam_out._beam.rays))
-
-            min_value_x = numpy.min(coord_x)
-            step_x = numpy.abs(coord_x[1]-coord_x[0])
-            min_value_z = numpy.min(coord_z)
-            step_z = numpy.abs(coord_z[1]-coord_z[0])
-
-            if distribution_type == Distribution.POSITION:
-                beam_out._beam.rays[:, 0] = min_value_x + sampled[0, :]*step_x
-                beam_out._beam.rays[:, 2] = min_value_z + sampled[1, :]*step_z
-
-            elif distribution_type == Distribution.DIVERGENCE:
-                alpha_x = min_value_x + sampled[0, :]*step_x
-                alpha_z = min_value_z + sampled[1, :]*step_z
-
-                beam_out._beam.rays[:, 3] =  numpy.cos(alpha_z)*numpy.sin(alpha_x)
-                beam_out._beam.rays[:, 4] =  numpy.cos(alpha_z)*numpy.cos(alpha_x)
-                beam_out._beam.rays[:, 5] =  numpy.sin(alpha_z)
-        elif kind_of_sampler == 1:
-            min_x = numpy.min(coord_x)
-            max_x = numpy.max(coord_x)
-            delta_x = max_x - min_x
-
-            min_z = numpy.min(coord_z)
-            max_z = numpy.max(coord_z)
-            delta_z = max_z - min_z
-
-            dim_x = len(coord_x)
-            dim_z = len(coord_z)
-
-            from orangecontrib.aps.util.random_distributions import Distribution2D, Grid2D, distribution_from_grid
-
-            grid = Grid2D((dim_x, dim_z))
-            grid[..., ...] = intensity.tolist()
-
-            d = Distribution2D(distribution_from_grid(grid, dim_x, dim_z), (0, 0), (dim_x, dim_z))
-
-            samples = d.get_samples(len(beam_out._beam.rays), seed)
-
-            if distribution_type == Distribution.POSITION:
-                beam_out._beam.rays[:, 0] = min_x + samples[:, 0] * delta_x
-                beam_out._beam.rays[:, 2] = min_z + samples[:, 1] * delta_z
-
-            elif distribution_type == Distribution.DIVERGENCE:
-                alpha_x = min_x + samples[:, 0] * delta_x
-                alpha_z = min_z + samples[:, 1] * delta_z
-
-                beam_out._beam.rays[:, 3] = numpy.cos(alpha_z) * numpy.sin(alpha_x)
-                beam_out._beam.rays[:, 4] = numpy.cos(alpha_z) * numpy.cos(alpha_x)
-                beam_out._beam.rays[:, 5] = numpy.sin(alpha_z)
-
-        else:
-            raise ValueError("Sampler not recognized")
-        
-    def gamma(self):
-        return 1e9*self.electron_energy_in_GeV / (codata.m_e *  codata.c**2 / codata.e)
-
-    def resonance_energy(self, theta_x=0.0, theta_z=0.0, harmonic=1):
-        gamma = self.gamma()
-
-        wavelength = (self.undulator_period / (2.0*gamma **2)) * \
-                     (1 + self.Kv**2 / 2.0 + self.Kh**2 / 2.0 + \
-                      gamma**2 * (theta_x**2 + theta_z ** 2))
-
-        wavelength /= harmonic
-
-        return m2ev/wavelength
+        super().onDeleteWidget()
 
     ####################################################################################
-    # SRW FILES
+    # SRW CALCULATION
     ####################################################################################
 
-    def checkSRWFilesFields(self):
-        congruence.checkFile(self.source_dimension_srw_file)
-        congruence.checkFile(self.angular_distribution_srw_file)
-
-    def loadSRWFiles(self):
-
-        self.checkSRWFilesFields()
-
-        x, z, intensity_source_dimension = self.loadNumpyFormat(self.source_dimension_srw_file)
-        x_first, z_first, intensity_angular_distribution = self.loadNumpyFormat(self.angular_distribution_srw_file)
-
-
-        # SWITCH FROM SRW METERS TO SHADOWOUI U.M.
-        x = x/self.workspace_units_to_m
-        z = z/self.workspace_units_to_m
+    def precomputeSRWDistributions(self, energies, on_finished):
+        """
+        computes the SRW distributions of all the energies of the scan in the SRW process pool, into a store in a new
+        temporary directory: the futures are polled by a timer, without blocking the event loop, and on_finished is
+        called at the end (also when the precomputation fails)
+        """
+        self.cancelPrecomputedSRWCalculations()
+        self.removeSRWEnergyScanStore()
 
-        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution
-
-
-    def file_load(self, _fname, _read_labels=1):
-        nLinesHead = 11
-        hlp = []
-
-        with open(_fname,'r') as f:
-            for i in range(nLinesHead):
-                hlp.append(f.readline())
-
-        ne, nx, ny = [int(hlp[i].replace('#','').split()[0]) for i in [3,6,9]]
-        ns = 1
-        testStr = hlp[nLinesHead - 1]
-        if testStr[0] == '#':
-            ns = int(testStr.replace('#','').split()[0])
-
-        e0,e1,x0,x1,y0,y1 = [float(hlp[i].replace('#','').split()[0]) for i in [1,2,4,5,7,8]]
-
-        data = numpy.squeeze(numpy.loadtxt(_fname, dtype=numpy.float64)) #get data from file (C-aligned flat)
-
-        allrange = e0, e1, ne, x0, x1, nx, y0, y1, ny
-
-        arLabels = ['Photon Energy', 'Horizontal Position', 'Vertical Position', 'Intensity']
-        arUnits = ['eV', 'm', 'm', 'ph/s/.1%bw/mm^2']
-
-        if _read_labels:
-            arTokens = hlp[0].split(' [')
-            arLabels[3] = arTokens[0].replace('#','')
-            arUnits[3] = '';
-            if len(arTokens) > 1:
-                arUnits[3] = arTokens[1].split('] ')[0]
-
-            for i in range(3):
-                arTokens = hlp[i*3 + 1].split()
-                nTokens = len(arTokens)
-                nTokensLabel = nTokens - 3
-                nTokensLabel_mi_1 = nTokensLabel - 1
-                strLabel = ''
-                for j in range(nTokensLabel):
-                    strLabel += arTokens[j + 2]
-                    if j < nTokensLabel_mi_1: strLabel += ' '
-                arLabels[i] = strLabel
-                arUnits[i] = arTokens[nTokens - 1].replace('[','').replace(']','')
+        self.checkSRWFields()
 
-        return data, None, allrange, arLabels, arUnits
+        if self.type_of_initialization == 2: raise ValueError("SRW distributions cannot be precomputed with the electron beam sampled from phase space")
 
-    def loadNumpyFormat(self, filename):
-        data, dump, allrange, arLabels, arUnits = self.file_load(filename)
+        directory = tempfile.mkdtemp(prefix="srw_energy_scan_", dir=congruence.checkDir(self.srw_cache_directory))
 
-        dim_x = allrange[5]
-        dim_y = allrange[8]
-        np_array = data.reshape((dim_y, dim_x))
-        np_array = np_array.transpose()
-        x_coordinates = numpy.linspace(allrange[3], allrange[4], dim_x)
-        y_coordinates = numpy.linspace(allrange[6], allrange[7], dim_y)
+        try:
+            srw_energy_scan_store = SRWEnergyScanStore(directory, SRWResultsCache.get_key(self.get_srw_parameters(include_photon_energy=False)), energies)
+        except:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
 
-        return x_coordinates, y_coordinates, np_array
+        timer = QTimer(self)
+        timer.setInterval(50)
+        timer.timeout.connect(self.pollPrecomputedSRWCalculations)
 
-    ####################################################################################
-    # ASCII FILES
-    ####################################################################################
+        self.srw_precomputation = {"store"              : srw_energy_scan_store,
+                                   "energies_to_submit" : list(energies),
+                                   "number_of_energies" : len(energies),
+                                   "running"            : {},
+                                   "completed"          : 0,
+                                   "timer"              : timer,
+                                   "on_finished"        : on_finished}
 
-    def checkASCIIFilesFields(self):
-        congruence.checkFile(self.x_positions_file)
-        congruence.checkFile(self.z_positions_file)
-        congruence.checkFile(self.x_divergences_file)
-        congruence.checkFile(self.z_divergences_file)
+        self.setStatusMessage("Precomputing SRW distributions")
 
-        self.x_positions_factor = float(self.x_positions_factor)
-        self.z_positions_factor = float(self.z_positions_factor)
-        self.x_divergences_factor = float(self.x_divergences_factor)
-        self.z_divergences_factor = float(self.z_divergences_factor)
+        timer.start()
 
-        congruence.checkStrictlyPositiveNumber(self.x_positions_factor, "X Position Units to Workspace Units")
-        congruence.checkStrictlyPositiveNumber(self.z_positions_factor, "Z Position Units to Workspace Units")
-        congruence.checkStrictlyPositiveNumber(self.x_divergences_factor, "X Divergence Units to rad")
-        congruence.checkStrictlyPositiveNumber(self.z_divergences_factor, "Z Divergence Units to rad")
+    def pollPrecomputedSRWCalculations(self):
+        precomputation = self.srw_precomputation
 
-    def loadASCIIFiles(self):
-        self.checkASCIIFilesFields()
+        if precomputation is None: return
 
-        x_positions = self.extract_distribution_from_file(distribution_file_name=self.x_positions_file)
-        z_positions = self.extract_distribution_from_file(distribution_file_name=self.z_positions_file)
+        srw_energy_scan_store = precomputation["store"]
+        energies_to_submit    = precomputation["energies_to_submit"]
+        running               = precomputation["running"]
+        max_running           = 2*os.cpu_count() # wavefronts are allocated only when submitted: limits the memory
 
-        x_positions[:, 0] *= self.x_positions_factor
-        z_positions[:, 0] *= self.z_positions_factor
+        finished = True
 
-        x_divergences = self.extract_distribution_from_file(distribution_file_name=self.x_divergences_file)
-        z_divergences = self.extract_distribution_from_file(distribution_file_name=self.z_divergences_file)
+        try:
+            for energy in [energy for energy, futures in running.items() if futures[0].done() and futures[1].done()]:
+                future_angular_distribution, future_source_dimension = running.pop(energy)
 
-        x_divergences[:, 0] *= self.x_divergences_factor
-        z_divergences[:, 0] *= self.z_divergences_factor
+                arIAngDist, meshAngDist = future_angular_distribution.result()
+                arISouDim, meshSouDim   = future_source_dimension.result()
 
-        x, z, intensity_source_dimension = self.combine_distributions(x_positions, z_positions)
-        x_first, z_first, intensity_angular_distribution = self.combine_distributions(x_divergences, z_divergences)
+                srw_energy_scan_store.put(energy, self.processSRWIntensities(arIAngDist, meshAngDist, arISouDim, meshSouDim))
 
-        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution
+                precomputation["completed"] += 1
 
+                self.setStatusMessage("Precomputing SRW distributions: " + str(precomputation["completed"]) + " of " + str(precomputation["number_of_energies"]))
 
-    def extract_distribution_from_file(self, distribution_file_name):
-        distribution = []
+            srw_process_pool = get_srw_process_pool()
 
-        try:
-            distribution_file = open(distribution_file_name, "r")
+            while len(energies_to_submit) > 0 and len(running) < max_running:
+                energy = energies_to_submit.pop(0)
 
-            rows = distribution_file.readlines()
+                magFldCnt, wfrAngDist, wfrSouDim, optBLSouDim, arPrecParSpec = self.prepareSRWCalculations(energy)
 
-            for index in range(0, len(rows)):
-                row = rows[index]
+                running[energy] = [srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrAngDist, arPrecParSpec),
+                                   srw_process_pool.submit(calculate_srw_intensity, magFldCnt, wfrSouDim, arPrecParSpec, optBLSouDim)]
 
-                if not row.strip() == "":
-                    values = row.split()
+            if len(energies_to_submit) > 0 or len(running) > 0:
+                finished = False
+            else:
+                srw_energy_scan_store.flush()
 
-                    if not len(values) == 2: raise Exception("Malformed file, must be: <value> <spaces> <frequency>")
+                self.srw_energy_scan_store = srw_energy_scan_store
+        except Exception as exception:
+            QtWidgets.QMessageBox.critical(self, "Error", str(exception), QtWidgets.QMessageBox.Ok)
 
-                    value = float(values[0].strip())
-                    frequency = float(values[1].strip())
+            if self.IS_DEVELOP: raise exception
+        finally:
+            # stops the timer and cancels the calculations still running (on error): an incomplete store is removed
+            if finished: self.cancelPrecomputedSRWCalculations()
 
-                    distribution.append([value, frequency])
+        if finished: precomputation["on_finished"]()
 
-        except Exception as err:
-            raise Exception("Problems reading distribution file: {0}".format(err))
-        except:
-            raise Exception("Unexpected error reading distribution file: ", sys.exc_info()[0])
+    def cancelPrecomputedSRWCalculations(self):
+        precomputation = self.srw_precomputation
 
-        return numpy.array(distribution)
+        if not precomputation is None:
+            self.srw_precomputation = None
 
-    def combine_distributions(self, distribution_x, distribution_y):
+            precomputation["timer"].stop()
+            precomputation["timer"].deleteLater()
 
-        coord_x = distribution_x[:, 0]
-        coord_y = distribution_y[:, 0]
+            for futures in precomputation["running"].values():
+                for future in futures: future.cancel()
 
-        intensity_x = repmat(distribution_x[:, 1], len(coord_y), 1).transpose()
-        intensity_y = repmat(distribution_y[:, 1], len(coord_x), 1)
+            if not self.srw_energy_scan_store is precomputation["store"]: self.removeSRWEnergyScanStore(precomputation["store"])
 
-        if self.combine_strategy == 0:
-            convoluted_intensity = numpy.sqrt(intensity_x*intensity_y)
-        elif self.combine_strategy == 1:
-            convoluted_intensity = numpy.sqrt(intensity_x**2 + intensity_y**2)
-        elif self.combine_strategy == 2:
-            convoluted_intensity = convolve2d(intensity_x, intensity_y, boundary='fill', mode='same', fillvalue=0)
-        elif self.combine_strategy == 3:
-            convoluted_intensity = 0.5*(intensity_x + intensity_y)
+    def removeSRWEnergyScanStore(self, srw_energy_scan_store=None):
+        if srw_energy_scan_store is None:
+            srw_energy_scan_store = self.srw_energy_scan_store
 
-        return coord_x, coord_y, convoluted_intensity
+            self.srw_energy_scan_store = None
 
+        if not srw_energy_scan_store is None: shutil.rmtree(srw_energy_scan_store.directory, ignore_errors=True)
 
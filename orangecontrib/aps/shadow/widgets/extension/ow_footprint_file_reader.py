@@ -45,7 +45,7 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # #########################################################################
 
-import os, numpy
+import os
 
 from PyQt5 import QtGui, QtWidgets
 from orangewidget import gui
@@ -56,6 +56,8 @@ from oasys.widgets import widget as oasyswidget
 from orangecontrib.shadow.util.shadow_util import ShadowCongruence
 from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
 
+from orangecontrib.aps.shadow.util.histogram_util import get_intensity, set_absorbed_intensity
+
 
 class FootprintFileReader(oasyswidget.OWWidget):
     name = "Footprint Reader"
@@ -136,10 +138,9 @@ class FootprintFileReader(oasyswidget.OWWidget):
 
             incident_beam = self.input_beam.getOEHistory(self.input_beam._oe_number)._input_beam
 
-            ticket = incident_beam._beam.histo2(1, 3, nbins=100, xrange=None, yrange=None, nolost=1, ref=23)
-            ticket['histogram'] *= (total_power/n_rays) # power
+            incident_rays = incident_beam._beam.rays
 
-            additional_parameters["incident_power"] = ticket['histogram'].sum()
+            additional_parameters["incident_power"] = get_intensity(incident_rays)[incident_rays[:, 9] == 1].sum()*(total_power/n_rays)
 
             if self.kind_of_power == 0: # incident
                 beam_out._beam.rays[:, 6]  = incident_beam._beam.rays[:, 6]
@@ -150,21 +151,7 @@ class FootprintFileReader(oasyswidget.OWWidget):
                 beam_out._beam.rays[:, 17] = incident_beam._beam.rays[:, 17]
             elif self.kind_of_power == 1: # absorbed
                 # need a trick: put the whole intensity of one single component
-
-                incident_intensity = incident_beam._beam.rays[:, 6]**2 + incident_beam._beam.rays[:, 7]**2 + incident_beam._beam.rays[:, 8]**2 +\
-                                     incident_beam._beam.rays[:, 15]**2 + incident_beam._beam.rays[:, 16]**2 + incident_beam._beam.rays[:, 17]**2
-                transmitted_intensity = beam_out._beam.rays[:, 6]**2 + beam_out._beam.rays[:, 7]**2 + beam_out._beam.rays[:, 8]**2 +\
-                                        beam_out._beam.rays[:, 15]**2 + beam_out._beam.rays[:, 16]**2 + beam_out._beam.rays[:, 17]**2
-
-                electric_field = numpy.sqrt(incident_intensity - transmitted_intensity)
-                electric_field[numpy.where(electric_field == numpy.nan)] = 0.0
-
-                beam_out._beam.rays[:, 6]  = electric_field
-                beam_out._beam.rays[:, 7]  = 0.0
-                beam_out._beam.rays[:, 8]  = 0.0
-                beam_out._beam.rays[:, 15] = 0.0
-                beam_out._beam.rays[:, 16] = 0.0
-                beam_out._beam.rays[:, 17] = 0.0
+                set_absorbed_intensity(beam_out._beam.rays, incident_beam._beam.rays)
 
             beam_out.setScanningData(ShadowBeam.ScanningData(self.input_beam.scanned_variable_data.get_scanned_variable_name(),
                                                              self.input_beam.scanned_variable_data.get_scanned_variable_value(),
@@ -47,7 +47,6 @@
 
 import sys
 import os
-import time
 import copy
 import numpy
 
@@ -64,7 +63,8 @@ from orangecontrib.shadow.util.shadow_objects import ShadowBeam
 from orangecontrib.shadow.util.shadow_util import ShadowCongruence, ShadowPlot
 from orangecontrib.shadow.widgets.gui import ow_automatic_element
 
-from orangecontrib.aps.util.gui import StatisticalDataCollection, HistogramDataCollection, DoublePlotWidget, write_histo_and_stats_file_hdf5, write_histo_and_stats_file
+from orangecontrib.aps.util.gui import StatisticalDataCollection, HistogramDataCollection, DoublePlotWidget, write_histo_and_stats_file_hdf5, write_histo_and_stats_file, \
+    PlotRedrawScheduler
 from orangecontrib.aps.shadow.util.gui import ScanHistoWidget, Scan3DHistoWidget
 
 class Histogram(ow_automatic_element.AutomaticElement):
@@ -125,9 +125,19 @@ class Histogram(ow_automatic_element.AutomaticElement):
     peak_integral_intensity = Setting(0)
     absolute_relative_intensity = Setting(0)
 
+    redraw_mode = Setting(0)
+    redraw_interval = Setting(500)
+    redraw_steps = Setting(10)
+
+    scan_variable_label = None
+    stats_xum = None
+
     def __init__(self):
         super().__init__()
 
+        self.redraw_scheduler = PlotRedrawScheduler(self.redraw_scan)
+        self.pending_histograms = []
+
         self.refresh_button = gui.button(self.controlArea, self, "Refresh", callback=self.plot_results, height=45)
         gui.separator(self.controlArea, 10)
 
@@ -252,7 +262,7 @@ class Histogram(ow_automatic_element.AutomaticElement):
                                             "Lost Only"],
                                      sendSelectedValue=False, orientation="horizontal")
 
-        incremental_box = oasysgui.widgetBox(tab_gen, "Incremental Result", addSpace=True, orientation="vertical", height=320)
+        incremental_box = oasysgui.widgetBox(tab_gen, "Incremental Result", addSpace=True, orientation="vertical", height=390)
 
         gui.button(incremental_box, self, "Clear Stored Data", callback=self.clearResults, height=30)
         gui.separator(incremental_box)
@@ -298,6 +308,20 @@ class Histogram(ow_automatic_element.AutomaticElement):
                      items=["Relative", "Absolute"],
                      sendSelectedValue=False, orientation="horizontal")
 
+        gui.separator(self.box_scan)
+
+        gui.comboBox(self.box_scan, self, "redraw_mode", label="Refresh Plots", labelWidth=200,
+                     items=["Every Step", "At most every N ms", "Every K Steps", "After N ms without new Steps"],
+                     sendSelectedValue=False, orientation="horizontal", callback=self.set_redraw_mode)
+
+        self.redraw_box_1 = oasysgui.widgetBox(self.box_scan, "", addSpace=False, orientation="vertical", height=25)
+        self.redraw_box_2 = oasysgui.widgetBox(self.box_scan, "", addSpace=False, orientation="vertical", height=25)
+
+        oasysgui.lineEdit(self.redraw_box_1, self, "redraw_interval", "N/Idle time before refresh [ms]", labelWidth=250, valueType=int, orientation="horizontal")
+        oasysgui.lineEdit(self.redraw_box_2, self, "redraw_steps", "K [steps]", labelWidth=250, valueType=int, orientation="horizontal")
+
+        self.set_redraw_mode()
+
         gui.button(self.box_scan, self, "Export Scanning Results/Stats", callback=self.export_scanning_stats_analysis, height=30)
 
         self.set_IterativeMode()
@@ -344,6 +368,12 @@ class Histogram(ow_automatic_element.AutomaticElement):
 
         self.histo_index = -1
 
+        self.scan_variable_label = None
+        self.stats_xum = None
+
+        self.pending_histograms = []
+        self.redraw_scheduler.cancel()
+
         if not self.plot_canvas is None:
             self.main_tabs.removeTab(1)
             self.main_tabs.removeTab(0)
@@ -369,6 +399,10 @@ class Histogram(ow_automatic_element.AutomaticElement):
             self.plot_canvas = None
             self.plot_canvas_stats = None
 
+    def set_redraw_mode(self):
+        self.redraw_box_1.setVisible(self.redraw_mode > 0)
+        self.redraw_box_2.setVisible(self.redraw_mode == 2)
+
     def set_IterativeMode(self):
         self.box_scan_empty.setVisible(self.iterative_mode<2)
         if self.iterative_mode==2:
@@ -412,25 +446,24 @@ class Histogram(ow_automatic_element.AutomaticElement):
 
             self.image_box.layout().addWidget(self.plot_canvas)
 
-        if self.iterative_mode==0:
-            self.last_ticket = None
+        if self.iterative_mode < 2:
             self.current_histo_data = None
             self.current_stats = None
             self.last_histo_data = None
             self.histo_index = -1
-            self.plot_canvas.plot_histo(beam._beam, var, self.rays, xrange,
-                                        self.weight_column_index, title, xtitle, ytitle,
-                                        nbins=self.number_of_bins, xum=xum, conv=self.workspace_units_to_cm)
 
-        elif self.iterative_mode == 1:
-            self.current_histo_data = None
-            self.current_stats = None
-            self.last_histo_data = None
-            self.histo_index = -1
-            self.last_ticket = self.plot_canvas.plot_histo(beam._beam, var, self.rays, xrange,
-                                                           self.weight_column_index, title, xtitle, ytitle,
-                                                           nbins=self.number_of_bins, xum=xum, conv=self.workspace_units_to_cm,
-                                                           ticket_to_add=self.last_ticket)
+            # DetailedHistoWidget computes and draws the histogram in the same call: it is executed by the scheduler,
+            # out of the input handler. Accumulated histograms are added in order, the single one is replaced
+            if self.iterative_mode == 0:
+                self.last_ticket = None
+                self.pending_histograms = []
+
+            self.pending_histograms.append((self.iterative_mode,
+                                            (beam._beam, var, self.rays, xrange, self.weight_column_index, title, xtitle, ytitle),
+                                            {"nbins" : self.number_of_bins, "xum" : xum, "conv" : self.workspace_units_to_cm}))
+
+            self.redraw_scheduler.set_parameters(PlotRedrawScheduler.EVERY_STEP, self.redraw_interval, self.redraw_steps)
+            self.redraw_scheduler.request()
         else:
             if not beam.scanned_variable_data is None:
                 self.last_ticket = None
@@ -452,7 +485,8 @@ class Histogram(ow_automatic_element.AutomaticElement):
                                                          xrange=xrange,
                                                          show_reference=False,
                                                          add_labels=self.add_labels==1,
-                                                         has_colormap=self.has_colormap==1
+                                                         has_colormap=self.has_colormap==1,
+                                                         redraw=False
                                                          )
                 scanned_variable_value = beam.scanned_variable_data.get_scanned_variable_value()
 
@@ -474,35 +508,67 @@ class Histogram(ow_automatic_element.AutomaticElement):
 
                 self.last_histo_data = histo_data
 
-                if self.sigma_fwhm_size==0:
-                    sizes = self.current_stats.get_sigmas()
-                    label_size = "Sigma " + xum
-                else:
-                    sizes = self.current_stats.get_fwhms()
-                    label_size = "FWHM " + xum
+                self.scan_variable_label = beam.scanned_variable_data.get_scanned_variable_display_name() + um
+                self.stats_xum = xum
 
-                if self.absolute_relative_intensity == 0: #relative
-                    if self.peak_integral_intensity==0: # peak
-                        intensities =  self.current_stats.get_relative_peak_intensities()
-                        label_intensity = "Relative Peak Intensity"
-                    else:
-                        intensities = self.current_stats.get_relative_integral_intensities()
-                        label_intensity = "Relative Integral Intensity"
-                else:
-                    if self.peak_integral_intensity==0: # peak
-                        intensities =  self.current_stats.get_absolute_peak_intensities()
-                        label_intensity = "Absolute Peak Intensity"
+                self.redraw_scheduler.set_parameters(self.redraw_mode, self.redraw_interval, self.redraw_steps)
+                self.redraw_scheduler.request()
+
+    def redraw_scan(self):
+        if len(self.pending_histograms) > 0:
+            pending_histograms, self.pending_histograms = self.pending_histograms, []
+
+            try:
+                for iterative_mode, arguments, keyword_arguments in pending_histograms:
+                    if iterative_mode == 0:
+                        self.plot_canvas.plot_histo(*arguments, **keyword_arguments)
                     else:
-                        intensities = self.current_stats.get_absolute_integral_intensities()
-                        label_intensity = "Absolute Integral Intensity"
+                        self.last_ticket = self.plot_canvas.plot_histo(*arguments, ticket_to_add=self.last_ticket, **keyword_arguments)
+            except Exception as exception:
+                QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise exception
+        elif not self.plot_canvas is None and not self.current_stats is None:
+            try:
+                self.plot_canvas.redraw()
+                self.plot_stats()
+            except Exception as exception:
+                QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise exception
+
+    def plot_stats(self):
+        xum = self.stats_xum
+
+        if self.sigma_fwhm_size==0:
+            sizes = self.current_stats.get_sigmas()
+            label_size = "Sigma " + xum
+        else:
+            sizes = self.current_stats.get_fwhms()
+            label_size = "FWHM " + xum
 
-                self.plot_canvas_stats.plotCurves(self.current_stats.get_scan_values(),
-                                                  sizes,
-                                                  intensities,
-                                                  "Statistics",
-                                                  beam.scanned_variable_data.get_scanned_variable_display_name() + um,
-                                                  label_size,
-                                                  label_intensity)
+        if self.absolute_relative_intensity == 0: #relative
+            if self.peak_integral_intensity==0: # peak
+                intensities =  self.current_stats.get_relative_peak_intensities()
+                label_intensity = "Relative Peak Intensity"
+            else:
+                intensities = self.current_stats.get_relative_integral_intensities()
+                label_intensity = "Relative Integral Intensity"
+        else:
+            if self.peak_integral_intensity==0: # peak
+                intensities =  self.current_stats.get_absolute_peak_intensities()
+                label_intensity = "Absolute Peak Intensity"
+            else:
+                intensities = self.current_stats.get_absolute_integral_intensities()
+                label_intensity = "Absolute Integral Intensity"
+
+        self.plot_canvas_stats.plotCurves(self.current_stats.get_scan_values(),
+                                          sizes,
+                                          intensities,
+                                          "Statistics",
+                                          self.scan_variable_label,
+                                          label_size,
+                                          label_intensity)
 
 
     def plot_histo(self, var_x, title, xtitle, ytitle, xum):
@@ -581,6 +647,10 @@ class Histogram(ow_automatic_element.AutomaticElement):
 
                 self.number_of_bins = congruence.checkPositiveNumber(self.number_of_bins, "Number of Bins")
 
+                if self.iterative_mode == 2:
+                    if self.redraw_mode > 0: congruence.checkPositiveNumber(self.redraw_interval, "Refresh interval")
+                    if self.redraw_mode == 2: congruence.checkStrictlyPositiveNumber(self.redraw_steps, "Refresh steps")
+
                 x, auto_title, xum = self.get_titles()
 
                 self.plot_histo(x, title=self.title, xtitle=auto_title, ytitle="Number of Rays", xum=xum)
@@ -592,8 +662,6 @@ class Histogram(ow_automatic_element.AutomaticElement):
                 for row in grabber.ttyData:
                     self.writeStdOut(row)
 
-            time.sleep(0.5)  # prevents a misterious dead lock in the Orange cycle when refreshing the histogram
-
             return plotted
         except Exception as exception:
             QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
@@ -45,13 +45,13 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # #########################################################################
 
-import sys, numpy, os
+import sys, os
 
 import scipy.constants as codata
 m2ev = codata.c * codata.h / codata.e
 
 from PyQt5.QtGui import QPalette, QFont, QColor
-from PyQt5.QtWidgets import QApplication, QMessageBox
+from PyQt5.QtWidgets import QApplication, QMessageBox, QFileDialog
 
 from orangewidget.widget import OWAction
 from orangewidget import gui
@@ -68,19 +68,8 @@ from oasys.widgets.exchange import DataExchangeObject
 from syned.storage_ring.light_source import LightSource
 from syned.widget.widget_decorator import WidgetDecorator
 
-class EnergyBinning(object):
-    def __init__(self,
-                 energy_value = 0.0,
-                 energy_value_to = None,
-                 energy_step       = 0.0,
-                 power_step        = None):
-        self.energy_value    = energy_value
-        self.energy_value_to = energy_value_to
-        self.energy_step     = energy_step
-        self.power_step      = power_step
-
-    def __str__(self):
-        return str(self.energy_value) + ", " + str(self.energy_value_to) + ", " + str(self.energy_step) + ", " + str(self.power_step)
+from orangecontrib.aps.util.energy_binning import SPECTRUM_FILE, FILTERS_FILE, EnergyBinning, read_spectrum_file, read_filters_file, write_spectrum_file, write_filters_file, \
+                                                  get_two_columns_data, calculate_automatic_binning, get_energy_binnings, allocate_number_of_rays
 
 class PowerLoopPoint(widget.OWWidget):
 
@@ -117,13 +106,22 @@ class PowerLoopPoint(widget.OWWidget):
 
     seed_increment=Setting(1)
 
+    precompute_srw = Setting(0)
+    prefetch_srw = Setting(0)
+
     autobinning = Setting(1)
 
     auto_n_step = Setting(1001)
     auto_perc_total_power = Setting(99)
+    auto_power_tolerance = Setting(0.01)
+    auto_max_n_step = Setting(10000)
 
     send_power_step = Setting(0)
 
+    allocate_rays = Setting(0)
+    total_number_of_rays = Setting(1000000)
+    minimum_number_of_rays = Setting(1000)
+
     electron_energy = Setting(6.0)
     K_vertical = Setting(1.943722)
     K_horizontal = Setting(0.0)
@@ -141,8 +139,9 @@ class PowerLoopPoint(widget.OWWidget):
 
     external_binning = False
 
-    filters = None
-    spectrum_data = None
+    # (energy, flux) and (energy, intensity factor) arrays, saved with the workflow
+    filters = Setting(None)
+    spectrum_data = Setting(None)
 
     #################################
     process_last = True
@@ -215,10 +214,13 @@ class PowerLoopPoint(widget.OWWidget):
 
         oasysgui.lineEdit(left_box_1, self, "seed_increment", "Source Montecarlo Seed Increment", labelWidth=250, valueType=int, orientation="horizontal")
 
+        gui.comboBox(left_box_1, self, "precompute_srw", label="Precompute SRW Distributions (Parallel)", items=["No", "Yes"], labelWidth=300, sendSelectedValue=False, orientation="horizontal")
+        gui.comboBox(left_box_1, self, "prefetch_srw", label="Prefetch SRW Distributions", items=["No", "Next Energy", "Next 2 Energies"], labelWidth=220, sendSelectedValue=False, orientation="horizontal")
+
         gui.separator(left_box_1)
 
         gui.comboBox(left_box_1, self, "autobinning", label="Energy Binning",
-                     items=["Manual", "Automatic (Constant Power)", "Automatic (Constant Energy)"], labelWidth=150,
+                     items=["Manual", "Automatic (Constant Power)", "Automatic (Constant Energy)", "Automatic (Adaptive)"], labelWidth=150,
                      callback=self.set_Autobinning, sendSelectedValue=False, orientation="horizontal")
 
         self.autobinning_box_1 = oasysgui.widgetBox(left_box_1, "", addSpace=False, orientation="vertical", height=50)
@@ -234,12 +236,32 @@ class PowerLoopPoint(widget.OWWidget):
 
         oasysgui.lineEdit(self.autobinning_box_2, self, "auto_n_step", "Number of Steps", labelWidth=250, valueType=int, orientation="horizontal")
         oasysgui.lineEdit(self.autobinning_box_2, self, "auto_perc_total_power", "% Total Power", labelWidth=250, valueType=float, orientation="horizontal")
+
+        self.autobinning_box_3 = oasysgui.widgetBox(self.autobinning_box_2, "", addSpace=False, orientation="vertical", height=50)
+
+        oasysgui.lineEdit(self.autobinning_box_3, self, "auto_power_tolerance", "Power Error Tolerance per Step [% Total Power]", labelWidth=300, valueType=float, orientation="horizontal")
+        oasysgui.lineEdit(self.autobinning_box_3, self, "auto_max_n_step", "Max Number of Steps", labelWidth=250, valueType=int, orientation="horizontal")
+
         gui.comboBox(self.autobinning_box_2, self, "send_power_step", label="Send Power Step", items=["No", "Yes"], labelWidth=350, sendSelectedValue=False, orientation="horizontal")
+        gui.comboBox(self.autobinning_box_2, self, "allocate_rays", label="Number of Rays per Step", items=["From Source", "Proportional to Power"], labelWidth=200,
+                     callback=self.set_Autobinning, sendSelectedValue=False, orientation="horizontal")
+
+        self.allocate_rays_box = oasysgui.widgetBox(self.autobinning_box_2, "", addSpace=False, orientation="vertical", height=50)
+
+        oasysgui.lineEdit(self.allocate_rays_box, self, "total_number_of_rays", "Total Number of Rays", labelWidth=250, valueType=int, orientation="horizontal")
+        oasysgui.lineEdit(self.allocate_rays_box, self, "minimum_number_of_rays", "Min Number of Rays per Step", labelWidth=250, valueType=int, orientation="horizontal")
 
         button_box = oasysgui.widgetBox(self.autobinning_box_2, "", addSpace=False, orientation="horizontal")
 
-        gui.button(button_box, self, "Reload Spectrum and Filters", callback=self.read_spectrum_and_filters_file)
-        gui.button(button_box, self, "Reload Spectrum Only", callback=self.read_spectrum_file_only)
+        gui.button(button_box, self, "Load Spectrum", callback=self.load_spectrum_file)
+        gui.button(button_box, self, "Load Filters", callback=self.load_filters_file)
+        gui.button(button_box, self, "Clear Filters", callback=self.clear_filters)
+
+        button_box = oasysgui.widgetBox(self.autobinning_box_2, "", addSpace=False, orientation="horizontal")
+
+        gui.button(button_box, self, "Recalculate Bins", callback=self.recalculate_energy_binnings)
+        gui.button(button_box, self, "Export Spectrum", callback=self.export_spectrum_file)
+        gui.button(button_box, self, "Export Filters", callback=self.export_filters_file)
 
         oasysgui.widgetLabel(self.autobinning_box_2, "Energy Value [eV], Energy Step [eV], Power Step [W]")
 
@@ -340,44 +362,74 @@ class PowerLoopPoint(widget.OWWidget):
 
         self.set_Autobinning()
 
+        # spectrum and filters of the saved workflow
+        if not self.filters is None: self.acceptFilters(self.get_exchange_data("filters_data", self.filters))
+        elif not self.spectrum_data is None: self.acceptEnergySpectrum(self.get_exchange_data("spectrum_data", self.spectrum_data))
+
     def set_Autobinning(self):
         self.autobinning_box_1.setVisible(self.autobinning==0)
-        self.autobinning_box_2.setVisible(self.autobinning==1 or self.autobinning==2)
+        autobinning_box_2_height = 190 + (50 if self.autobinning==3 else 0) + (50 if self.allocate_rays==1 else 0)
+
+        self.autobinning_box_2.setVisible(self.autobinning>=1)
+        self.autobinning_box_2.setFixedHeight(autobinning_box_2_height)
+        self.autobinning_box_3.setVisible(self.autobinning==3)
+        self.allocate_rays_box.setVisible(self.allocate_rays==1)
         self.text_area.setReadOnly(self.autobinning>=1)
-        self.text_area.setFixedHeight(201 if self.autobinning>=1 else 290)
+        self.text_area.setFixedHeight(290 if self.autobinning==0 else 341 - autobinning_box_2_height)
+
+    def get_exchange_data(self, name, data):
+        exchange_data = DataExchangeObject(program_name="ShadowOui", widget_name="PowerLoopPoint")
+        exchange_data.add_content(name, data)
 
-    def read_spectrum_file(self, reset_filters=True):
+        return exchange_data
+
+    def load_spectrum_file(self):
         try:
-            if reset_filters:
-                self.filters=None
-                self.filter_plot.clear()
+            file_name, _ = QFileDialog.getOpenFileName(self, "Load Spectrum (Energy, Flux)", os.curdir, "Text Files (*.dat *.txt);;Numpy Files (*.npy);;All Files (*)")
 
-            data = numpy.loadtxt("autobinning.dat", skiprows=1)
+            if file_name: self.acceptEnergySpectrum(self.get_exchange_data("spectrum_data", read_spectrum_file(file_name)))
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e), QMessageBox.Ok)
 
-            calculated_data = DataExchangeObject(program_name="ShadowOui", widget_name="PowerLoopPoint")
-            calculated_data.add_content("spectrum_data", data)
+            if self.IS_DEVELOP: raise e
 
-            self.acceptEnergySpectrum(calculated_data)
+    def load_filters_file(self):
+        try:
+            file_name, _ = QFileDialog.getOpenFileName(self, "Load Filters (Energy, Intensity Factor)", os.curdir, "Text Files (*.dat *.txt);;Numpy Files (*.npy);;All Files (*)")
+
+            if file_name: self.acceptFilters(self.get_exchange_data("filters_data", read_filters_file(file_name)))
         except Exception as e:
             QMessageBox.critical(self, "Error", str(e), QMessageBox.Ok)
 
             if self.IS_DEVELOP: raise e
 
-    def read_spectrum_file_only(self):
-        self.read_spectrum_file(True)
+    def clear_filters(self):
+        self.filters = None
+        self.filter_plot.clear()
+
+        if not self.spectrum_data is None: self.recalculate_energy_binnings()
+
+    def recalculate_energy_binnings(self):
+        if self.spectrum_data is None: QMessageBox.critical(self, "Error", "No Spectrum loaded", QMessageBox.Ok)
+        else: self.acceptEnergySpectrum(self.get_exchange_data("spectrum_data", self.spectrum_data))
+
+    def export_spectrum_file(self):
+        self.__export_file(self.spectrum_data, "Spectrum", SPECTRUM_FILE, write_spectrum_file)
 
-    def read_spectrum_and_filters_file(self):
+    def export_filters_file(self):
+        self.__export_file(self.filters, "Filters", FILTERS_FILE, write_filters_file)
+
+    def __export_file(self, data, description, default_file_name, write_file):
         try:
-            data = numpy.loadtxt("filters.dat", skiprows=1)
+            if data is None: raise ValueError("No " + description + " to export")
 
-            calculated_data = DataExchangeObject(program_name="ShadowOui", widget_name="PowerLoopPoint")
-            calculated_data.add_content("filters_data", data)
+            file_name, _ = QFileDialog.getSaveFileName(self, "Export " + description, os.path.join(os.curdir, default_file_name), "Text Files (*.dat *.txt);;Numpy Files (*.npy)")
 
-            self.acceptFilters(calculated_data)
-        except Exception:
-            self.filters = None
+            if file_name: write_file(data, file_name)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", str(e), QMessageBox.Ok)
 
-        self.read_spectrum_file(False)
+            if self.IS_DEVELOP: raise e
 
     def receive_syned_data(self, data):
         if not data is None:
@@ -404,11 +456,8 @@ class PowerLoopPoint(widget.OWWidget):
     def acceptFilters(self, exchange_data):
         if not exchange_data is None:
             try: # FROM XOPPY F1F2
-                write_file = True
-
                 try:
                     data = exchange_data.get_content("filters_data")
-                    write_file = False
                 except:
                     if not exchange_data.get_program_name() == "XOPPY": raise ValueError("Only XOPPY F1F2 and CRYSTAL widgets are accepted")
 
@@ -421,38 +470,18 @@ class PowerLoopPoint(widget.OWWidget):
                     elif exchange_data.get_widget_name() == "MLAYER":
                         data = exchange_data.get_content("xoppy_data")[0:3:2, 0:3:2]
 
-                self.filters = data
+                self.filters = get_two_columns_data(data)
 
                 energies     = self.filters[:, 0]
                 intensity_factors = self.filters[:, 1]
 
-                if write_file:
-                    file = open("filters.dat", "w")
-                    file.write("Energy Filter")
-
-
-                    for energy, intensity_factor in zip(energies, intensity_factors):
-                        file.write("\n" + str(energy) + " " + str(intensity_factor))
-
-                    file.flush()
-                    file.close()
-
                 self.filter_plot.clear()
                 self.filter_plot.addCurve(energies, intensity_factors, replace=True, legend="Intensity Factor")
                 self.filter_plot.setGraphXLabel("Energy [eV]")
                 self.filter_plot.setGraphYLabel("Intensity Factor")
                 self.filter_plot.setGraphTitle("Filter on Flux")
 
-                if self.autobinning==0:
-                    if write_file: QMessageBox.information(self, "Info", "File filters.dat written on working directory, switch to Automatic binning to load it", QMessageBox.Ok)
-                else:
-                    if write_file: QMessageBox.information(self, "Info", "File filters.dat written on working directory", QMessageBox.Ok)
-
-                if not self.spectrum_data is None:
-                    calculated_data = DataExchangeObject(program_name="ShadowOui", widget_name="PowerLoopPoint")
-                    calculated_data.add_content("spectrum_data", self.spectrum_data)
-
-                    self.acceptEnergySpectrum(calculated_data)
+                if not self.spectrum_data is None: self.acceptEnergySpectrum(self.get_exchange_data("spectrum_data", self.spectrum_data))
 
             except Exception as e:
                 QMessageBox.critical(self, "Error", str(e), QMessageBox.Ok)
@@ -462,97 +491,50 @@ class PowerLoopPoint(widget.OWWidget):
     def acceptEnergySpectrum(self, exchange_data):
         if not exchange_data is None:
             try:
-                write_file = True
-
                 try:
                     data = exchange_data.get_content("spectrum_data")
-                    write_file = False
                 except:
                     try:
                         data = exchange_data.get_content("srw_data")
                     except:
                         data = exchange_data.get_content("xoppy_data")
 
-                self.spectrum_data = data.copy()
-
-                energies                              = data[:, 0]
-                flux_through_finite_aperture          = data[:, 1]
-                flux_through_finite_aperture_filtered = flux_through_finite_aperture.copy()
-
-                if not self.filters is None:
-                    flux_through_finite_aperture_filtered *= numpy.interp(energies, self.filters[:, 0], self.filters[:, 1])
-
-                if write_file:
-                    file = open("autobinning.dat", "w")
-                    file.write("Energy Flux")
-
-                    for energy, flux in zip(energies, flux_through_finite_aperture):
-                        file.write("\n" + str(energy) + " " + str(flux))
-
-                    file.flush()
-                    file.close()
-
-                if self.autobinning==0:
-                    if write_file: QMessageBox.information(self, "Info", "File autobinning.dat written on working directory, switch to Automatic binning to load it", QMessageBox.Ok)
-                else:
-                    if write_file: QMessageBox.information(self, "Info", "File autobinning.dat written on working directory", QMessageBox.Ok)
+                self.spectrum_data = get_two_columns_data(data)
 
+                if self.autobinning!=0:
                     congruence.checkStrictlyPositiveNumber(self.auto_n_step, "(Auto) % Number of Steps")
                     congruence.checkStrictlyPositiveNumber(self.auto_perc_total_power, "(Auto) % Total Power")
 
-                    energy_step = energies[1] - energies[0]
-
-                    # last energy do not contribute to the total (the approximated integral of the power is out of the range)
-
-                    power           = flux_through_finite_aperture * (1e3 * energy_step * codata.e)
-                    cumulated_power = numpy.cumsum(power)
-                    total_power     = cumulated_power[-1]
-
-                    if not self.filters is None:
-                        power_filtered           = flux_through_finite_aperture_filtered * (1e3 * energy_step * codata.e)
-                        cumulated_power_filtered = numpy.cumsum(power_filtered)
-                        total_power_filtered     = cumulated_power_filtered[-1]
+                    if self.autobinning==3:
+                        congruence.checkStrictlyPositiveNumber(self.auto_power_tolerance, "(Auto) Power Error Tolerance")
+                        congruence.checkGreaterOrEqualThan(self.auto_max_n_step, self.auto_n_step, "(Auto) Max Number of Steps", "(Auto) Number of Steps")
+
+                    binning = calculate_automatic_binning(self.spectrum_data,
+                                                          filters=self.filters,
+                                                          autobinning=self.autobinning,
+                                                          n_step=self.auto_n_step,
+                                                          perc_total_power=self.auto_perc_total_power,
+                                                          power_tolerance=self.auto_power_tolerance,
+                                                          max_n_step=self.auto_max_n_step)
+
+                    energies                              = binning["spectrum_energies"]
+                    cumulated_power                       = binning["cumulated_power"]
+                    cumulated_power_filtered              = binning["cumulated_power_filtered"]
+                    total_power_filtered                  = binning["total_power_filtered"]
+                    flux_through_finite_aperture          = binning["flux_through_finite_aperture"]
+                    flux_through_finite_aperture_filtered = binning["flux_through_finite_aperture_filtered"]
+                    interpolated_energies                 = binning["energies"]
+                    interpolated_cumulated_power          = binning["cumulated_powers"]
+                    power_steps                           = binning["power_steps"]
+                    flux_steps                            = binning["flux_steps"]
 
                     self.text_area.clear()
 
                     self.cumulated_power_plot.clear()
                     self.spectral_flux_plot.clear()
 
-                    good = numpy.where(cumulated_power <= self.auto_perc_total_power*0.01*total_power)
-
-                    energies                     = energies[good]
-                    cumulated_power              = cumulated_power[good]
-                    flux_through_finite_aperture = flux_through_finite_aperture[good]
-
-                    if not self.filters is None:
-                        cumulated_power_filtered = cumulated_power_filtered[good]
-                        flux_through_finite_aperture_filtered = flux_through_finite_aperture_filtered[good]
-
-                    if self.autobinning==1: # constant power
-                        interpolated_cumulated_power = numpy.linspace(start=numpy.min(cumulated_power), stop=numpy.max(cumulated_power), num=self.auto_n_step+1)
-                        interpolated_energies        = numpy.interp(interpolated_cumulated_power, cumulated_power, energies)
-                        energy_steps = numpy.ediff1d(interpolated_energies)
-
-                        interpolated_energies        = interpolated_energies[:-1]
-                        interpolated_cumulated_power = interpolated_cumulated_power[:-1]
-
-                        power_steps  = numpy.ones(self.auto_n_step)*cumulated_power[-1]/self.auto_n_step
-
-                    elif self.autobinning==2: # constant energy
-                        minimum_energy = energies[0]
-                        maximum_energy = energies[-1]
-                        energy_step = (maximum_energy-minimum_energy)/self.auto_n_step
-
-                        interpolated_energies        = numpy.arange(minimum_energy, maximum_energy, energy_step)
-                        interpolated_cumulated_power = numpy.interp(interpolated_energies, energies, cumulated_power)
-
-                        energy_steps = numpy.ones(self.auto_n_step)*energy_step
-                        power_steps  = numpy.ediff1d(numpy.append(numpy.zeros(1), interpolated_cumulated_power))
-
-                    flux_steps = numpy.interp(interpolated_energies, energies, flux_through_finite_aperture)
-
-                    self.energy_binnings = []
-                    self.total_new_objects = 0
+                    self.energy_binnings = get_energy_binnings(binning)
+                    self.total_new_objects = len(self.energy_binnings)
 
                     self.cumulated_power_plot.addCurve(energies, cumulated_power, replace=True, legend="Cumulated Power")
                     if not self.filters is None:  self.cumulated_power_plot.addCurve(energies, cumulated_power_filtered, replace=False, legend="Cumulated Power Filters",
@@ -578,17 +560,10 @@ class PowerLoopPoint(widget.OWWidget):
 
                     text = ""
 
-                    for energy_value, energy_step, power_step in zip(interpolated_energies, energy_steps, power_steps):
-                        energy_binning = EnergyBinning(energy_value=round(energy_value, 3),
-                                                       energy_step=round(energy_step, 3),
-                                                       power_step=round(power_step, 4))
-
-                        text += str(round(energy_value, 3)) + ", " + \
-                                str(round(energy_step, 3))  + ", " + \
-                                str(round(power_step, 4)) + "\n"
-
-                        self.energy_binnings.append(energy_binning)
-                        self.total_new_objects += 1
+                    for energy_binning in self.energy_binnings:
+                        text += str(energy_binning.energy_value) + ", " + \
+                                str(energy_binning.energy_step)  + ", " + \
+                                str(energy_binning.power_step) + "\n"
 
                     self.text_area.setText(text)
 
@@ -622,16 +597,53 @@ class PowerLoopPoint(widget.OWWidget):
                                                    energy_step=energy_step)
                     self.energy_binnings.append(energy_binning)
 
-                    self.total_new_objects += int((energy_to - energy_from) / energy_step)
+                    self.total_new_objects += self.get_number_of_energy_values(energy_binning)
+
+    # the loop and the list of all the energies (SRW precomputation and prefetch) use the same values
+
+    def get_number_of_energy_values(self, energy_binning):
+        if self.external_binning: return 1
+        else: return max(1, int((energy_binning.energy_value_to - energy_binning.energy_value) / energy_binning.energy_step))
+
+    def get_energy_value(self, energy_binning, index):
+        return round(energy_binning.energy_value + index*energy_binning.energy_step, 8)
+
+    def get_all_energy_values(self):
+        return [self.get_energy_value(energy_binning, index) for energy_binning in self.energy_binnings
+                                                              for index in range(self.get_number_of_energy_values(energy_binning))]
+
+    def get_additional_parameters(self, energy_step, start_event=False):
+        additional_parameters = {"energy_value"   : self.current_energy_value,
+                                 "energy_step"    : energy_step,
+                                 "power_step"     : -1 if self.current_power_step is None else self.current_power_step,
+                                 "seed_increment" : self.seed_increment,
+                                 "start_event"    : start_event}
+
+        if self.external_binning and self.allocate_rays == 1:
+            additional_parameters["number_of_rays"] = self.energy_binnings[self.current_energy_binning].number_of_rays
+
+        # the source computes the SRW distributions of the next energies in background, while the beamline is traced
+        if self.prefetch_srw > 0:
+            additional_parameters["prefetch_energy_values"] = self.get_all_energy_values()[self.total_current_new_object:self.total_current_new_object + self.prefetch_srw]
+
+        return additional_parameters
+
+    def allocate_number_of_rays(self):
+        # the total number of rays of the scan is shared among the energy steps, proportionally to their power
+        if self.external_binning and self.allocate_rays == 1:
+            congruence.checkStrictlyPositiveNumber(self.total_number_of_rays, "Total Number of Rays")
+            congruence.checkPositiveNumber(self.minimum_number_of_rays, "Min Number of Rays per Step")
+
+            numbers_of_rays = allocate_number_of_rays([energy_binning.power_step for energy_binning in self.energy_binnings],
+                                                      self.total_number_of_rays,
+                                                      self.minimum_number_of_rays)
+
+            for energy_binning, number_of_rays in zip(self.energy_binnings, numbers_of_rays):
+                energy_binning.number_of_rays = int(number_of_rays)
 
     def calculate_number_of_new_objects(self):
         if len(self.energy_binnings) > 0:
-            if self.external_binning:
-                self.number_of_new_objects = 1
-            else:
-                energy_binning = self.energy_binnings[self.current_energy_binning]
-
-                self.number_of_new_objects = int((energy_binning.energy_value_to - energy_binning.energy_value) / energy_binning.energy_step)
+            self.number_of_new_objects = self.get_number_of_energy_values(self.energy_binnings[self.current_energy_binning])
         else:
             self.number_of_new_objects = 0
 
@@ -649,10 +661,18 @@ class PowerLoopPoint(widget.OWWidget):
         try:
             self.calculate_energy_binnings()
 
+            try:
+                self.allocate_number_of_rays()
+            except Exception as e:
+                QMessageBox.critical(self, "Error", str(e), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise e
+                else: return
+
             self.current_new_object = 1
             self.total_current_new_object = 1
             self.current_energy_binning = 0
-            self.current_energy_value             = round(self.energy_binnings[0].energy_value, 8)
+            self.current_energy_value             = self.get_energy_value(self.energy_binnings[0], 0)
             self.current_energy_step              = round(self.energy_binnings[0].energy_step, 8)
             self.current_power_step               = None if self.energy_binnings[0].power_step is None else (None if self.send_power_step==0 else round(self.energy_binnings[0].power_step, 8))
             self.calculate_number_of_new_objects()
@@ -660,12 +680,12 @@ class PowerLoopPoint(widget.OWWidget):
             self.start_button.setEnabled(False)
             self.text_area.setEnabled(False)
             self.setStatusMessage("Running " + self.get_object_name() + " " + str(self.total_current_new_object) + " of " + str(self.total_new_objects))
-            self.send("Trigger", TriggerOut(new_object=True,
-                                            additional_parameters={"energy_value"   : self.current_energy_value,
-                                                                   "energy_step"    : self.current_energy_step,
-                                                                   "power_step"     : -1 if self.current_power_step is None else self.current_power_step,
-                                                                   "seed_increment" : self.seed_increment,
-                                                                   "start_event"    : True}))
+
+            additional_parameters = self.get_additional_parameters(self.current_energy_step, start_event=True)
+
+            if self.precompute_srw == 1: additional_parameters["precompute_energy_values"] = self.get_all_energy_values()
+
+            self.send("Trigger", TriggerOut(new_object=True, additional_parameters=additional_parameters))
         except Exception as e:
             if self.IS_DEVELOP : raise e
             else: pass
@@ -732,22 +752,17 @@ class PowerLoopPoint(widget.OWWidget):
                             if self.current_energy_value is None:
                                 self.current_new_object = 1
                                 self.calculate_number_of_new_objects()
-                                self.current_energy_value = round(energy_binning.energy_value, 8)
+                                self.current_energy_value = self.get_energy_value(energy_binning, 0)
                             else:
                                 self.current_new_object += 1
-                                self.current_energy_value = round(self.current_energy_value + energy_binning.energy_step, 8)
+                                self.current_energy_value = self.get_energy_value(energy_binning, self.current_new_object - 1)
 
                             self.current_power_step = None if energy_binning.power_step is None else (None if self.send_power_step==0 else round(energy_binning.power_step, 8))
 
                             self.setStatusMessage("Running " + self.get_object_name() + " " + str(self.total_current_new_object) + " of " + str(self.total_new_objects))
                             self.start_button.setEnabled(False)
                             self.text_area.setEnabled(False)
-                            self.send("Trigger", TriggerOut(new_object=True,
-                                                            additional_parameters={"energy_value"   : self.current_energy_value,
-                                                                                   "energy_step"    : energy_binning.energy_step,
-                                                                                   "power_step"     : -1 if self.current_power_step is None else self.current_power_step,
-                                                                                   "seed_increment" : self.seed_increment,
-                                                                                   "start_event"    : False}))
+                            self.send("Trigger", TriggerOut(new_object=True, additional_parameters=self.get_additional_parameters(energy_binning.energy_step)))
                         else:
                             self.current_energy_binning += 1
 
@@ -756,18 +771,13 @@ class PowerLoopPoint(widget.OWWidget):
 
                                 self.current_new_object = 1
                                 self.calculate_number_of_new_objects()
-                                self.current_energy_value = round(energy_binning.energy_value, 8)
+                                self.current_energy_value = self.get_energy_value(energy_binning, 0)
                                 self.current_power_step = None if energy_binning.power_step is None else (None if self.send_power_step==0 else round(energy_binning.power_step, 8))
 
                                 self.setStatusMessage("Running " + self.get_object_name() + " " + str(self.total_current_new_object) + " of " + str(self.total_new_objects))
                                 self.start_button.setEnabled(False)
                                 self.text_area.setEnabled(False)
-                                self.send("Trigger", TriggerOut(new_object=True,
-                                                                additional_parameters={"energy_value"   : self.current_energy_value,
-                                                                                       "energy_step"    : energy_binning.energy_step,
-                                                                                       "power_step"     : -1 if self.current_power_step is None else self.current_power_step,
-                                                                                       "seed_increment" : self.seed_increment,
-                                                                                       "start_event"    : False}))
+                                self.send("Trigger", TriggerOut(new_object=True, additional_parameters=self.get_additional_parameters(energy_binning.energy_step)))
                             else:
                                 self.reset_values()
                                 self.start_button.setEnabled(True)
@@ -46,7 +46,6 @@
 # #########################################################################
 
 import os, sys
-import time
 import numpy
 import scipy.ndimage.filters as filters
 import scipy.ndimage.interpolation as interpolation
@@ -67,6 +66,9 @@ from orangecontrib.shadow.util.shadow_objects import ShadowBeam
 from orangecontrib.shadow.util.shadow_util import ShadowCongruence, ShadowPlot
 from orangecontrib.shadow.widgets.gui.ow_automatic_element import AutomaticElement
 from orangecontrib.aps.shadow.util.gui import PowerPlotXYWidget
+from orangecontrib.aps.shadow.util.hdf5_util import PowerDensityHdf5File, PowerDensityHdf5Writer
+from orangecontrib.aps.util.accumulator import PowerDensityAccumulator
+from orangecontrib.aps.util.gui import PlotRedrawScheduler
 
 class PowerPlotXY(AutomaticElement):
 
@@ -113,6 +115,9 @@ class PowerPlotXY(AutomaticElement):
 
     autosave = Setting(0)
     autosave_file_name = Setting("autosave_power_density.hdf5")
+    autosave_compression = Setting(2)
+    autosave_flush_steps = Setting(10)
+    autosave_flush_seconds = Setting(30.0)
 
     kind_of_calculation = Setting(0)
     replace_poor_statistic = Setting(0)
@@ -122,6 +127,7 @@ class PowerPlotXY(AutomaticElement):
     sigma_x = Setting(0.0)
     sigma_y = Setting(0.0)
     gamma = Setting(0.0)
+    eta = Setting(0.5)
 
 
     loaded_plot_file_name = "<load hdf5 file>"
@@ -149,11 +155,18 @@ class PowerPlotXY(AutomaticElement):
 
     view_type=Setting(1)
 
+    redraw_mode = Setting(0)
+    redraw_interval = Setting(500)
+    redraw_steps = Setting(10)
+
     autosave_file = None
+    accumulator = None
 
     def __init__(self):
         super().__init__(show_automatic_box=False)
 
+        self.redraw_scheduler = PlotRedrawScheduler(self.redraw_plot)
+
         button_box = oasysgui.widgetBox(self.controlArea, "", addSpace=False, orientation="horizontal")
 
         gui.button(button_box, self, "Plot Data", callback=self.plot_cumulated_data, height=45)
@@ -232,7 +245,21 @@ class PowerPlotXY(AutomaticElement):
                                     items=["Transmitted", "Absorbed (Lost)", "Absorbed (Still Good)"],
                                     sendSelectedValue=False, orientation="horizontal")
 
-        autosave_box = oasysgui.widgetBox(tab_gen, "Autosave", addSpace=True, orientation="vertical", height=85)
+        redraw_box = oasysgui.widgetBox(tab_set, "Plot Refresh", addSpace=True, orientation="vertical", height=110)
+
+        gui.comboBox(redraw_box, self, "redraw_mode", label="Refresh Plot", labelWidth=200,
+                     items=["Every Step", "At most every N ms", "Every K Steps", "After N ms without new Steps"],
+                     sendSelectedValue=False, orientation="horizontal", callback=self.set_redraw_mode)
+
+        self.redraw_box_1 = oasysgui.widgetBox(redraw_box, "", addSpace=False, orientation="vertical", height=25)
+        self.redraw_box_2 = oasysgui.widgetBox(redraw_box, "", addSpace=False, orientation="vertical", height=25)
+
+        oasysgui.lineEdit(self.redraw_box_1, self, "redraw_interval", "N/Idle time before refresh [ms]", labelWidth=250, valueType=int, orientation="horizontal")
+        oasysgui.lineEdit(self.redraw_box_2, self, "redraw_steps", "K [steps]", labelWidth=250, valueType=int, orientation="horizontal")
+
+        self.set_redraw_mode()
+
+        autosave_box = oasysgui.widgetBox(tab_gen, "Autosave", addSpace=True, orientation="vertical", height=160)
 
         gui.comboBox(autosave_box, self, "autosave", label="Save automatically plot into file", labelWidth=250,
                                          items=["No", "Yes"],
@@ -245,6 +272,13 @@ class PowerPlotXY(AutomaticElement):
 
         gui.button(self.autosave_box_1, self, "...", callback=self.selectAutosaveFile)
 
+        self.autosave_box_3 = oasysgui.widgetBox(autosave_box, "", addSpace=False, orientation="vertical", height=75)
+
+        gui.comboBox(self.autosave_box_3, self, "autosave_compression", label="Compression", labelWidth=250,
+                     items=["None", "gzip", "lzf"], sendSelectedValue=False, orientation="horizontal")
+        oasysgui.lineEdit(self.autosave_box_3, self, "autosave_flush_steps", "Flush every N steps (0=never)", labelWidth=250, valueType=int, orientation="horizontal")
+        oasysgui.lineEdit(self.autosave_box_3, self, "autosave_flush_seconds", "Flush every T seconds (0=never)", labelWidth=250, valueType=float, orientation="horizontal")
+
         incremental_box = oasysgui.widgetBox(tab_gen, "Incremental Result", addSpace=True, orientation="vertical", height=120)
 
         gui.comboBox(incremental_box, self, "keep_result", label="Keep Result", labelWidth=250,
@@ -253,7 +287,10 @@ class PowerPlotXY(AutomaticElement):
         self.cb_autosave_partial_results = gui.comboBox(incremental_box, self, "autosave_partial_results", label="Save partial plots into file", labelWidth=250,
                                                         items=["No", "Yes"], sendSelectedValue=False, orientation="horizontal")
 
-        gui.button(incremental_box, self, "Clear", callback=self.clearResults)
+        button_box = oasysgui.widgetBox(incremental_box, "", addSpace=False, orientation="horizontal")
+
+        gui.button(button_box, self, "Clear", callback=self.clearResults)
+        gui.button(button_box, self, "Undo Last Step", callback=self.undoLastStep)
 
         self.set_autosave()
 
@@ -264,7 +301,8 @@ class PowerPlotXY(AutomaticElement):
         gui.separator(histograms_box)
 
         gui.comboBox(histograms_box, self, "kind_of_calculation", label="Kind of Calculation", labelWidth=200,
-                     items=["From Rays", "Flat Distribution", "Gaussian Distribution", "Lorentzian Distribution"], sendSelectedValue=False, orientation="horizontal", callback=self.set_kind_of_calculation)
+                     items=["From Rays", "Flat Distribution", "Gaussian Distribution", "Lorentzian Distribution",
+                            "Pseudo-Voigt (Beam Moments)", "Rotated Gaussian (Beam Moments)"], sendSelectedValue=False, orientation="horizontal", callback=self.set_kind_of_calculation)
 
         self.poor_statics_cb = gui.comboBox(histograms_box, self, "replace_poor_statistic", label="Activate on Poor Statistics", labelWidth=250,
                                             items=["No", "Yes"], sendSelectedValue=False, orientation="horizontal", callback=self.set_manage_poor_statistics)
@@ -277,6 +315,7 @@ class PowerPlotXY(AutomaticElement):
         self.kind_of_calculation_box_1 = oasysgui.widgetBox(histograms_box, "", addSpace=False, orientation="vertical", height=110)
         self.kind_of_calculation_box_2 = oasysgui.widgetBox(histograms_box, "", addSpace=False, orientation="vertical", height=110)
         self.kind_of_calculation_box_3 = oasysgui.widgetBox(histograms_box, "", addSpace=False, orientation="vertical", height=110)
+        self.kind_of_calculation_box_4 = oasysgui.widgetBox(histograms_box, "", addSpace=False, orientation="vertical", height=110)
 
         self.le_g_sigma_x = oasysgui.lineEdit(self.kind_of_calculation_box_2, self, "sigma_x", "Sigma H", labelWidth=100,  valueType=float, orientation="horizontal")
         self.le_g_sigma_y = oasysgui.lineEdit(self.kind_of_calculation_box_2, self, "sigma_y", "Sigma V", labelWidth=100,  valueType=float, orientation="horizontal")
@@ -287,6 +326,8 @@ class PowerPlotXY(AutomaticElement):
         self.le_l_center_x = oasysgui.lineEdit(self.kind_of_calculation_box_3, self, "center_x", "Center H", labelWidth=100,  valueType=float, orientation="horizontal")
         self.le_l_center_y = oasysgui.lineEdit(self.kind_of_calculation_box_3, self, "center_y", "Center V", labelWidth=100,  valueType=float, orientation="horizontal")
 
+        self.le_pv_eta = oasysgui.lineEdit(self.kind_of_calculation_box_4, self, "eta", "Gaussian Fraction (η)", labelWidth=200,  valueType=float, orientation="horizontal")
+
         self.set_kind_of_calculation()
 
         # post porcessing
@@ -385,18 +426,61 @@ class PowerPlotXY(AutomaticElement):
             self.energy_step = None
             self.total_power = None
             self.cumulated_total_power = None
+            self.accumulator = None
 
-            if not self.autosave_file is None:
-                self.autosave_file.close()
-                self.autosave_file = None
+            self.redraw_scheduler.cancel()
+            self.close_autosave_file()
 
             if not self.plot_canvas is None:
                 self.plot_canvas.clear()
 
+    def undoLastStep(self):
+        if self.autosave == 1:
+            QMessageBox.information(self, "Undo Last Step", "Undo is not available while saving into file: the saved steps cannot be removed", QMessageBox.Ok)
+        elif self.accumulator is None or not self.accumulator.can_undo():
+            QMessageBox.information(self, "Undo Last Step", "Only the last step of a cumulated result can be undone, and only once", QMessageBox.Ok)
+        elif ConfirmDialog.confirmed(parent=self, message="Remove the last step from the cumulated result?"):
+            try:
+                power_plot     = self.accumulator.get_records("power_plot")[-1]
+                incident_power = self.accumulator.get_records("incident_power")[-1]
+                total_power    = self.accumulator.get_records("total_power")[-1]
+
+                self.accumulator.undo()
+
+                if self.accumulator.number_of_steps == 0:
+                    self.clearResults(interactive=False)
+                else:
+                    self.cumulated_total_power -= total_power
+                    self.energy_max            = self.accumulator.get_records("energy_max")[-1]
+
+                    if not self.plot_canvas is None:
+                        self.plot_canvas.cumulated_power_plot -= power_plot
+                        self.plot_canvas.cumulated_previous_power_plot -= incident_power
+
+                    if not self.cumulated_ticket is None: # None if all the steps left have an empty beam
+                        self.cumulated_ticket = self.cumulated_ticket.copy()
+                        self.cumulated_ticket["histogram"] = self.accumulator.get_power_density().copy()
+                        self.cumulated_ticket["intensity"] = self.accumulator.get_total("intensity")
+                        self.cumulated_ticket["nrays"]     = int(self.accumulator.get_total("nrays"))
+                        self.cumulated_ticket["good_rays"] = int(self.accumulator.get_total("good_rays"))
+
+                        self.plotted_ticket = self.cumulated_ticket
+
+                        self.plot_cumulated_data()
+            except Exception as exception:
+                QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise exception
+
+    def set_redraw_mode(self):
+        self.redraw_box_1.setVisible(self.redraw_mode > 0)
+        self.redraw_box_2.setVisible(self.redraw_mode == 2)
+
     def set_kind_of_calculation(self):
-        self.kind_of_calculation_box_1.setVisible(self.kind_of_calculation<=1)
+        self.kind_of_calculation_box_1.setVisible(self.kind_of_calculation<=1 or self.kind_of_calculation==5)
         self.kind_of_calculation_box_2.setVisible(self.kind_of_calculation==2)
         self.kind_of_calculation_box_3.setVisible(self.kind_of_calculation==3)
+        self.kind_of_calculation_box_4.setVisible(self.kind_of_calculation==4)
 
         if self.kind_of_calculation > 0:
             self.poor_statics_cb.setEnabled(True)
@@ -413,6 +497,7 @@ class PowerPlotXY(AutomaticElement):
     def set_autosave(self):
         self.autosave_box_1.setVisible(self.autosave==1)
         self.autosave_box_2.setVisible(self.autosave==0)
+        self.autosave_box_3.setVisible(self.autosave==1)
 
         self.cb_autosave_partial_results.setEnabled(self.autosave==1 and self.keep_result==1)
 
@@ -495,6 +580,7 @@ class PowerPlotXY(AutomaticElement):
                                                            energy_step=energy_step)
 
                 self.cumulated_ticket = None
+                self.accumulator = None
                 self.plotted_ticket = ticket
                 self.plotted_ticket_original = ticket.copy()
             except Exception as e:
@@ -770,19 +856,23 @@ class PowerPlotXY(AutomaticElement):
 
             if self.autosave == 1:
                 if self.autosave_file is None:
-                    self.autosave_file = ShadowPlot.PlotXYHdf5File(congruence.checkDir(self.autosave_file_name))
+                    self.autosave_file = self.create_autosave_file()
                 elif self.autosave_file.filename != congruence.checkFileName(self.autosave_file_name):
-                    self.autosave_file.close()
-                    self.autosave_file = ShadowPlot.PlotXYHdf5File(congruence.checkDir(self.autosave_file_name))
+                    self.close_autosave_file()
+                    self.autosave_file = self.create_autosave_file()
 
             if self.keep_result == 1:
+                if self.accumulator is None: self.accumulator = PowerDensityAccumulator()
+
                 self.cumulated_ticket, last_ticket = self.plot_canvas.plot_power_density(shadow_beam, var_x, var_y,
                                                                                          self.total_power, self.cumulated_total_power,
                                                                                          self.energy_min, self.energy_max, self.energy_step,
                                                                                          nbins=nbins, xrange=xrange, yrange=yrange, nolost=nolost,
                                                                                          ticket_to_add=self.cumulated_ticket,
+                                                                                         accumulator=self.accumulator,
+                                                                                         records={"energy_max" : self.energy_max, "total_power" : self.total_power},
                                                                                          to_mm=self.workspace_units_to_mm,
-                                                                                         show_image=self.view_type==1,
+                                                                                         show_image=False,
                                                                                          kind_of_calculation=self.kind_of_calculation,
                                                                                          replace_poor_statistic=self.replace_poor_statistic,
                                                                                          good_rays_limit=self.good_rays_limit,
@@ -790,34 +880,26 @@ class PowerPlotXY(AutomaticElement):
                                                                                          center_y=self.center_y,
                                                                                          sigma_x=self.sigma_x,
                                                                                          sigma_y=self.sigma_y,
-                                                                                         gamma=self.gamma)
+                                                                                         gamma=self.gamma,
+                                                                                         eta=self.eta)
                 self.plotted_ticket = self.cumulated_ticket
                 self.plotted_ticket_original = self.plotted_ticket.copy()
 
                 if self.autosave == 1:
-                    self.autosave_file.write_coordinates(self.cumulated_ticket)
-                    dataset_name = "power_density"
-
-                    self.autosave_file.add_plot_xy(self.cumulated_ticket, dataset_name=dataset_name)
-
                     if self.autosave_partial_results == 1:
-                        if last_ticket is None:
-                            self.autosave_file.add_plot_xy(self.cumulated_ticket,
-                                                           plot_name="Energy Range: " + str(round(self.energy_max-self.energy_step, 2)) + "-" + str(round(self.energy_max, 2)),
-                                                           dataset_name=dataset_name)
-                        else:
-                            self.autosave_file.add_plot_xy(last_ticket,
-                                                           plot_name="Energy Range: " + str(round(self.energy_max-self.energy_step, 2)) + "-" + str(round(self.energy_max, 2)),
-                                                           dataset_name=dataset_name)
-
-                    self.autosave_file.flush()
+                        self.write_autosave_step(self.cumulated_ticket,
+                                                 partial_ticket=self.cumulated_ticket if last_ticket is None else last_ticket,
+                                                 energy_min=self.energy_max-self.energy_step,
+                                                 energy_max=self.energy_max)
+                    else:
+                        self.write_autosave_step(self.cumulated_ticket)
             else:
                 ticket, _ = self.plot_canvas.plot_power_density(shadow_beam, var_x, var_y,
                                                                 self.total_power, self.cumulated_total_power,
                                                                 self.energy_min, self.energy_max, self.energy_step,
                                                                 nbins=nbins, xrange=xrange, yrange=yrange, nolost=nolost,
                                                                 to_mm=self.workspace_units_to_mm,
-                                                                show_image=self.view_type==1,
+                                                                show_image=False,
                                                                 kind_of_calculation=self.kind_of_calculation,
                                                                 replace_poor_statistic=self.replace_poor_statistic,
                                                                 good_rays_limit=self.good_rays_limit,
@@ -825,23 +907,80 @@ class PowerPlotXY(AutomaticElement):
                                                                 center_y=self.center_y,
                                                                 sigma_x=self.sigma_x,
                                                                 sigma_y=self.sigma_y,
-                                                                gamma=self.gamma)
+                                                                gamma=self.gamma,
+                                                                eta=self.eta)
 
                 self.cumulated_ticket = None
+                self.accumulator = None
                 self.plotted_ticket = ticket
                 self.plotted_ticket_original = self.plotted_ticket.copy()
 
                 if self.autosave == 1:
-                    self.autosave_file.write_coordinates(ticket)
-                    self.autosave_file.add_plot_xy(ticket, dataset_name="power_density")
-                    self.autosave_file.flush()
+                    self.write_autosave_step(ticket)
 
+            if self.view_type == 1:
+                self.redraw_scheduler.set_parameters(self.redraw_mode, self.redraw_interval, self.redraw_steps)
+                self.redraw_scheduler.request()
         except Exception as e:
             if not self.IS_DEVELOP:
                 raise Exception("Data not plottable: No good rays or bad content")
             else:
                 raise e
 
+    def redraw_plot(self):
+        if not self.plotted_ticket is None and not self.plot_canvas is None:
+            try:
+                self.plot_canvas.plot_power_density_ticket(ticket=self.plotted_ticket,
+                                                           var_x=self.x_column_index+1,
+                                                           var_y=self.y_column_index+1,
+                                                           cumulated_total_power=self.cumulated_total_power,
+                                                           energy_min=self.energy_min,
+                                                           energy_max=self.energy_max,
+                                                           energy_step=self.energy_step,
+                                                           show_image=self.view_type==1)
+            except Exception as exception:
+                QMessageBox.critical(self, "Error", str(exception), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise exception
+
+    def create_autosave_file(self):
+        return PowerDensityHdf5Writer(congruence.checkDir(self.autosave_file_name),
+                                      compression=PowerDensityHdf5File.COMPRESSIONS[self.autosave_compression],
+                                      flush_steps=congruence.checkPositiveNumber(self.autosave_flush_steps, "Flush every N steps"),
+                                      flush_seconds=congruence.checkPositiveNumber(self.autosave_flush_seconds, "Flush every T seconds"))
+
+    def write_autosave_step(self, ticket, partial_ticket=None, energy_min=0.0, energy_max=0.0):
+        try:
+            self.autosave_file.write_step(ticket, partial_ticket=partial_ticket, energy_min=energy_min, energy_max=energy_max)
+        except Exception as exception:
+            autosave_file, self.autosave_file = self.autosave_file, None
+
+            try: autosave_file.close()
+            except: pass
+
+            self.autosave = 0
+            self.set_autosave()
+
+            QMessageBox.critical(self, "Error", "Autosave failed and has been disabled:\n" + str(exception), QMessageBox.Ok)
+
+            if self.IS_DEVELOP: raise exception
+
+    def close_autosave_file(self):
+        if not self.autosave_file is None:
+            autosave_file, self.autosave_file = self.autosave_file, None
+
+            try:
+                autosave_file.close()
+            except Exception as exception:
+                QMessageBox.critical(self, "Error", "Autosave failed:\n" + str(exception), QMessageBox.Ok)
+
+                if self.IS_DEVELOP: raise exception
+
+    def onDeleteWidget(self):
+        self.close_autosave_file()
+
+        super().onDeleteWidget()
+
     def plot_xy(self, var_x, var_y):
         beam_to_plot = self.input_beam
 
@@ -908,9 +1047,14 @@ class PowerPlotXY(AutomaticElement):
             if ShadowCongruence.checkEmptyBeam(self.input_beam):
                 self.number_of_bins = congruence.checkStrictlyPositiveNumber(self.number_of_bins, "Number of Bins")
 
-                self.plot_xy(self.x_column_index+1, self.y_column_index+1)
+                if self.kind_of_calculation == 4:
+                    congruence.checkPositiveNumber(self.eta, "Gaussian Fraction")
+                    congruence.checkLessOrEqualThan(self.eta, 1.0, "Gaussian Fraction", "1")
 
-            time.sleep(0.1)  # prevents a misterious dead lock in the Orange cycle when refreshing the histogram
+                if self.redraw_mode > 0: congruence.checkPositiveNumber(self.redraw_interval, "Refresh interval")
+                if self.redraw_mode == 2: congruence.checkStrictlyPositiveNumber(self.redraw_steps, "Refresh steps")
+
+                self.plot_xy(self.x_column_index+1, self.y_column_index+1)
         except Exception as exception:
             QMessageBox.critical(self, "Error",
                                        str(exception),
@@ -943,9 +1087,26 @@ class PowerPlotXY(AutomaticElement):
                     else:
                         self.cb_rays.setEnabled(True)
 
-                if ShadowCongruence.checkEmptyBeam(input_beam):
-                    if ShadowCongruence.checkGoodBeam(input_beam):
-                        self.plot_results()
+                if ShadowCongruence.checkEmptyBeam(input_beam) and ShadowCongruence.checkGoodBeam(input_beam):
+                    self.plot_results()
+                else:
+                    self.add_empty_step()
+
+    def add_empty_step(self):
+        # a step without good rays is not plotted, but it is recorded with a zero power density: undo always removes the last step
+        if self.keep_result == 1:
+            if self.accumulator is None: self.accumulator = PowerDensityAccumulator()
+
+            nbins = int(self.number_of_bins)
+
+            self.accumulator.add(numpy.zeros((nbins, nbins) if self.accumulator.shape is None else self.accumulator.shape),
+                                 intensity=0.0,
+                                 nrays=0,
+                                 good_rays=0,
+                                 power_plot=0.0,
+                                 incident_power=0.0,
+                                 energy_max=self.energy_max,
+                                 total_power=self.total_power)
 
     def writeStdOut(self, text):
         cursor = self.shadow_output.textCursor()
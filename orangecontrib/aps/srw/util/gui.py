@@ -7,7 +7,7 @@ from matplotlib import cm, rcParams
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 from matplotlib.collections import LineCollection
-from matplotlib.colors import colorConverter, ListedColormap
+from matplotlib.colors import colorConverter, ListedColormap, Normalize
 
 try:
     from mpl_toolkits.mplot3d import Axes3D  # mandatory to load 3D plot
@@ -73,8 +73,6 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
         self.setLayout(layout)
 
         self.xx = None
-        self.yy = None
-        self.zz = None
 
         self.title = ""
         self.xlabel = ""
@@ -84,6 +82,23 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
         self.__type=type
         self.__cc = lambda arg: colorConverter.to_rgba(arg, alpha=0.5)
 
+        self.__yy = None
+        self.__zz = None
+        self.__size = 0
+
+        self.reset_plot()
+
+    # scan data are stored in preallocated buffers (capacity doubled when full), and plotted incrementally: every
+    # redraw adds only the lines/surface strips of the histograms added after the previous one
+
+    @property
+    def yy(self):
+        return None if self.__size == 0 else self.__yy[:self.__size]
+
+    @property
+    def zz(self):
+        return None if self.__size == 0 else self.__zz[:self.__size]
+
     def clear(self):
         self.reset_plot()
         try:
@@ -93,8 +108,25 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
 
     def reset_plot(self):
         self.xx = None
-        self.yy = None
-        self.zz = None
+        self.__size = 0
+        self.__plotted_size = 0
+        self.__zmin = numpy.inf
+        self.__zmax = -numpy.inf
+
+        self.__has_colormap = True
+        self.__colormap = cm.rainbow
+        self.__transparent_colormap = None
+        self.__norm = None
+        self.__scalar_mappable = None
+        self.__colormapped_collections = []
+
+        if not self.colorbar is None:
+            try:
+                self.colorbar.remove()
+            except:
+                pass
+            self.colorbar = None
+
         self.axis.set_title("")
         self.axis.clear()
 
@@ -184,106 +216,115 @@ class Scan3DHistoWidget(AbstractScanHistoWidget):
 
         return HistogramData(histogram_stats, bins_stats, 0.0, xrange, fwhm, sigma, peak_intensity)
 
-    def add_histo(self, scan_value, intensities, has_colormap, colormap, histo_index):
+    def add_histo(self, scan_value, intensities, has_colormap, colormap, histo_index, redraw=True):
         if self.xx is None: raise ValueError("Initialize X range first")
         if self.xx.shape != intensities.shape: raise ValueError("Given Histogram has a different binning")
 
-        if isinstance(scan_value, str):
-            self.yy = numpy.array([1]) if self.yy is None else numpy.append(self.yy, len(self.yy)+1)
-        else:
-            self.yy = numpy.array([scan_value]) if self.yy is None else numpy.append(self.yy, scan_value)
+        if self.__size == 0:
+            self.__yy = numpy.zeros(16)
+            self.__zz = numpy.zeros((16, len(self.xx)))
+            self.__has_colormap = has_colormap
+            self.__colormap = colormap
 
-        if self.zz is None:
-            self.zz = numpy.array([intensities])
-        else:
-            self.zz = numpy.append(self.zz, intensities)
+            transparent_colormap = colormap(numpy.arange(colormap.N))
+            transparent_colormap[:,-1] = 0.5*numpy.ones(colormap.N)
+            self.__transparent_colormap = ListedColormap(transparent_colormap)
+        elif self.__size == len(self.__yy):
+            self.__yy = numpy.concatenate((self.__yy, numpy.zeros(len(self.__yy))))
+            self.__zz = numpy.concatenate((self.__zz, numpy.zeros(self.__zz.shape)))
 
-        self.axis.clear()
+        self.__yy[self.__size] = self.__size + 1 if isinstance(scan_value, str) else scan_value
+        self.__zz[self.__size] = intensities
+        self.__size += 1
 
-        self.restore_labels()
+        if redraw: self.redraw()
+
+    def redraw(self):
+        if self.__size == 0: return
 
-        x_to_plot, y_to_plot = numpy.meshgrid(self.xx, self.yy)
-        zz_to_plot = self.zz.reshape(len(self.yy), len(self.xx))
+        if self.__plotted_size == 0:
+            self.axis.clear()
+            self.axis.mouse_init()
+
+        self.restore_labels()
 
-        if self.__type==Scan3DHistoWidget.PlotType.SURFACE:
-            if has_colormap:
-                self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
-                                       rstride=1, cstride=1, cmap=colormap, linewidth=0.5, antialiased=True)
-            else:
-                self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
-                                       rstride=1, cstride=1, color=self.__cc('black'), linewidth=0.5, antialiased=True)
+        new_rows = range(self.__plotted_size, self.__size)
 
-        elif self.__type==Scan3DHistoWidget.PlotType.LINES:
+        self.__zmin = min(self.__zmin, numpy.min(self.__zz[self.__plotted_size:self.__size]))
+        self.__zmax = max(self.__zmax, numpy.max(self.__zz[self.__plotted_size:self.__size]))
 
-            if has_colormap:
-                self.plot_lines_colormap(x_to_plot, y_to_plot, zz_to_plot, colormap, histo_index)
-            else:
-                self.plot_lines_black(x_to_plot, zz_to_plot)
+        if self.__has_colormap: self.__update_norm()
 
-            xmin = numpy.min(self.xx)
-            xmax = numpy.max(self.xx)
-            ymin = numpy.min(self.yy)
-            ymax = numpy.max(self.yy)
-            zmin = numpy.min(self.zz)
-            zmax = numpy.max(self.zz)
+        for row in new_rows:
+            if self.__type==Scan3DHistoWidget.PlotType.SURFACE:
+                if row > 0: self.add_surface_strip(row)
+            elif self.__type==Scan3DHistoWidget.PlotType.LINES:
+                if self.__has_colormap:
+                    self.add_lines_colormap(row)
+                else:
+                    self.add_lines_black(row)
 
-            self.axis.set_xlim(xmin,xmax)
-            self.axis.set_ylim(ymin,ymax)
-            self.axis.set_zlim(zmin,zmax)
+        self.__plotted_size = self.__size
 
-        self.axis.mouse_init()
+        self.axis.set_xlim(numpy.min(self.xx), numpy.max(self.xx))
+        if self.__size > 1: self.axis.set_ylim(numpy.min(self.yy), numpy.max(self.yy))
+        if self.__zmax > self.__zmin: self.axis.set_zlim(self.__zmin, self.__zmax)
 
         try:
-            self.plot_canvas.draw()
+            self.plot_canvas.draw_idle()
         except:
             pass
 
     def add_empty_curve(self, histo_data):
         pass
 
+    def add_lines_black(self, row):
+        self.axis.add_collection3d(LineCollection([numpy.array([self.xx, self.__zz[row]]).T], colors=[self.__cc('black')]),
+                                   zs=self.__yy[row], zdir='y')
 
-    def plot_lines_black(self, X, Z):
-        verts = []
-        for i in range(len(self.yy)):
-            verts.append(list(zip(X[i], Z[i, :])))
-
-        self.axis.add_collection3d(LineCollection(verts, colors=[self.__cc('black')]), zs=self.yy, zdir='y')
+    def add_lines_colormap(self, row):
+        # reshape the X,Z into pairs
+        points = numpy.array([self.xx, self.__zz[row]]).T.reshape(-1, 1, 2)
+        segments = numpy.concatenate([points[:-1], points[1:]], axis=1)
 
-    def plot_lines_colormap(self, X, Y, Z, colormap, histo_index):
+        lc = LineCollection(segments, cmap=self.__transparent_colormap, norm=self.__norm)
 
-        import matplotlib.pyplot as plt
+        # Set the values used for colormapping
+        lc.set_array((self.__zz[row, 1:] + self.__zz[row, :-1])/2)
+        lc.set_linewidth(2) # set linewidth a little larger to see properly the colormap variation
+        self.axis.add_collection3d(lc, zs=self.__yy[row],  zdir='y') # add line to axes
 
-        # Set normalization to the same values for all plots
-        norm = plt.Normalize(numpy.min(self.zz), numpy.max(self.zz))
+        self.__colormapped_collections.append(lc)
 
-        # Check sizes to loop always over the smallest dimension
-        n,m = Z.shape
+    def add_surface_strip(self, row):
+        x_to_plot, y_to_plot = numpy.meshgrid(self.xx, self.__yy[row-1:row+1])
+        zz_to_plot = self.__zz[row-1:row+1]
 
-        if n>m:
-            X=X.T; Y=Y.T; Z=Z.T
-            m,n = n,m
+        if self.__has_colormap:
+            strip = self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
+                                           rstride=1, cstride=1, cmap=self.__colormap, norm=self.__norm, linewidth=0.5, antialiased=True)
 
-        transparent_colormap = colormap(numpy.arange(colormap.N))
-        transparent_colormap[:,-1] = 0.5*numpy.ones(colormap.N)
-        transparent_colormap = ListedColormap(transparent_colormap)
+            self.__colormapped_collections.append(strip)
+        else:
+            self.axis.plot_surface(x_to_plot, y_to_plot, zz_to_plot,
+                                   rstride=1, cstride=1, color=self.__cc('black'), linewidth=0.5, antialiased=True)
 
-        for j in range(n):
-            # reshape the X,Z into pairs
-            points = numpy.array([X[j,:], Z[j,:]]).T.reshape(-1, 1, 2)
-            segments = numpy.concatenate([points[:-1], points[1:]], axis=1)
-            lc = LineCollection(segments, cmap=transparent_colormap, norm=norm)
+    def __update_norm(self):
+        # the same normalization is shared by all the plots and by the colorbar: only its limits are changed
+        if self.__norm is None:
+            self.__norm = Normalize(self.__zmin, self.__zmax)
+            self.__scalar_mappable = cm.ScalarMappable(norm=self.__norm, cmap=self.__transparent_colormap)
+            self.__scalar_mappable.set_array([])
 
-            # Set the values used for colormapping
-            lc.set_array((Z[j,1:]+Z[j,:-1])/2)
-            lc.set_linewidth(2) # set linewidth a little larger to see properly the colormap variation
-            self.axis.add_collection3d(lc, zs=(Y[j,1:]+Y[j,:-1])/2,  zdir='y') # add line to axes
+            if self.__type==Scan3DHistoWidget.PlotType.LINES:
+                self.colorbar = self.figure.colorbar(self.__scalar_mappable, ax=self.axis)
+        elif self.__norm.vmin != self.__zmin or self.__norm.vmax != self.__zmax:
+            self.__norm.autoscale([self.__zmin, self.__zmax]) # a single notification to plots and colorbar
 
-        if histo_index==0:
-            self.colorbar = self.figure.colorbar(lc) # add colorbar, as the normalization is the same for all,
+            if not hasattr(self.__norm, "callbacks"): # matplotlib < 3.5: changes of the norm are not notified
+                for collection in self.__colormapped_collections: collection.changed()
 
-        self.colorbar.update_normal(lc)
-        self.colorbar.draw_all()
-        self.colorbar.update_bruteforce(lc)
+                if not self.colorbar is None: self.colorbar.update_normal(self.__scalar_mappable)
 
 class ScanHistoWidget(AbstractScanHistoWidget):
 
@@ -0,0 +1,117 @@
+import math, numpy
+
+class PowerDensityAccumulator(object):
+    """
+    cumulated power density of a scan (sum of one 2D histogram per step), with records of scalar values per step
+    (e.g. energy, flux, power)
+
+    the sum is kept in float64 with Kahan compensated summation, in preallocated buffers updated in place. Buffers
+    are doubled: each step writes the new sum over the one of two steps before, so that:
+    - get_power_density returns in O(1) a read-only view, valid until the second following step (copy it to keep it)
+    - undo restores the state before the last step
+
+    records are kept in preallocated arrays, grown by doubling their capacity
+    """
+    def __init__(self, initial_capacity=256):
+        self.initial_capacity = initial_capacity
+
+        self.reset()
+
+    def reset(self):
+        self.__sums = None
+        self.__compensations = None
+        self.__scratch = None
+        self.__current = 0
+        self.__number_of_steps = 0
+        self.__can_undo = False
+
+        self.__records = {}
+
+    @property
+    def number_of_steps(self):
+        return self.__number_of_steps
+
+    @property
+    def shape(self):
+        return None if self.__sums is None else self.__sums[0].shape
+
+    def can_undo(self):
+        return self.__can_undo
+
+    def add(self, power_density, **records):
+        power_density = numpy.asarray(power_density, dtype=numpy.float64)
+
+        if self.__sums is None:
+            self.__sums          = [numpy.zeros(power_density.shape), numpy.zeros(power_density.shape)]
+            self.__compensations = [numpy.zeros(power_density.shape), numpy.zeros(power_density.shape)]
+            self.__scratch       = numpy.zeros(power_density.shape)
+        elif power_density.shape != self.shape:
+            raise ValueError("Power density with shape " + str(power_density.shape) + " cannot be added to the cumulated one, with shape " + str(self.shape))
+
+        if self.__number_of_steps == 0:
+            self.__sums[self.__current][:]          = 0.0
+            self.__compensations[self.__current][:] = 0.0
+
+        current_sum          = self.__sums[self.__current]
+        current_compensation = self.__compensations[self.__current]
+        new_sum              = self.__sums[1 - self.__current]
+        new_compensation     = self.__compensations[1 - self.__current]
+
+        numpy.subtract(power_density, current_compensation, out=self.__scratch)
+        numpy.add(current_sum, self.__scratch, out=new_sum)
+        numpy.subtract(new_sum, current_sum, out=new_compensation)
+        new_compensation -= self.__scratch
+
+        for name, value in records.items():
+            self.__add_record(name, value)
+
+        self.__current = 1 - self.__current
+        self.__number_of_steps += 1
+        self.__can_undo = True
+
+    def undo(self):
+        if not self.__can_undo: raise ValueError("Only the last step can be undone")
+
+        self.__current = 1 - self.__current
+        self.__number_of_steps -= 1
+        self.__can_undo = False
+
+        for name in self.__records.keys():
+            values, size = self.__records[name]
+            self.__records[name] = [values, min(size, self.__number_of_steps)]
+
+    def get_power_density(self):
+        if self.__sums is None or self.__number_of_steps == 0: return None
+
+        power_density = self.__sums[self.__current].view()
+        power_density.flags.writeable = False
+
+        return power_density
+
+    def get_records(self, name):
+        values, size = self.__records[name]
+
+        records = values[:size].view()
+        records.flags.writeable = False
+
+        return records
+
+    def get_total(self, name):
+        return math.fsum(self.get_records(name))
+
+    def __add_record(self, name, value):
+        if not name in self.__records:
+            self.__records[name] = [numpy.zeros(self.initial_capacity), 0]
+
+        values, size = self.__records[name]
+
+        while len(values) <= self.__number_of_steps:
+            values = numpy.concatenate((values, numpy.zeros(len(values))))
+
+        if size < self.__number_of_steps: # record not given in all the steps
+            values[size:self.__number_of_steps] = numpy.nan
+            size = self.__number_of_steps
+
+        values[size] = value
+
+        self.__records[name] = [values, size + 1]
@@ -11,18 +11,37 @@ class CustomDistribution(object):
     the overhead is minimal
 
     a call to this distibution object returns indices into density array
+
+    with interpolation the returned indices are continuous (index i is the position of pdf[i]):
+     - UNIFORM: piecewise constant density, uniform inside the cell centered on each pdf value
+     - LINEAR:  piecewise linear (1D) or bilinear (2D) density between the pdf values, the cells
+                are the intervals between adjacent values (allowed only for 1 or 2 dimensions)
     """
+    NONE    = 0
+    UNIFORM = 1
+    LINEAR  = 2
+
     def __init__(self, pdf, sort = False, interpolation = False, transform = lambda x: x, seed=0):
-        self.shape          = pdf.shape
-        self.pdf            = pdf.ravel()
+        self.interpolation  = int(interpolation)
         self.sort           = sort
-        self.interpolation  = interpolation
         self.transform      = transform
         self.seed = seed
 
         #a pdf can not be negative
         assert(numpy.all(pdf>=0))
 
+        if self.interpolation == CustomDistribution.LINEAR:
+            if not 1 <= pdf.ndim <= 2: raise ValueError("Linear interpolation is possible only for 1D or 2D distributions")
+            if numpy.any(numpy.array(pdf.shape) < 2): raise ValueError("Linear interpolation needs at least 2 values per dimension")
+
+            self.nodes = pdf
+            # probability of each cell between adjacent values
+            if pdf.ndim == 1: pdf = 0.5*(pdf[:-1] + pdf[1:])
+            else:             pdf = 0.25*(pdf[:-1, :-1] + pdf[1:, :-1] + pdf[:-1, 1:] + pdf[1:, 1:])
+
+        self.shape          = pdf.shape
+        self.pdf            = pdf.ravel()
+
         #sort the pdf by magnitude
         if self.sort:
             self.sortindex = numpy.argsort(self.pdf, axis=None)
@@ -51,6 +70,172 @@ class CustomDistribution(object):
         index = numpy.unravel_index(index, self.shape)
         index = numpy.vstack(index)
         #is this a discrete or piecewise continuous distribution?
-        if self.interpolation:
-            index = index + numpy.random.uniform(size=index.shape)
+        if self.interpolation == CustomDistribution.UNIFORM:
+            index = index + numpy.random.uniform(size=index.shape) - 0.5
+        elif self.interpolation == CustomDistribution.LINEAR:
+            index = index + self.__linear_offsets(index, numpy.random.uniform(size=index.shape))
         return self.transform(index)
+
+    def __linear_offsets(self, index, random):
+        # inversion of the linear density between the values at the borders of each cell
+        if self.ndim == 1:
+            i = index[0]
+
+            return numpy.vstack([CustomDistribution.__invert_linear(self.nodes[i], self.nodes[i+1], random[0])])
+        else:
+            i, j = index
+            f00 = self.nodes[i, j]
+            f10 = self.nodes[i+1, j]
+            f01 = self.nodes[i, j+1]
+            f11 = self.nodes[i+1, j+1]
+
+            u = CustomDistribution.__invert_linear(f00 + f01, f10 + f11, random[0])
+            v = CustomDistribution.__invert_linear((1-u)*f00 + u*f10, (1-u)*f01 + u*f11, random[1])
+
+            return numpy.vstack([u, v])
+
+    @staticmethod
+    def __invert_linear(a, b, random):
+        # solution in [0, 1] of a*t + (b-a)*t^2/2 = random*(a+b)/2, in a numerically stable form
+        numerator = random*(a + b)
+        denominator = a + numpy.sqrt(a**2 + random*(b**2 - a**2))
+
+        t = numpy.array(random, dtype=float, copy=True)
+        good = denominator > 0
+        t[good] = numerator[good]/denominator[good]
+
+        return numpy.clip(t, 0.0, 1.0)
+
+class CustomDistribution2D(object):
+    """
+    vectorized replacement of random_distributions.Distribution2D
+
+    draws samples from a two dimensional probability distribution (a matrix of relative
+    probabilities of the cells of a regular grid) by means of a cumulative marginal
+    distribution on the first axis and of the conditional cumulative distributions on
+    the second axis, inverted with searchsorted
+
+    as in Distribution2D the samples are uniformly distributed inside the cells and a call
+    to get_samples returns an (N, 2) array of coordinates normalized between 0 and 1
+    """
+    def __init__(self, pdf, min_corner=(0, 0), max_corner=(1, 1)):
+        pdf = numpy.asarray(pdf, dtype=numpy.float64)
+
+        #a pdf can not be negative
+        assert(numpy.all(pdf>=0))
+
+        self.min_x, self.min_y = min_corner
+        self.max_x, self.max_y = max_corner
+        self.width, self.height = pdf.shape
+
+        marginal = pdf.sum(axis=1)
+
+        if marginal.sum() <= 0: raise ValueError("Probability matrix is empty")
+
+        #cumulative marginal distribution, normalized, with a leading 0
+        self.cdf_x = numpy.concatenate((numpy.zeros(1), numpy.cumsum(marginal)))
+        self.cdf_x /= self.cdf_x[-1]
+
+        #conditional cumulative distributions, one per row, normalized, with a leading 0
+        #rows with zero probability are never drawn, they are set to uniform to stay finite
+        cdf_y = numpy.zeros((self.width, self.height + 1))
+        cdf_y[:, 1:] = numpy.cumsum(pdf, axis=1)
+
+        empty_rows = marginal <= 0
+        cdf_y[empty_rows, 1:] = numpy.arange(1, self.height + 1)
+        cdf_y /= cdf_y[:, -1:]
+
+        #each row is shifted by its index: all the tables can be inverted with a single searchsorted
+        self.cdf_y = (cdf_y + numpy.arange(self.width)[:, numpy.newaxis]).ravel()
+        self.cdf_y_raw = cdf_y
+
+    def get_samples(self, N, seed=0, random_generator=None):
+        # as Distribution2D: any seed, 0 included, gives the same samples at every call
+        if random_generator is None: random_generator = numpy.random.default_rng(seed)
+
+        N = int(N)
+
+        u = random_generator.random(N)
+        v = random_generator.random(N)
+
+        ix = numpy.clip(numpy.searchsorted(self.cdf_x, u, side="right") - 1, 0, self.width - 1)
+        x = ix + self.__fraction(u, self.cdf_x[ix], self.cdf_x[ix + 1])
+
+        position = numpy.searchsorted(self.cdf_y, ix + v, side="right") - 1
+        iy = numpy.clip(position - ix*(self.height + 1), 0, self.height - 1)
+        y = iy + self.__fraction(v, self.cdf_y_raw[ix, iy], self.cdf_y_raw[ix, iy + 1])
+
+        samples = numpy.empty((N, 2))
+        samples[:, 0] = x / self.width
+        samples[:, 1] = y / self.height
+
+        return samples
+
+    @staticmethod
+    def __fraction(value, lower, upper):
+        width = upper - lower
+        width[width <= 0] = 1.0
+
+        return numpy.clip((value - lower) / width, 0.0, 1.0)
+
+class SeparableDistribution2D(object):
+    """
+    two dimensional probability distribution given as the product of two one dimensional ones
+    (pdf[i, j] = pdf_x[i]*pdf_y[j]): samples are drawn on each axis independently, in O(N+M)
+    and without building the N x M matrix
+
+    get_samples has the same interface and output of CustomDistribution2D, and draws the same
+    samples of CustomDistribution2D(to_array()) with the same random numbers
+    """
+    def __init__(self, pdf_x, pdf_y):
+        self.pdf_x = numpy.asarray(pdf_x, dtype=numpy.float64)
+        self.pdf_y = numpy.asarray(pdf_y, dtype=numpy.float64)
+
+        #a pdf can not be negative
+        assert(numpy.all(self.pdf_x>=0) and numpy.all(self.pdf_y>=0))
+
+        if self.pdf_x.sum() <= 0 or self.pdf_y.sum() <= 0: raise ValueError("Probability matrix is empty")
+
+        self.width, self.height = len(self.pdf_x), len(self.pdf_y)
+
+        self.cdf_x = SeparableDistribution2D.__get_cdf(self.pdf_x)
+        self.cdf_y = SeparableDistribution2D.__get_cdf(self.pdf_y)
+
+    @property
+    def shape(self):
+        return (self.width, self.height)
+
+    def to_array(self):
+        return numpy.outer(self.pdf_x, self.pdf_y)
+
+    def get_samples(self, N, seed=0, random_generator=None):
+        if random_generator is None: random_generator = numpy.random.default_rng(seed)
+
+        N = int(N)
+
+        u = random_generator.random(N)
+        v = random_generator.random(N)
+
+        samples = numpy.empty((N, 2))
+        samples[:, 0] = SeparableDistribution2D.__invert(self.cdf_x, u) / self.width
+        samples[:, 1] = SeparableDistribution2D.__invert(self.cdf_y, v) / self.height
+
+        return samples
+
+    @staticmethod
+    def __get_cdf(pdf):
+        #cumulative distribution, normalized, with a leading 0
+        cdf = numpy.concatenate((numpy.zeros(1), numpy.cumsum(pdf)))
+
+        return cdf / cdf[-1]
+
+    @staticmethod
+    def __invert(cdf, random):
+        #index of the cell plus the position inside it (uniform)
+        size  = len(cdf) - 1
+        index = numpy.clip(numpy.searchsorted(cdf, random, side="right") - 1, 0, size - 1)
+
+        width = cdf[index + 1] - cdf[index]
+        width[width <= 0] = 1.0
+
+        return index + numpy.clip((random - cdf[index]) / width, 0.0, 1.0)
@@ -0,0 +1,222 @@
+import numpy
+import scipy.constants as codata
+
+SPECTRUM_FILE = "autobinning.dat"
+FILTERS_FILE  = "filters.dat"
+
+class EnergyBinning(object):
+    def __init__(self,
+                 energy_value = 0.0,
+                 energy_value_to = None,
+                 energy_step       = 0.0,
+                 power_step        = None,
+                 number_of_rays    = None):
+        self.energy_value    = energy_value
+        self.energy_value_to = energy_value_to
+        self.energy_step     = energy_step
+        self.power_step      = power_step
+        self.number_of_rays  = number_of_rays
+
+    def __str__(self):
+        return str(self.energy_value) + ", " + str(self.energy_value_to) + ", " + str(self.energy_step) + ", " + str(self.power_step) + ", " + str(self.number_of_rays)
+
+def read_spectrum_file(file_name=SPECTRUM_FILE):
+    return _read_two_columns_file(file_name)
+
+def read_filters_file(file_name=FILTERS_FILE):
+    return _read_two_columns_file(file_name)
+
+def write_spectrum_file(spectrum_data, file_name=SPECTRUM_FILE):
+    _write_two_columns_file(file_name, "Energy Flux", spectrum_data)
+
+def write_filters_file(filters, file_name=FILTERS_FILE):
+    _write_two_columns_file(file_name, "Energy Filter", filters)
+
+def get_two_columns_data(data):
+    """
+    first two columns (energy, value) of spectra and filters, as float64 array
+    """
+    data = numpy.array(data, dtype=numpy.float64)
+
+    if data.ndim != 2 or data.shape[1] < 2: raise ValueError("Data should have at least two columns (energy, value), found shape: " + str(data.shape))
+
+    return data[:, 0:2].copy()
+
+# binary .npy files, or text files with one header line
+
+def _read_two_columns_file(file_name):
+    if str(file_name).endswith(".npy"): return get_two_columns_data(numpy.load(file_name))
+    else: return get_two_columns_data(numpy.loadtxt(file_name, skiprows=1, ndmin=2))
+
+def _write_two_columns_file(file_name, header, data):
+    data = get_two_columns_data(data)
+
+    if str(file_name).endswith(".npy"): numpy.save(file_name, data)
+    else: numpy.savetxt(file_name, data, header=header, comments="")
+
+def calculate_automatic_binning(spectrum_data, filters=None, autobinning=1, n_step=1001, perc_total_power=99, power_tolerance=0.01, max_n_step=10000):
+    """
+    energy binning of a spectrum (energy, flux through the finite aperture [ph/s/.1%bw]), limited to the energies
+    containing perc_total_power % of the total power, with n_step bins of constant power (autobinning=1) or of
+    constant energy (autobinning=2). Filters (energy, intensity factor) are used for the filtered curves only
+
+    adaptive binning (autobinning=3) starts from n_step bins of constant power and halves the bins whose power
+    error is above power_tolerance % of the total power, up to max_n_step bins. The error of a bin is the one of
+    the source, that computes the power of the bin from the flux at its first energy (flux * energy step): it is
+    large where the spectrum is steep or curved (harmonic peaks and edges) and small on the smooth tails
+
+    returns a dictionary with the binning (energies, energy_steps, power_steps, flux_steps, cumulated_powers) and
+    the curves of the spectrum, within the selected range
+    """
+    if not autobinning in [1, 2, 3]: raise ValueError("Automatic binning not recognized: " + str(autobinning))
+
+    energies                              = spectrum_data[:, 0]
+    flux_through_finite_aperture          = spectrum_data[:, 1]
+    flux_through_finite_aperture_filtered = flux_through_finite_aperture.copy()
+
+    if not filters is None:
+        flux_through_finite_aperture_filtered *= numpy.interp(energies, filters[:, 0], filters[:, 1])
+
+    energy_step = energies[1] - energies[0]
+
+    # last energy do not contribute to the total (the approximated integral of the power is out of the range)
+
+    power           = flux_through_finite_aperture * (1e3 * energy_step * codata.e)
+    cumulated_power = numpy.cumsum(power)
+    total_power     = cumulated_power[-1]
+
+    power_filtered           = flux_through_finite_aperture_filtered * (1e3 * energy_step * codata.e)
+    cumulated_power_filtered = numpy.cumsum(power_filtered)
+    total_power_filtered     = cumulated_power_filtered[-1]
+
+    good = numpy.where(cumulated_power <= perc_total_power*0.01*total_power)
+
+    energies                              = energies[good]
+    cumulated_power                       = cumulated_power[good]
+    cumulated_power_filtered              = cumulated_power_filtered[good]
+    flux_through_finite_aperture          = flux_through_finite_aperture[good]
+    flux_through_finite_aperture_filtered = flux_through_finite_aperture_filtered[good]
+
+    if autobinning==1: # constant power
+        interpolated_cumulated_power = numpy.linspace(start=numpy.min(cumulated_power), stop=numpy.max(cumulated_power), num=n_step+1)
+        interpolated_energies        = numpy.interp(interpolated_cumulated_power, cumulated_power, energies)
+        energy_steps = numpy.ediff1d(interpolated_energies)
+
+        interpolated_energies        = interpolated_energies[:-1]
+        interpolated_cumulated_power = interpolated_cumulated_power[:-1]
+
+        power_steps  = numpy.ones(n_step)*cumulated_power[-1]/n_step
+
+    elif autobinning==2: # constant energy
+        minimum_energy = energies[0]
+        maximum_energy = energies[-1]
+        energy_step = (maximum_energy-minimum_energy)/n_step
+
+        interpolated_energies        = numpy.arange(minimum_energy, maximum_energy, energy_step)
+        interpolated_cumulated_power = numpy.interp(interpolated_energies, energies, cumulated_power)
+
+        energy_steps = numpy.ones(n_step)*energy_step
+        power_steps  = numpy.ediff1d(numpy.append(numpy.zeros(1), interpolated_cumulated_power))
+
+    elif autobinning==3: # adaptive
+        energy_edges, power_steps, power_errors = _calculate_adaptive_energy_edges(energies,
+                                                                                   cumulated_power,
+                                                                                   flux_through_finite_aperture,
+                                                                                   n_step,
+                                                                                   power_tolerance*0.01*total_power,
+                                                                                   max_n_step,
+                                                                                   minimum_energy_step=2*energy_step)
+
+        interpolated_energies        = energy_edges[:-1]
+        interpolated_cumulated_power = numpy.interp(interpolated_energies, energies, cumulated_power)
+        energy_steps                 = numpy.ediff1d(energy_edges)
+
+    flux_steps = numpy.interp(interpolated_energies, energies, flux_through_finite_aperture)
+
+    return {"energies"                              : interpolated_energies,
+            "energy_steps"                          : energy_steps,
+            "power_steps"                           : power_steps,
+            "flux_steps"                            : flux_steps,
+            "power_errors"                          : power_errors if autobinning==3 else None,
+            "cumulated_powers"                      : interpolated_cumulated_power,
+            "spectrum_energies"                     : energies,
+            "cumulated_power"                       : cumulated_power,
+            "cumulated_power_filtered"              : None if filters is None else cumulated_power_filtered,
+            "total_power_filtered"                  : None if filters is None else total_power_filtered,
+            "flux_through_finite_aperture"          : flux_through_finite_aperture,
+            "flux_through_finite_aperture_filtered" : None if filters is None else flux_through_finite_aperture_filtered}
+
+def _calculate_adaptive_energy_edges(energies, cumulated_power, flux, n_step, tolerance, max_n_step, minimum_energy_step):
+    def get_bin_powers(energy_edges):
+        cumulated_power_at_edges = numpy.interp(energy_edges, energies, cumulated_power)
+
+        power_steps     = numpy.ediff1d(cumulated_power_at_edges)
+        estimated_power = numpy.interp(energy_edges[:-1], energies, flux) * (1e3 * numpy.ediff1d(energy_edges) * codata.e)
+
+        return power_steps, numpy.abs(power_steps - estimated_power)
+
+    # coarse binning: constant power
+    energy_edges = numpy.interp(numpy.linspace(start=numpy.min(cumulated_power), stop=numpy.max(cumulated_power), num=n_step+1), cumulated_power, energies)
+
+    power_steps, power_errors = get_bin_powers(energy_edges)
+
+    while len(energy_edges) - 1 < max_n_step:
+        # bins narrower than the sampling of the spectrum cannot be improved
+        to_split = numpy.where((power_errors > tolerance) & (numpy.ediff1d(energy_edges) > minimum_energy_step))[0]
+
+        if len(to_split) == 0: break
+
+        # worst bins first, within the maximum number of bins
+        to_split = to_split[numpy.argsort(power_errors[to_split])[::-1]][:max_n_step - (len(energy_edges) - 1)]
+
+        energy_edges = numpy.sort(numpy.append(energy_edges, 0.5*(energy_edges[to_split] + energy_edges[to_split + 1])))
+
+        power_steps, power_errors = get_bin_powers(energy_edges)
+
+    return energy_edges, power_steps, power_errors
+
+def get_energy_binnings(binning):
+    return [EnergyBinning(energy_value=round(energy_value, 3),
+                          energy_step=round(energy_step, 3),
+                          power_step=round(power_step, 4)) for energy_value, energy_step, power_step in zip(binning["energies"],
+                                                                                                              binning["energy_steps"],
+                                                                                                              binning["power_steps"])]
+
+def allocate_number_of_rays(power_steps, total_number_of_rays, minimum_number_of_rays=0):
+    """
+    number of rays of every energy step, proportional to the power of the step and not less than
+    minimum_number_of_rays, with total_number_of_rays in total: steps below the minimum are raised to it and the
+    remaining rays are shared among the other steps (rays left by the rounding go to the largest remainders)
+    """
+    power_steps = numpy.maximum(numpy.asarray(power_steps, dtype=numpy.float64), 0.0)
+    n_step      = len(power_steps)
+
+    if n_step == 0: return numpy.zeros(0, dtype=int)
+    if total_number_of_rays < n_step*minimum_number_of_rays:
+        raise ValueError("Total number of rays should be >= " + str(n_step*minimum_number_of_rays) + " (" + str(n_step) + " steps with at least " + str(minimum_number_of_rays) + " rays)")
+
+    number_of_rays = numpy.full(n_step, float(minimum_number_of_rays))
+    free           = numpy.ones(n_step, dtype=bool)
+
+    while numpy.any(free):
+        free_indexes = numpy.where(free)[0]
+        free_rays    = total_number_of_rays - minimum_number_of_rays*(n_step - len(free_indexes))
+        free_power   = power_steps[free_indexes].sum()
+
+        if free_power > 0: shares = free_rays*power_steps[free_indexes]/free_power
+        else:              shares = numpy.full(len(free_indexes), free_rays/len(free_indexes))
+
+        below = shares < minimum_number_of_rays
+
+        if not numpy.any(below):
+            number_of_rays[free_indexes] = shares
+            break
+
+        free[free_indexes[below]] = False
+
+    rounded_number_of_rays = numpy.floor(number_of_rays).astype(int)
+    remainders             = number_of_rays - rounded_number_of_rays
+
+    rounded_number_of_rays[numpy.argsort(remainders, kind="stable")[::-1][:total_number_of_rays - rounded_number_of_rays.sum()]] += 1
+
+    return rounded_number_of_rays
@@ -1,5 +1,6 @@
-import os, numpy
+import os, time, numpy
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QWidget, QVBoxLayout
 
 from oasys.widgets import gui as oasysgui
@@ -208,6 +209,82 @@ class DoublePlotWidget(QWidget):
         self.ax2.plot(x, y2, "r.-")
         self.ax2.set_ylabel(ylabel2, color="r")
 
+class PlotRedrawScheduler(object):
+    """
+    coalesces the redraws of a plot updated at every step of a scan: the data are updated at every step, while the
+    redraw is requested and executed later by the Qt event loop, never inside the widget input (signal) handler
+    that received the step. Drawing inside the handler of the Orange signal manager was the cause of the dead locks
+    previously avoided by sleeping after every step
+
+    modes:
+    - EVERY_STEP: one redraw per step (steps arrived before the event loop is free are coalesced)
+    - THROTTLED: at most one redraw every interval [ms]
+    - EVERY_K_STEPS: one redraw every steps steps, and when no new step arrives in interval [ms]
+    - AFTER_IDLE: one redraw when no new step arrives in interval [ms]: with steps slower than interval, this is a
+      redraw per step (the widgets do not receive an end of scan signal)
+    """
+    EVERY_STEP = 0
+    THROTTLED = 1
+    EVERY_K_STEPS = 2
+    AFTER_IDLE = 3
+
+    def __init__(self, redraw_function, mode=EVERY_STEP, interval=500, steps=10):
+        self.__redraw_function = redraw_function
+
+        self.set_parameters(mode, interval, steps)
+
+        self.__pending_steps = 0
+        self.__last_redraw_time = None
+
+        self.__timer = QTimer()
+        self.__timer.setSingleShot(True)
+        self.__timer.timeout.connect(self.__redraw)
+
+    def set_parameters(self, mode, interval, steps):
+        self.mode = mode
+        self.interval = max(0, int(interval))
+        self.steps = max(1, int(steps))
+
+    def has_pending_redraw(self):
+        return self.__pending_steps > 0
+
+    def request(self):
+        self.__pending_steps += 1
+
+        if self.mode == PlotRedrawScheduler.EVERY_STEP:
+            if not self.__timer.isActive(): self.__timer.start(0)
+        elif self.mode == PlotRedrawScheduler.THROTTLED:
+            if not self.__timer.isActive():
+                if self.__last_redraw_time is None:
+                    self.__timer.start(0)
+                else:
+                    elapsed = (time.monotonic() - self.__last_redraw_time)*1000
+
+                    self.__timer.start(int(max(0.0, self.interval - elapsed)))
+        elif self.mode == PlotRedrawScheduler.EVERY_K_STEPS:
+            self.__timer.start(0 if self.__pending_steps >= self.steps else self.interval)
+        elif self.mode == PlotRedrawScheduler.AFTER_IDLE:
+            self.__timer.start(self.interval)
+        else:
+            raise ValueError("Redraw mode not recognized: " + str(self.mode))
+
+    def flush(self):
+        self.__timer.stop()
+
+        if self.__pending_steps > 0: self.__redraw()
+
+    def cancel(self):
+        self.__timer.stop()
+        self.__pending_steps = 0
+
+    def __redraw(self):
+        self.__pending_steps = 0
+
+        try:
+            self.__redraw_function()
+        finally:
+            self.__last_redraw_time = time.monotonic()
+
 import h5py
 
 def write_histo_and_stats_file_hdf5(histo_data=HistogramDataCollection(),
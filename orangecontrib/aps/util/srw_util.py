@@ -0,0 +1,428 @@
+import os, json, hashlib, threading, multiprocessing, numpy
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+def transform_srw_array(output_array, mesh, dtype=numpy.float64):
+    """
+    converts the "flat" intensity array filled by srwl.CalcIntFromElecField (C-aligned, vertical
+    index running slower) into a 2D (nx, ny) array, together with the mesh coordinates
+
+    the SRW array('f') is read through the buffer protocol (no element-wise copy): with dtype=None
+    the returned intensity is a transposed view over the SRW buffer, otherwise it is converted
+    in a single vectorized step (float64 by default, as the historical loop did)
+    """
+    h_array = numpy.linspace(mesh.xStart, mesh.xFin, mesh.nx)
+    v_array = numpy.linspace(mesh.yStart, mesh.yFin, mesh.ny)
+
+    tot_len = int(mesh.ny * mesh.nx)
+
+    if isinstance(output_array, numpy.ndarray):
+        data = output_array.ravel()
+    else:
+        data = numpy.frombuffer(output_array, dtype=numpy.dtype(output_array.typecode))
+
+    if len(data) > tot_len:
+        data = data[0:tot_len]
+    elif len(data) < tot_len:
+        data = numpy.concatenate((data, numpy.zeros(tot_len - len(data), dtype=data.dtype)))
+
+    intensity_array = data.reshape(mesh.ny, mesh.nx).T
+
+    if not dtype is None: intensity_array = intensity_array.astype(dtype)
+
+    return h_array, v_array, intensity_array
+
+def calculate_srw_intensity(magnetic_field_container, wavefront, precision_parameters, optical_beamline=None):
+    """
+    SR electric field (optionally propagated) and single-electron/multi-electron intensity of a wavefront,
+    returned as a flat float32 numpy array together with the final mesh
+
+    module function: it can be executed in a process pool (all the SRW objects are picklable)
+    """
+    from oasys_srw.srwlib import srwl, array
+
+    srwl.CalcElecFieldSR(wavefront, 0, magnetic_field_container, precision_parameters)
+
+    if not optical_beamline is None: srwl.PropagElecField(wavefront, optical_beamline)
+
+    arI = array('f', [0]*wavefront.mesh.nx*wavefront.mesh.ny) #"flat" 2D array to take intensity data
+    srwl.CalcIntFromElecField(arI, wavefront, 6, 1, 3, wavefront.mesh.eStart, 0, 0)
+
+    return numpy.frombuffer(arI, dtype=numpy.float32).copy(), wavefront.mesh
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_srw_process_pool():
+    """
+    shared pool of processes for SRW calculations: SRW does not release the GIL consistently
+    inside its C calls, so threads cannot be used. Processes are spawned (not forked) to stay
+    safe with the Qt event loop running in the parent process
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+        return _process_pool
+
+def shutdown_srw_process_pool():
+    global _process_pool
+
+    with _process_pool_lock:
+        if not _process_pool is None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+class SRWResultsCache(object):
+    """
+    content-addressed cache of the results of SRW calculations (tuples of numpy arrays and numbers)
+
+    entries are kept in memory in LRU order, up to max_memory_size bytes, and optionally in a
+    directory on disk (one .npz file per key, oldest files removed beyond max_disk_size bytes)
+    """
+    def __init__(self, max_memory_size=512*1024**2, cache_directory=None, max_disk_size=4*1024**3):
+        self.max_memory_size = max_memory_size
+        self.cache_directory = cache_directory
+        self.max_disk_size = max_disk_size
+
+        self.__entries = OrderedDict()
+        self.__memory_size = 0
+        self.__lock = threading.RLock()
+
+    @classmethod
+    def get_key(cls, parameters):
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True, default=repr).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+
+                return self.__copy(self.__entries[key])
+
+        if not self.cache_directory is None:
+            file_name = self.__get_file_name(key)
+
+            if os.path.exists(file_name):
+                try:
+                    with numpy.load(file_name) as data:
+                        items = tuple([data["arr_" + str(index)] for index in range(len(data.files))])
+
+                    items = tuple([item.item() if item.ndim == 0 else item for item in items])
+
+                    os.utime(file_name)  # LRU on disk
+
+                    self.__put_in_memory(key, items)
+
+                    return self.__copy(items)
+                except Exception:
+                    pass # corrupted or partial file: treated as a miss
+
+        return None
+
+    def put(self, key, items):
+        items = self.__copy(items)
+
+        self.__put_in_memory(key, items)
+
+        if not self.cache_directory is None:
+            os.makedirs(self.cache_directory, exist_ok=True)
+
+            file_name = self.__get_file_name(key)
+            temp_file_name = file_name + "." + str(os.getpid()) + ".tmp.npz"
+
+            numpy.savez(temp_file_name, *items)
+            os.replace(temp_file_name, file_name)
+
+            self.__shrink_disk()
+
+    def clear(self, clear_disk=False):
+        with self.__lock:
+            self.__entries.clear()
+            self.__memory_size = 0
+
+        if clear_disk and not self.cache_directory is None and os.path.exists(self.cache_directory):
+            for file_name in self.__get_disk_files():
+                os.remove(file_name)
+
+    def __put_in_memory(self, key, items):
+        size = self.__get_size(items)
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__memory_size -= self.__get_size(self.__entries.pop(key))
+
+            if size > self.max_memory_size: return
+
+            self.__entries[key] = items
+            self.__memory_size += size
+
+            while self.__memory_size > self.max_memory_size:
+                _, removed = self.__entries.popitem(last=False)
+                self.__memory_size -= self.__get_size(removed)
+
+    def __shrink_disk(self):
+        files = sorted(self.__get_disk_files(), key=os.path.getmtime)
+        disk_size = sum([os.path.getsize(file_name) for file_name in files])
+
+        while disk_size > self.max_disk_size and len(files) > 1:
+            file_name = files.pop(0)
+            disk_size -= os.path.getsize(file_name)
+            os.remove(file_name)
+
+    def __get_disk_files(self):
+        return [os.path.join(self.cache_directory, file_name) for file_name in os.listdir(self.cache_directory)
+                if file_name.endswith(".npz") and not file_name.endswith(".tmp.npz")]
+
+    def __get_file_name(self, key):
+        return os.path.join(self.cache_directory, key + ".npz")
+
+    @classmethod
+    def __get_size(cls, items):
+        return sum([item.nbytes if isinstance(item, numpy.ndarray) else 8 for item in items])
+
+    @classmethod
+    def __copy(cls, items):
+        return tuple([item.copy() if isinstance(item, numpy.ndarray) else item for item in items])
+
+class SRWEnergyScanStore(object):
+    """
+    memory-mapped store of the SRW distributions of all the energies of a scan, precomputed
+    for a fixed set of the other SRW parameters (identified by key)
+
+    every field is a .npy file holding a stack of arrays (energy index first), opened with
+    numpy memmaps: reading the distributions of one energy only touches its slice
+    """
+    FIELDS = ["x", "z", "intensity_source_dimension", "x_first", "z_first", "intensity_angular_distribution", "integrated_flux"]
+    HEADER_FILE = "header.json"
+
+    def __init__(self, directory, key, energies):
+        self.directory = directory
+        self.key = key
+        self.energies = numpy.array(energies, dtype=numpy.float64)
+
+        self.__arrays = None
+        self.__completed = numpy.zeros(len(self.energies), dtype=bool)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        for field in SRWEnergyScanStore.FIELDS:
+            if os.path.exists(self.__get_file_name(field)): os.remove(self.__get_file_name(field))
+
+        with open(os.path.join(self.directory, SRWEnergyScanStore.HEADER_FILE), "w") as header_file:
+            json.dump({"key" : self.key, "energies" : self.energies.tolist()}, header_file)
+
+    def get_energy_index(self, energy):
+        indexes = numpy.where(numpy.isclose(self.energies, energy, rtol=0.0, atol=1e-6))[0]
+
+        return None if len(indexes) == 0 else int(indexes[0])
+
+    def contains(self, key, energy):
+        if key != self.key: return False
+
+        index = self.get_energy_index(energy)
+
+        return not index is None and bool(self.__completed[index])
+
+    def put(self, energy, items):
+        index = self.get_energy_index(energy)
+
+        if index is None: raise ValueError("Energy " + str(energy) + " is not part of the scan")
+
+        if self.__arrays is None: self.__allocate(items)
+
+        for field, item in zip(SRWEnergyScanStore.FIELDS, items):
+            if numpy.shape(item) != self.__arrays[field].shape[1:]:
+                raise ValueError("SRW distributions at " + str(energy) + " eV have a different mesh: they cannot be stored")
+
+            self.__arrays[field][index] = item
+
+        self.__completed[index] = True
+
+    def get(self, energy):
+        index = self.get_energy_index(energy)
+
+        if index is None or not self.__completed[index]: return None
+
+        items = [numpy.array(self.__arrays[field][index], dtype=numpy.float64) for field in SRWEnergyScanStore.FIELDS]
+        items[-1] = float(items[-1])
+
+        return tuple(items)
+
+    def flush(self):
+        if not self.__arrays is None:
+            for array in self.__arrays.values(): array.flush()
+
+    def __allocate(self, items):
+        self.__arrays = {}
+
+        for field, item in zip(SRWEnergyScanStore.FIELDS, items):
+            self.__arrays[field] = numpy.lib.format.open_memmap(self.__get_file_name(field),
+                                                                mode="w+",
+                                                                dtype=numpy.float32 if field.startswith("intensity") else numpy.float64,
+                                                                shape=(len(self.energies),) + numpy.shape(item))
+
+    def __get_file_name(self, field):
+        return os.path.join(self.directory, field + ".npy")
+
+class SRWDistributionsFile(object):
+    """
+    binary container of the distributions of the undulator computed by SRW, for libraries of precomputed sources: a
+    directory with the source dimension and the angular distribution maps (.npy, float32 as computed by SRW) and a
+    JSON header with the meshes, the integrated flux and the parameters of the calculation
+
+    maps are read as read-only numpy memmaps: opening a source does not read its maps
+    """
+    FIELDS = ["intensity_source_dimension", "intensity_angular_distribution"]
+    MESHES = ["x", "z", "x_first", "z_first"]
+    HEADER_FILE = "header.json"
+    VERSION = 1
+
+    @classmethod
+    def write(cls, directory, x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, integrated_flux, parameters=None):
+        os.makedirs(directory, exist_ok=True)
+
+        for field, intensity, (h_array, v_array) in zip(SRWDistributionsFile.FIELDS,
+                                                        [intensity_source_dimension, intensity_angular_distribution],
+                                                        [(x, z), (x_first, z_first)]):
+            if numpy.shape(intensity) != (len(h_array), len(v_array)):
+                raise ValueError("Shape of " + field + " " + str(numpy.shape(intensity)) + " is not compatible with its mesh " + str((len(h_array), len(v_array))))
+
+            cls.__replace(cls.__get_file_name(directory, field), lambda file_name: numpy.save(file_name, numpy.asarray(intensity, dtype=numpy.float32)))
+
+        header = {"version" : SRWDistributionsFile.VERSION,
+                  "integrated_flux" : float(integrated_flux),
+                  "parameters" : {} if parameters is None else json.loads(json.dumps(parameters, default=repr))}
+
+        for mesh, array in zip(SRWDistributionsFile.MESHES, [x, z, x_first, z_first]): header[mesh] = numpy.asarray(array, dtype=numpy.float64).tolist()
+
+        def write_header(file_name):
+            with open(file_name, "w") as header_file: json.dump(header, header_file)
+
+        cls.__replace(os.path.join(directory, SRWDistributionsFile.HEADER_FILE), write_header) # last: the container is complete
+
+    @classmethod
+    def read(cls, directory):
+        """
+        returns x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, integrated_flux
+        (meshes in m and rad)
+        """
+        header = cls.read_header(directory)
+
+        x, z, x_first, z_first = [numpy.array(header[mesh], dtype=numpy.float64) for mesh in SRWDistributionsFile.MESHES]
+
+        intensity_source_dimension, intensity_angular_distribution = [numpy.load(cls.__get_file_name(directory, field), mmap_mode="r") for field in SRWDistributionsFile.FIELDS]
+
+        return x, z, intensity_source_dimension, x_first, z_first, intensity_angular_distribution, header["integrated_flux"]
+
+    @classmethod
+    def read_header(cls, directory):
+        with open(os.path.join(directory, SRWDistributionsFile.HEADER_FILE), "r") as header_file:
+            header = json.load(header_file)
+
+        if header.get("version", None) != SRWDistributionsFile.VERSION: raise ValueError("Version of the SRW distributions in " + str(directory) + " not recognized: " + str(header.get("version", None)))
+
+        return header
+
+    @classmethod
+    def __get_file_name(cls, directory, field):
+        return os.path.join(directory, field + ".npy")
+
+    @classmethod
+    def __replace(cls, file_name, write):
+        temp_file_name = file_name + "." + str(os.getpid()) + ".tmp" + os.path.splitext(file_name)[1] # same extension: numpy.save does not add it
+
+        write(temp_file_name)
+
+        os.replace(temp_file_name, file_name)
+
+SRW_INTENSITY_FILE_HEADER_LINES = 11
+
+def load_srw_intensity_file(file_name, read_labels=True, use_sidecar_cache=True):
+    """
+    reads an ASCII intensity file saved by SRW (srwl_uti_save_intens_ascii): returns the flat (C-aligned) data,
+    the ranges (e0, e1, ne, x0, x1, nx, y0, y1, ny), the labels and the units
+
+    the header is parsed once, then the body is read at once by the C parser of numpy and checked against the size
+    declared in the header. With use_sidecar_cache, the result is also saved in a binary file next to the ASCII one
+    (<file_name>.cache.npz, valid while size and modification time of the ASCII file do not change): reloading
+    the same file only reads the binary one
+    """
+    cache_file_name = str(file_name) + ".cache.npz"
+    file_stat       = os.stat(file_name)
+
+    if use_sidecar_cache and os.path.exists(cache_file_name):
+        try:
+            with numpy.load(cache_file_name) as cache:
+                if int(cache["size"]) == file_stat.st_size and int(cache["mtime_ns"]) == file_stat.st_mtime_ns:
+                    allrange = tuple([int(value) if index in [2, 5, 8] else float(value) for index, value in enumerate(cache["allrange"])])
+
+                    return cache["data"], allrange, [str(label) for label in cache["labels"]], [str(unit) for unit in cache["units"]]
+        except Exception:
+            pass # corrupted or old cache: the ASCII file is read again
+
+    with open(file_name, "rb") as file:
+        header = []
+
+        for _ in range(SRW_INTENSITY_FILE_HEADER_LINES):
+            position = file.tell()
+            line     = file.readline().decode("utf-8")
+
+            if line.startswith("#"):
+                header.append(line)
+            else: # no number of components: first line of data
+                file.seek(position)
+                break
+
+        if len(header) < SRW_INTENSITY_FILE_HEADER_LINES - 1: raise ValueError("File " + str(file_name) + " is not an SRW intensity file: header not recognized")
+
+        ne, nx, ny = [int(header[i].replace('#','').split()[0]) for i in [3, 6, 9]]
+        ns = int(header[10].replace('#','').split()[0]) if len(header) == SRW_INTENSITY_FILE_HEADER_LINES else 1
+
+        e0, e1, x0, x1, y0, y1 = [float(header[i].replace('#','').split()[0]) for i in [1, 2, 4, 5, 7, 8]]
+
+        number_of_values = ne*nx*ny*ns
+
+        # stops at the end of the file or at the first value that is not a number: a shorter array is a truncated file
+        data = numpy.fromfile(file, dtype=numpy.float64, count=number_of_values, sep=" ")
+
+    if len(data) < number_of_values: raise ValueError("File " + str(file_name) + " is truncated: " + str(len(data)) + " values found, " + str(number_of_values) + " expected")
+
+    allrange = e0, e1, ne, x0, x1, nx, y0, y1, ny
+    labels, units = _get_srw_intensity_file_labels(header, read_labels)
+
+    if use_sidecar_cache:
+        try:
+            temp_file_name = cache_file_name + "." + str(os.getpid()) + ".tmp.npz"
+
+            numpy.savez(temp_file_name,
+                        data=data,
+                        allrange=numpy.array(allrange, dtype=numpy.float64),
+                        labels=numpy.array(labels),
+                        units=numpy.array(units),
+                        size=file_stat.st_size,
+                        mtime_ns=file_stat.st_mtime_ns)
+            os.replace(temp_file_name, cache_file_name)
+        except Exception:
+            pass # e.g. read-only directory: the cache is optional
+
+    return data, allrange, labels, units
+
+def _get_srw_intensity_file_labels(header, read_labels):
+    labels = ['Photon Energy', 'Horizontal Position', 'Vertical Position', 'Intensity']
+    units  = ['eV', 'm', 'm', 'ph/s/.1%bw/mm^2']
+
+    if read_labels:
+        tokens    = header[0].split(' [')
+        labels[3] = tokens[0].replace('#','')
+        units[3]  = ''
+        if len(tokens) > 1: units[3] = tokens[1].split('] ')[0]
+
+        for i in range(3):
+            tokens    = header[i*3 + 1].split()
+            labels[i] = ' '.join(tokens[2:len(tokens) - 1])
+            units[i]  = tokens[len(tokens) - 1].replace('[','').replace(']','')
+
+    return labels, units
@@ -0,0 +1,93 @@
+import numpy, pytest
+
+from orangecontrib.aps.util.accumulator import PowerDensityAccumulator
+
+def get_power_densities(number_of_steps, shape=(4, 3)):
+    random = numpy.random.default_rng(0)
+
+    return [random.random(shape) for _ in range(number_of_steps)]
+
+def test_add():
+    accumulator = PowerDensityAccumulator(initial_capacity=2) # records grown beyond the initial capacity
+    power_densities = get_power_densities(5)
+
+    for index, power_density in enumerate(power_densities):
+        accumulator.add(power_density, energy_max=100.0*index, total_power=1.0)
+
+    assert accumulator.number_of_steps == 5
+    assert accumulator.shape == (4, 3)
+    assert numpy.allclose(accumulator.get_power_density(), numpy.sum(power_densities, axis=0))
+    assert numpy.array_equal(accumulator.get_records("energy_max"), [0.0, 100.0, 200.0, 300.0, 400.0])
+    assert accumulator.get_total("total_power") == 5.0
+
+def test_undo_and_add_again():
+    accumulator = PowerDensityAccumulator()
+    power_densities = get_power_densities(4)
+
+    for index, power_density in enumerate(power_densities[:3]):
+        accumulator.add(power_density, energy_max=float(index), total_power=float(index + 1))
+
+    accumulator.undo()
+
+    assert not accumulator.can_undo()
+    assert accumulator.number_of_steps == 2
+    assert numpy.allclose(accumulator.get_power_density(), power_densities[0] + power_densities[1])
+    assert numpy.array_equal(accumulator.get_records("energy_max"), [0.0, 1.0])
+    assert accumulator.get_total("total_power") == 3.0
+
+    with pytest.raises(ValueError): accumulator.undo()
+
+    accumulator.add(power_densities[3], energy_max=5.0, total_power=10.0)
+
+    assert accumulator.can_undo()
+    assert accumulator.number_of_steps == 3
+    assert numpy.allclose(accumulator.get_power_density(), power_densities[0] + power_densities[1] + power_densities[3])
+    assert numpy.array_equal(accumulator.get_records("energy_max"), [0.0, 1.0, 5.0])
+    assert accumulator.get_total("total_power") == 13.0
+
+def test_undo_empty_step():
+    accumulator = PowerDensityAccumulator()
+    power_densities = get_power_densities(1)
+
+    accumulator.add(power_densities[0], power_plot=2.0, energy_max=1.0)
+    accumulator.add(numpy.zeros((4, 3)), power_plot=0.0, energy_max=2.0) # empty beam
+
+    accumulator.undo()
+
+    assert numpy.allclose(accumulator.get_power_density(), power_densities[0])
+    assert numpy.array_equal(accumulator.get_records("energy_max"), [1.0])
+    assert accumulator.get_total("power_plot") == 2.0
+
+def test_undo_first_step():
+    accumulator = PowerDensityAccumulator()
+
+    accumulator.add(numpy.ones((4, 3)), energy_max=1.0)
+    accumulator.undo()
+
+    assert accumulator.number_of_steps == 0
+    assert accumulator.get_power_density() is None
+    assert len(accumulator.get_records("energy_max")) == 0
+
+    accumulator.add(numpy.full((4, 3), 2.0), energy_max=2.0)
+
+    assert numpy.array_equal(accumulator.get_power_density(), numpy.full((4, 3), 2.0))
+    assert numpy.array_equal(accumulator.get_records("energy_max"), [2.0])
+
+def test_missing_records_and_read_only_views():
+    accumulator = PowerDensityAccumulator()
+
+    accumulator.add(numpy.ones((2, 2)))
+    accumulator.add(numpy.ones((2, 2)), power_plot=1.0)
+
+    assert numpy.isnan(accumulator.get_records("power_plot")[0])
+    assert accumulator.get_records("power_plot")[1] == 1.0
+
+    with pytest.raises(ValueError): accumulator.get_power_density()[0, 0] = 0.0
+    with pytest.raises(ValueError): accumulator.get_records("power_plot")[0] = 0.0
+
+def test_wrong_shape():
+    accumulator = PowerDensityAccumulator()
+
+    accumulator.add(numpy.ones((2, 2)))
+
+    with pytest.raises(ValueError): accumulator.add(numpy.ones((3, 2)))
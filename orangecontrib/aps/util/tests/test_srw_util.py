@@ -0,0 +1,102 @@
+from array import array
+from types import SimpleNamespace
+
+import numpy, pytest
+
+from orangecontrib.aps.util.srw_util import transform_srw_array, load_srw_intensity_file
+
+def old_transform_srw_array(output_array, mesh):
+    # element-wise loop of APSUndulator.transform_srw_array before the vectorization (srw_array is array.array)
+    h_array = numpy.linspace(mesh.xStart, mesh.xFin, mesh.nx)
+    v_array = numpy.linspace(mesh.yStart, mesh.yFin, mesh.ny)
+
+    intensity_array = numpy.zeros((h_array.size, v_array.size))
+
+    tot_len = int(mesh.ny * mesh.nx)
+    len_output_array = len(output_array)
+
+    if len_output_array > tot_len:
+        output_array = numpy.array(output_array[0:tot_len])
+    elif len_output_array < tot_len:
+        aux_array = array('d', [0] * len_output_array)
+        for i in range(len_output_array): aux_array[i] = output_array[i]
+        output_array = numpy.array(array('d', aux_array))
+    else:
+        output_array = numpy.array(output_array)
+
+    output_array = output_array.reshape(mesh.ny, mesh.nx)
+
+    for ix in range(mesh.nx):
+        for iy in range(mesh.ny):
+            intensity_array[ix, iy] = output_array[iy, ix]
+
+    return h_array, v_array, intensity_array
+
+def get_mesh(nx=7, ny=5):
+    return SimpleNamespace(xStart=-1e-3, xFin=2e-3, nx=nx, yStart=-5e-4, yFin=5e-4, ny=ny)
+
+def get_srw_array(length):
+    return array('f', numpy.random.default_rng(0).random(length).astype(numpy.float32))
+
+@pytest.mark.parametrize("extra", [0, 3])
+def test_transform_srw_array_same_as_loop(extra):
+    mesh = get_mesh()
+    output_array = get_srw_array(mesh.nx*mesh.ny + extra)
+
+    h_array, v_array, intensity_array = transform_srw_array(output_array, mesh)
+    old_h_array, old_v_array, old_intensity_array = old_transform_srw_array(output_array, mesh)
+
+    assert intensity_array.dtype == numpy.float64
+    assert numpy.array_equal(h_array, old_h_array)
+    assert numpy.array_equal(v_array, old_v_array)
+    assert numpy.array_equal(intensity_array, old_intensity_array)
+
+def test_transform_srw_array_view():
+    mesh = get_mesh()
+    output_array = get_srw_array(mesh.nx*mesh.ny)
+
+    _, _, intensity_array = transform_srw_array(output_array, mesh, dtype=None)
+
+    assert intensity_array.dtype == numpy.float32
+    assert numpy.array_equal(intensity_array, old_transform_srw_array(output_array, mesh)[2])
+
+def test_transform_srw_array_short_output():
+    mesh = get_mesh()
+    output_array = get_srw_array(mesh.nx*mesh.ny - 4)
+
+    # the old padding kept the length of the output array: reshape failed
+    with pytest.raises(ValueError): old_transform_srw_array(output_array, mesh)
+
+    _, _, intensity_array = transform_srw_array(output_array, mesh)
+
+    padded_array = array('f', output_array.tolist() + [0.0]*4)
+
+    assert numpy.array_equal(intensity_array, old_transform_srw_array(padded_array, mesh)[2])
+
+def write_srw_intensity_file(file_name, values, nx=4, ny=3):
+    with open(file_name, "w") as file:
+        file.write("#C-aligned Intensity (inner loop is vs photon energy, outer loop vs vertical position) [ph/s/.1%bw/mm^2] \n")
+        file.write("#1000.0 #Initial Photon Energy [eV]\n#1000.0 #Final Photon Energy [eV]\n#1 #Number of points vs Photon Energy\n")
+        file.write("#-0.001 #Initial Horizontal Position [m]\n#0.001 #Final Horizontal Position [m]\n#" + str(nx) + " #Number of points vs Horizontal Position [m]\n")
+        file.write("#-0.002 #Initial Vertical Position [m]\n#0.002 #Final Vertical Position [m]\n#" + str(ny) + " #Number of points vs Vertical Position [m]\n")
+        file.write("#1 #Number of components\n")
+        file.write("\n".join([str(value) for value in values]) + "\n")
+
+def test_load_srw_intensity_file(tmp_path):
+    file_name = str(tmp_path / "intensity.dat")
+    values = numpy.arange(12, dtype=numpy.float64)*0.5
+
+    write_srw_intensity_file(file_name, values)
+
+    data, allrange, _, _ = load_srw_intensity_file(file_name, use_sidecar_cache=False)
+
+    assert numpy.array_equal(data, values)
+    assert allrange == (1000.0, 1000.0, 1, -0.001, 0.001, 4, -0.002, 0.002, 3)
+
+@pytest.mark.parametrize("values", [list(range(10)), list(range(6)) + ["abc"] + list(range(5))])
+def test_load_srw_intensity_file_truncated(tmp_path, values):
+    file_name = str(tmp_path / "intensity.dat")
+
+    write_srw_intensity_file(file_name, values)
+
+    with pytest.raises(ValueError): load_srw_intensity_file(file_name, use_sidecar_cache=False)